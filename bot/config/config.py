@@ -20,15 +20,85 @@ class Settings(BaseSettings):
     MAX_ENERGY_LEVEL: int = 5
     AUTO_UPGRADE_CHARGE: bool = True
     MAX_CHARGE_LEVEL: int = 3
+    UPGRADE_PAYBACK_HOURS: float = 168
 
     APPLY_DAILY_ENERGY: bool = True
     APPLY_DAILY_TURBO: bool = True
     AUTO_SPIN: bool = True
 
     RANDOM_TAPS_COUNT: list[int] = [50, 200]
+    USE_ENERGY_MODEL: bool = False
     SLEEP_BETWEEN_TAP: list[int] = [15, 25]
 
+    GRAPHQL_URL: str = 'https://api-gw-tg.memefi.club/graphql'
+    GRAPHQL_SLIM_QUERIES: bool = False
+    GRAPHQL_PERSISTED_QUERIES: bool = False
+
+    FAST_MODE: bool = False
+
+    REQUESTS_PER_SECOND: float = 2
+    REQUESTS_BURST: int = 5
+    USE_BATCH_REQUESTS: bool = False
+    EGRESS_INITIAL_RATE: float = 20
+    EGRESS_MIN_RATE: float = 0.5
+    EGRESS_MAX_RATE: float = 200
+    EGRESS_RATE_INCREASE: float = 5
+
+    RETRY_ATTEMPTS: int = 3
+    RETRY_BASE_DELAY: float = 2
+    RETRY_MAX_DELAY: float = 60
+    RETRY_BUDGET_RATIO: float = 0.1
+    BREAKER_THRESHOLD: int = 5
+    ENDPOINT_BREAKER_THRESHOLD: int = 50
+    BREAKER_RESET_TIMEOUT: float = 30
+    BREAKER_MAX_TIMEOUT: float = 600
+
+    TOKEN_REFRESH_MARGIN: int = 300
+    REGISTRY_FLUSH_INTERVAL: float = 5
+
+    TG_MAX_CONNECTIONS: int = 20
+    TG_IDLE_TIMEOUT: int = 60
+
+    STARTUP_BATCH_SIZE: int = 50
+    SESSION_CHECK_CONCURRENCY: int = 32
+
+    SETTINGS_OVERRIDES_FILE: str = 'session_settings.toml'
+    SETTINGS_RELOAD_INTERVAL: float = 10
+
+    USE_SCHEDULER: bool = False
+    SCHEDULER_WORKERS: int = 50
+
+    CONNECTOR_LIMIT: int = 100
+    CONNECTOR_LIMIT_PER_HOST: int = 0
+    CONNECTOR_KEEPALIVE_TIMEOUT: int = 30
+    CONNECTOR_DNS_CACHE_TTL: int = 300
+
+    LOG_LEVEL: str = 'INFO'
+    LOG_SESSION_LEVEL: str = ''
+    LOG_SESSION_LEVELS: dict[str, str] = {}
+    LOG_ENQUEUE: bool = True
+    LOG_JSON_FILE: str = ''
+    LOG_SUMMARY_INTERVAL: float = 0
+
+    METRICS_ENABLED: bool = False
+    METRICS_HOST: str = '127.0.0.1'
+    METRICS_PORT: int = 9100
+
+    LOOP_LAG_INTERVAL: float = 0.5
+    LOOP_LAG_THRESHOLD: float = 0.5
+    SLOW_CALLBACK_DURATION: float = 0
+    PROFILE_SECONDS: int = 30
+    PROFILE_INTERVAL: float = 0.005
+    PROFILES_DIR: str = 'profiles'
+    CASSETTE_DIR: str = ''
+    CASSETTE_SESSIONS: list[str] = []
+
     USE_PROXY_FROM_FILE: bool = False
+    PROXY_CHECK_URL: str = 'https://api.ipify.org?format=json'
+    PROXY_CHECK_TIMEOUT: float = 10
+    PROXY_CHECK_INTERVAL: float = 300
+    PROXY_CHECK_CONCURRENCY: int = 50
+    PROXY_MAX_FAILURES: int = 3
     AUTO_GENERATE_USER_AGENT_FOR_EACH_SESSION: bool =True
 
 settings = Settings()
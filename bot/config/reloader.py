@@ -0,0 +1,158 @@
+import os
+import json
+import asyncio
+import tomllib
+from fnmatch import fnmatchcase
+from typing import Callable
+
+from pydantic import ValidationError
+
+from bot.config.config import Settings, settings
+from bot.utils.logger import logger
+
+
+# Read once at startup (connection pools, log sinks, background tasks), changes wait for a restart
+RESTART_KEYS = frozenset({
+    'API_ID', 'API_HASH', 'GRAPHQL_URL', 'FAST_MODE', 'AUTO_GENERATE_USER_AGENT_FOR_EACH_SESSION',
+    'TG_MAX_CONNECTIONS', 'TG_IDLE_TIMEOUT', 'STARTUP_BATCH_SIZE', 'SESSION_CHECK_CONCURRENCY',
+    'SETTINGS_RELOAD_INTERVAL', 'REGISTRY_FLUSH_INTERVAL', 'USE_SCHEDULER', 'SCHEDULER_WORKERS',
+    'CONNECTOR_LIMIT', 'CONNECTOR_LIMIT_PER_HOST', 'CONNECTOR_KEEPALIVE_TIMEOUT', 'CONNECTOR_DNS_CACHE_TTL',
+    'LOG_LEVEL', 'LOG_SESSION_LEVEL', 'LOG_SESSION_LEVELS', 'LOG_ENQUEUE', 'LOG_JSON_FILE', 'LOG_SUMMARY_INTERVAL',
+    'METRICS_ENABLED', 'METRICS_HOST', 'METRICS_PORT', 'LOOP_LAG_INTERVAL', 'LOOP_LAG_THRESHOLD',
+    'SLOW_CALLBACK_DURATION', 'PROFILE_SECONDS', 'PROFILE_INTERVAL', 'PROFILES_DIR', 'CASSETTE_DIR',
+    'CASSETTE_SESSIONS', 'USE_PROXY_FROM_FILE', 'PROXY_CHECK_INTERVAL',
+})
+
+# Shared by every session of the process, they can't be overridden per session
+PROCESS_KEYS = frozenset({
+    'EGRESS_INITIAL_RATE', 'EGRESS_MIN_RATE', 'EGRESS_MAX_RATE', 'EGRESS_RATE_INCREASE',
+    'RETRY_BUDGET_RATIO', 'ENDPOINT_BREAKER_THRESHOLD',
+})
+
+
+def read_overrides(path: str) -> dict[str, dict]:
+    """Session name patterns mapped to setting values, from a TOML, YAML or JSON file."""
+    if not path or not os.path.exists(path):
+        return {}
+
+    with open(path, 'rb') as file:
+        if path.endswith('.toml'):
+            data = tomllib.load(file)
+        elif path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError(f"{path} is a YAML file, install PyYAML (pip install pyyaml) or use TOML or JSON")
+            try:
+                data = yaml.safe_load(file) or {}
+            except yaml.YAMLError as error:
+                raise ValueError(f"{path} is not valid YAML: {error}")
+        else:
+            data = json.load(file)
+
+    if not isinstance(data, dict) or not all(isinstance(values, dict) for values in data.values()):
+        raise ValueError(f"{path} must map session names or patterns to tables of settings")
+
+    return data
+
+
+class SettingsReloader:
+    """Re-reads `.env` and the SETTINGS_OVERRIDES_FILE every SETTINGS_RELOAD_INTERVAL seconds
+    when either changed.
+
+    Keys that changed in the files are validated and applied to the shared `settings` in one
+    go; an invalid file is logged and the previous settings stay in use. Overrides map session
+    names or glob patterns (`farm-*`) to settings, later entries win, and `for_session` returns
+    the settings a session's next step runs with. Sessions apply them when `generation` moves,
+    process-wide limiters and breakers through the listeners. RESTART_KEYS are only logged."""
+
+    def __init__(self, env_file: str = '.env'):
+        self.env_file = env_file
+        self.loaded = settings.model_copy()
+        self.overrides: list[tuple[str, dict]] = []
+        self.sessions: dict[str, Settings] = {}
+        self.mtimes = self.get_mtimes()
+        self.generation = 0
+        self.listeners: list[Callable[[Settings], None]] = []
+
+    def add_listener(self, listener: Callable[[Settings], None]) -> None:
+        """`listener` is called with the base settings after every reload."""
+        self.listeners.append(listener)
+
+    def get_mtimes(self) -> tuple[float | None, ...]:
+        return tuple(os.path.getmtime(path) if path and os.path.exists(path) else None
+                     for path in (self.env_file, settings.SETTINGS_OVERRIDES_FILE))
+
+    def load_overrides(self, loaded: Settings) -> list[tuple[str, dict]]:
+        overrides = []
+        for pattern, values in read_overrides(loaded.SETTINGS_OVERRIDES_FILE).items():
+            # Validated against the base settings, so a typo fails the reload rather than a session
+            validated = Settings(**{**loaded.model_dump(), **values})
+            ignored = PROCESS_KEYS & set(values)
+            if ignored:
+                logger.warning(f"Ignoring {', '.join(sorted(ignored))} for <y>{pattern}</y> in "
+                               f"<e>{loaded.SETTINGS_OVERRIDES_FILE}</e>: process-wide settings can't be "
+                               f"overridden per session")
+            overrides.append((pattern, validated.model_dump(include=set(values) - ignored)))
+        return overrides
+
+    def load(self) -> None:
+        self.overrides = self.load_overrides(settings)
+        self.sessions.clear()
+
+    def reload(self) -> bool:
+        """Applies the changed settings, returns False when the files are invalid."""
+        try:
+            loaded = Settings()
+            overrides = self.load_overrides(loaded)
+        except (ValidationError, ValueError, OSError) as error:
+            # Without colors, so markup-like text in the validation errors isn't parsed
+            logger.opt(colors=False).error(f"Settings not reloaded, keeping the current ones: {error}")
+            return False
+
+        previous, current = self.loaded.model_dump(), loaded.model_dump()
+        changed = {key: value for key, value in current.items() if previous[key] != value}
+        applied = {key: value for key, value in changed.items() if key not in RESTART_KEYS}
+        self.loaded = loaded
+
+        settings.__dict__.update(applied)
+        self.overrides = overrides
+        self.sessions.clear()
+        self.generation += 1
+        for listener in self.listeners:
+            listener(settings)
+
+        logger.info(f"Settings reloaded | {', '.join(applied) or 'no changes'} | "
+                    f"{len(overrides)} session overrides")
+        if len(applied) < len(changed):
+            logger.warning(f"Restart to apply {', '.join(key for key in changed if key in RESTART_KEYS)}")
+        return True
+
+    def for_session(self, session_name: str) -> Settings:
+        cached = self.sessions.get(session_name)
+        if cached is not None:
+            return cached
+
+        values = {}
+        for pattern, override in self.overrides:
+            if fnmatchcase(session_name, pattern):
+                values.update(override)
+
+        # A snapshot, `reload` updates the shared settings in place while steps may be running
+        session_settings = self.sessions[session_name] = settings.model_copy(update=values)
+        return session_settings
+
+    async def run(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            mtimes = self.get_mtimes()
+            if mtimes != self.mtimes:
+                self.mtimes = mtimes
+                try:
+                    self.reload()
+                except Exception as error:
+                    # The watcher keeps running, a later fix to the files is still picked up
+                    logger.opt(exception=error).error(f"Settings not reloaded, keeping the current ones: {error}")
+
+
+settings_reloader = SettingsReloader()
@@ -11,6 +11,15 @@ class CustomTLSContext:
         "TLS_AES_128_CCM_SHA256", "TLS_AES_256_CCM_8_SHA256"
     ]
 
+    _shared_context = None
+
+    @classmethod
+    def get_shared_ssl_context(cls):
+        """Returns one SSL context for the whole process."""
+        if cls._shared_context is None:
+            cls._shared_context = cls.create_custom_ssl_context()
+        return cls._shared_context
+
     @classmethod
     def create_custom_ssl_context(cls):
         ssl_context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
@@ -0,0 +1,426 @@
+import json
+import asyncio
+from time import monotonic
+from dataclasses import dataclass
+
+import aiohttp
+
+from bot.config import settings
+from bot.config.config import Settings
+from bot.utils import logger, metrics, fast
+from bot.utils.graphql import Query, SlimQuery, OperationName, persisted_query_hash
+from bot.utils.retry import (CircuitBreaker, get_endpoint_breaker, get_retry_budget, get_retry_policy, jitter,
+                             retries_total)
+
+
+# Callables invoked as observer(session_name, operation, latency, status) after every request
+request_observers: list = []
+
+PERSISTED_QUERY_NOT_FOUND = ('PersistedQueryNotFound', 'PERSISTED_QUERY_NOT_FOUND')
+PERSISTED_QUERY_NOT_SUPPORTED = ('PersistedQueryNotSupported', 'PERSISTED_QUERY_NOT_SUPPORTED')
+# Retry delays up to this many seconds are slept in place, longer ones park the session
+# so `Tapper.step` returns them to the scheduler
+MAX_RETRY_SLEEP = 2
+# Lowercase fragments of the GraphQL error returned when the balance doesn't cover a purchase
+INSUFFICIENT_BALANCE_ERRORS = ('not enough', 'insufficient')
+
+
+@dataclass
+class OperationStats:
+    calls: int = 0
+    errors: int = 0
+    rate_limited: int = 0
+    total_latency: float = 0.0
+
+    def record(self, latency: float, failed: bool = False) -> None:
+        self.calls += 1
+        self.total_latency += latency
+        if failed:
+            self.errors += 1
+
+    @property
+    def avg_latency(self) -> float:
+        return self.total_latency / self.calls if self.calls else 0.0
+
+
+def parse_retry_after(value: str | None, default: float = 60) -> float:
+    try:
+        return max(float(value), 0)
+    except (TypeError, ValueError):
+        return default
+
+
+def get_persisted_query_error(response_json: dict | None) -> str | None:
+    """Returns the message or code of an automatic persisted query error in the response, if any."""
+    if not isinstance(response_json, dict):
+        return None
+
+    for error in response_json.get('errors') or []:
+        if not isinstance(error, dict):
+            continue
+        for value in (error.get('message'), (error.get('extensions') or {}).get('code')):
+            if value in PERSISTED_QUERY_NOT_FOUND or value in PERSISTED_QUERY_NOT_SUPPORTED:
+                return value
+
+    return None
+
+
+def get_error_messages(errors: list | None) -> list[str]:
+    return [str(error.get('message') if isinstance(error, dict) else error) for error in errors or []]
+
+
+def is_insufficient_balance(messages: list[str]) -> bool:
+    return any(fragment in message.lower() for message in messages for fragment in INSUFFICIENT_BALANCE_ERRORS)
+
+
+class RetryableError(Exception):
+    """A failed request worth retrying. `processed` is False when the server can't have
+    applied it, so even non-idempotent mutations may be resent."""
+
+    def __init__(self, message: str, retry_after: float | None = None, processed: bool = True):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.processed = processed
+
+
+class GraphQLClient:
+    """Single transport for every GraphQL operation of a session.
+
+    Builds the payload from `Query`/`OperationName`, waits on the limiter,
+    decodes the response and classifies errors in one place.
+
+    With `slim_queries` the trimmed `SlimQuery` documents are sent where one exists.
+    With `persisted_queries` a query is sent in full once together with its sha256 hash
+    and by hash only afterwards, falling back to the full text on `PersistedQueryNotFound`."""
+
+    def __init__(self, http_client: aiohttp.ClientSession, session_name: str,
+                 url: str | None = None, limiter=None, egress_limiter=None, batching: bool = False,
+                 slim_queries: bool = False, persisted_queries: bool = False, settings: Settings = settings):
+        self.http_client = http_client
+        self.session_name = session_name
+        self.url = url or settings.GRAPHQL_URL
+        self.limiter = limiter
+        self.egress_limiter = egress_limiter
+        # Orders this session's requests in the egress limiter, see `AdaptiveLimiter`
+        self.step_started_at = 0.0
+        self.batching = batching
+        self.slim_queries = slim_queries
+        self.persisted_queries = persisted_queries
+        self.registered_queries: set[str] = set()
+        # Hash-only requests that failed with an unrecognized error and were resent with the full query
+        self.suspected_queries: set[str] = set()
+        self.persisted_query_misses = 0
+        self.unauthorized = False
+        self.stats: dict[str, OperationStats] = {}
+
+        # Retries and the session breaker, the session's own settings when it has overrides
+        self.settings = settings
+        self.breaker = CircuitBreaker(name=session_name, scope='session', threshold=settings.BREAKER_THRESHOLD,
+                                      reset_timeout=settings.BREAKER_RESET_TIMEOUT,
+                                      max_timeout=settings.BREAKER_MAX_TIMEOUT)
+        self.endpoint_breaker = get_endpoint_breaker(self.url)
+        self.retry_after_until = 0.0
+
+    def configure(self, session_settings: Settings) -> None:
+        """Applies reloaded settings. Batching and persisted queries turned off after the server
+        rejected them are only turned on again when their setting changes."""
+        previous, self.settings = self.settings, session_settings
+        if session_settings.USE_BATCH_REQUESTS != previous.USE_BATCH_REQUESTS:
+            self.batching = session_settings.USE_BATCH_REQUESTS
+        if session_settings.GRAPHQL_PERSISTED_QUERIES != previous.GRAPHQL_PERSISTED_QUERIES:
+            self.persisted_queries = session_settings.GRAPHQL_PERSISTED_QUERIES
+            self.persisted_query_misses = 0
+        self.slim_queries = session_settings.GRAPHQL_SLIM_QUERIES
+
+        self.breaker.configure(threshold=session_settings.BREAKER_THRESHOLD,
+                               reset_timeout=session_settings.BREAKER_RESET_TIMEOUT,
+                               max_timeout=session_settings.BREAKER_MAX_TIMEOUT)
+
+    def get_query(self, operation: OperationName) -> str:
+        if self.slim_queries and operation.name in SlimQuery.__members__:
+            return SlimQuery[operation.name].value
+        return Query[operation.name].value
+
+    def build_payload(self, operation: OperationName, variables: dict | None = None) -> dict:
+        query = self.get_query(operation)
+        if not self.persisted_queries:
+            return {
+                'operationName': operation,
+                'query': query,
+                'variables': variables or {}
+            }
+
+        query_hash = persisted_query_hash(query)
+        payload = {'operationName': operation}
+        if query_hash not in self.registered_queries:
+            payload['query'] = query
+        payload['variables'] = variables or {}
+        payload['extensions'] = {'persistedQuery': {'version': 1, 'sha256Hash': query_hash}}
+
+        return payload
+
+    def register_query(self, payload: dict, response_json: dict | None) -> None:
+        """Remembers that the server has stored the full query sent in `payload`.
+
+        A server that ignores `extensions` answers hash-only requests with an error
+        it doesn't name, but the same query sent in full works. Persisted queries are
+        turned off the second time that happens."""
+        if 'query' not in payload or 'extensions' not in payload:
+            return
+
+        query_hash = payload['extensions']['persistedQuery']['sha256Hash']
+        self.registered_queries.add(query_hash)
+        if query_hash not in self.suspected_queries:
+            return
+
+        self.suspected_queries.discard(query_hash)
+        if not isinstance(response_json, dict) or response_json.get('data') is None:
+            return
+
+        self.persisted_query_misses += 1
+        if self.persisted_query_misses >= 2 and self.persisted_queries:
+            logger.bind(operation=payload['operationName']).warning(
+                f"{self.session_name} | Server doesn't answer persisted queries, sending full queries")
+            self.persisted_queries = False
+
+    def handle_persisted_query_error(self, operation: OperationName, response_json: dict | None) -> bool:
+        """Forgets the hash of a query the server doesn't know or failed to answer. Returns True
+        when the operation should be resent with the full query text."""
+        error = get_persisted_query_error(response_json)
+        unanswered = isinstance(response_json, dict) and bool(response_json.get('errors')) \
+            and response_json.get('data') is None
+        if error is None and not unanswered:
+            return False
+
+        query_hash = persisted_query_hash(self.get_query(operation))
+        self.registered_queries.discard(query_hash)
+        if error is None:
+            # Possibly a server that ignores `extensions`, see `register_query`
+            self.suspected_queries.add(query_hash)
+        elif error in PERSISTED_QUERY_NOT_SUPPORTED:
+            logger.bind(operation=operation.value).warning(
+                f"{self.session_name} | Persisted queries are not supported, sending full queries")
+            self.persisted_queries = False
+
+        return True
+
+    async def decode(self, response: aiohttp.ClientResponse) -> dict | list | None:
+        """Raises json.JSONDecodeError (orjson's is a subclass) for a body that isn't JSON."""
+        if self.settings.FAST_MODE:
+            body = await response.read()
+            return fast.loads(body) if body else None
+
+        return await response.json()
+
+    async def acquire(self) -> None:
+        """Waits for the session's own limiter, then for the egress it shares with other sessions."""
+        if self.limiter is not None:
+            await self.limiter.acquire()
+        if self.egress_limiter is not None:
+            await self.egress_limiter.acquire(priority=self.step_started_at)
+
+    def parked_for(self) -> float:
+        """Seconds until this session may send requests again: an open circuit or a Retry-After."""
+        return max(self.breaker.remaining(), self.endpoint_breaker.remaining(),
+                   self.retry_after_until - monotonic(), 0)
+
+    def record_success(self) -> None:
+        self.breaker.record_success()
+        self.endpoint_breaker.record_success()
+        if self.egress_limiter is not None:
+            self.egress_limiter.on_success()
+
+    def record_failure(self) -> None:
+        self.breaker.record_failure()
+        self.endpoint_breaker.record_failure()
+
+    async def execute(self, operation: OperationName, variables: dict | None = None,
+                      action: str | None = None, errors: list[str] | None = None) -> dict | None:
+        """Returns the `data` object of the response or None on any error. The messages of
+        GraphQL errors in the response are added to `errors` when it's given.
+
+        Failed requests are retried with backoff while the operation's retry policy and
+        the process-wide retry budget allow it. Non-idempotent mutations are only retried
+        when the server can't have processed them. A delay above MAX_RETRY_SLEEP parks the
+        session and returns None, the step is retried once the scheduler runs it again."""
+        action = action or operation.value
+        policy = get_retry_policy(operation, settings=self.settings)
+        budget = get_retry_budget(operation.value)
+        budget.deposit()
+
+        attempt = 0
+        while True:
+            if self.parked_for() > 0:
+                return None
+
+            try:
+                return await self.send(operation, variables=variables, action=action, errors=errors)
+            except RetryableError as error:
+                log = logger.bind(operation=operation.value)
+                attempt += 1
+                if (attempt >= policy.attempts or (error.processed and not policy.idempotent)
+                        or not budget.withdraw()):
+                    log.error(f"{self.session_name} | ❗️{error} while {action}")
+                    return None
+
+                delay = jitter(error.retry_after) if error.retry_after is not None else policy.delay(attempt - 1)
+                retries_total.inc(operation=operation.value)
+                if delay > MAX_RETRY_SLEEP:
+                    log.warning(f"{self.session_name} | {error} while {action}, backing off for {delay:.1f}s")
+                    self.retry_after_until = max(self.retry_after_until, monotonic() + delay)
+                    return None
+
+                log.warning(f"{self.session_name} | {error} while {action}, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def send(self, operation: OperationName, variables: dict | None, action: str,
+                   errors: list[str] | None = None) -> dict | None:
+        """One attempt of `execute`. Raises RetryableError for failures worth retrying."""
+        stats = self.stats.setdefault(operation.value, OperationStats())
+        json_data = self.build_payload(operation=operation, variables=variables)
+
+        await self.acquire()
+
+        started_at = monotonic()
+        try:
+            response = await self.http_client.post(url=self.url, json=json_data)
+            # Some servers answer an unknown persisted query hash with 400
+            if response.status != 400 or 'query' in json_data:
+                response.raise_for_status()
+
+            response_json = await self.decode(response)
+        except aiohttp.ClientResponseError as error:
+            self.record(stats=stats, operation=operation.value, started_at=started_at, status=error.status)
+            self.handle_error(error=error, stats=stats, operation=operation.value, action=action)
+            return None
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as error:
+            self.record(stats=stats, operation=operation.value, started_at=started_at, status=0)
+            self.record_failure()
+            # A refused connection never reached the server
+            raise RetryableError(f"Connection error: {error!r}",
+                                 processed=not isinstance(error, aiohttp.ClientConnectorError))
+        except (json.JSONDecodeError, UnicodeDecodeError) as error:
+            # An HTML error page from a proxy or a truncated body
+            self.record(stats=stats, operation=operation.value, started_at=started_at, status=response.status)
+            self.record_failure()
+            raise RetryableError(f"Invalid response body: {error}")
+
+        self.record(stats=stats, operation=operation.value, started_at=started_at, status=response.status)
+        self.record_success()
+
+        if 'query' not in json_data and self.handle_persisted_query_error(operation, response_json):
+            return await self.send(operation, variables=variables, action=action, errors=errors)
+        self.register_query(json_data, response_json)
+
+        if not response_json or response_json.get('data') is None:
+            stats.errors += 1
+            graphql_errors = response_json.get('errors') if response_json else None
+            if errors is not None:
+                errors.extend(get_error_messages(graphql_errors))
+            logger.bind(operation=operation.value).error(
+                f"{self.session_name} | ❗️GraphQL error while {action}: {graphql_errors}")
+            return None
+
+        return response_json['data']
+
+    async def execute_batch(self, operations: list[tuple[OperationName, dict | None]]) -> list[dict | None]:
+        """Sends independent operations as one array-batched request.
+
+        Falls back to sequential requests (and stops batching for this client)
+        when the server rejects or does not understand the batch. A failed batch
+        isn't retried, the session backs off instead."""
+        if not self.batching or len(operations) < 2:
+            return [await self.execute(operation, variables=variables) for operation, variables in operations]
+
+        if self.parked_for() > 0:
+            return [None] * len(operations)
+
+        stats = self.stats.setdefault('batch', OperationStats())
+        json_data = [self.build_payload(operation=operation, variables=variables)
+                     for operation, variables in operations]
+
+        await self.acquire()
+
+        started_at = monotonic()
+        try:
+            response = await self.http_client.post(url=self.url, json=json_data)
+            response.raise_for_status()
+
+            response_json = await self.decode(response)
+        except aiohttp.ClientResponseError as error:
+            self.record(stats=stats, operation='batch', started_at=started_at, status=error.status)
+            if error.status in (401, 429) or error.status >= 500:
+                try:
+                    self.handle_error(error=error, stats=stats, operation='batch', action='batch')
+                except RetryableError as failure:
+                    logger.bind(operation='batch').error(f"{self.session_name} | ❗️{failure} while batch")
+                return [None] * len(operations)
+
+            response_json = None
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as error:
+            self.record(stats=stats, operation='batch', started_at=started_at, status=0)
+            self.record_failure()
+            logger.bind(operation='batch').error(f"{self.session_name} | ❗️Connection error while batch: {error!r}")
+            return [None] * len(operations)
+        except (json.JSONDecodeError, UnicodeDecodeError) as error:
+            self.record(stats=stats, operation='batch', started_at=started_at, status=response.status)
+            self.record_failure()
+            logger.bind(operation='batch').error(f"{self.session_name} | ❗️Invalid response body while batch: {error}")
+            return [None] * len(operations)
+        else:
+            self.record(stats=stats, operation='batch', started_at=started_at, status=response.status)
+            self.record_success()
+
+        if not isinstance(response_json, list) or len(response_json) != len(operations):
+            logger.bind(operation='batch').warning(
+                f"{self.session_name} | Batched requests are not supported, falling back to sequential")
+            self.batching = False
+            return await self.execute_batch(operations)
+
+        results = []
+        for (operation, variables), payload, item in zip(operations, json_data, response_json):
+            if 'query' not in payload and self.handle_persisted_query_error(operation, item):
+                results.append(await self.execute(operation, variables=variables))
+                continue
+            self.register_query(payload, item)
+
+            data = item.get('data') if isinstance(item, dict) else None
+            if data is None:
+                logger.bind(operation=operation.value).error(
+                    f"{self.session_name} | ❗️GraphQL error while {operation.value}: "
+                    f"{item.get('errors') if isinstance(item, dict) else item}")
+            results.append(data)
+
+        return results
+
+    def record(self, stats: OperationStats, operation: str, started_at: float, status: int) -> None:
+        """Status 0 stands for a request that got no response."""
+        latency = monotonic() - started_at
+        stats.record(latency=latency, failed=status == 0 or status >= 400)
+
+        for observer in request_observers:
+            observer(self.session_name, operation, latency, status)
+
+    def handle_error(self, error: aiohttp.ClientResponseError, stats: OperationStats, operation: str,
+                     action: str) -> None:
+        """Logs an HTTP error, raises RetryableError for 429 and 5xx responses."""
+        if error.status == 429:
+            stats.rate_limited += 1
+            retry_after = parse_retry_after(error.headers.get('Retry-After') if error.headers else None)
+            self.retry_after_until = monotonic() + retry_after
+            if self.egress_limiter is not None:
+                self.egress_limiter.on_rate_limited(retry_after)
+            metrics.backoff_seconds_total.inc(retry_after)
+            raise RetryableError("Too many requests", retry_after=retry_after, processed=False)
+
+        if error.status >= 500:
+            self.record_failure()
+            raise RetryableError(f"Server error {error.status}")
+
+        self.record_success()
+        log = logger.bind(operation=operation)
+        if error.status == 401:
+            self.unauthorized = True
+            log.error(f"{self.session_name} | ❗️Access token rejected while {action}")
+        else:
+            log.error(f"{self.session_name} | ❗️Unknown error while {action}: {error}")
@@ -0,0 +1,308 @@
+import os
+import copy
+import gzip
+import json
+import atexit
+import asyncio
+from time import time, monotonic
+from fnmatch import fnmatchcase
+from typing import Awaitable, Callable
+
+import aiohttp
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+from bot.config import settings
+from bot.config.config import Settings
+from bot.core.upgrades import UpgradeCosts
+from bot.utils import logger
+
+
+CASSETTE_VERSION = 1
+
+# Response headers the tapper reads, everything else is left out of the cassette
+RECORDED_HEADERS = ('Retry-After',)
+SECRET_SETTINGS = {'API_ID', 'API_HASH'}
+# Events a recorder buffers before appending them to its cassette
+CASSETTE_BATCH_EVENTS = 200
+
+
+def get_cassette_path(directory: str, session_name: str) -> str:
+    return os.path.join(directory, f'{session_name}.jsonl.gz')
+
+
+def get_operation(payload: dict) -> str | None:
+    operation = payload.get('operationName')
+    return getattr(operation, 'value', operation)
+
+
+def get_operations(payload: dict | list) -> str | list[str]:
+    """Operation names of a request, a list for batches. Query texts aren't recorded."""
+    if isinstance(payload, list):
+        return [get_operation(item) for item in payload]
+    return get_operation(payload)
+
+
+class RecordingClient:
+    """Wraps the session's `aiohttp.ClientSession` and writes every GraphQL exchange to a cassette."""
+
+    def __init__(self, http_client: aiohttp.ClientSession, cassette: 'CassetteRecorder'):
+        self.http_client = http_client
+        self.cassette = cassette
+
+    @property
+    def headers(self):
+        return self.http_client.headers
+
+    async def close(self) -> None:
+        await self.http_client.close()
+
+    async def post(self, url: str, json: dict | list) -> aiohttp.ClientResponse:
+        event = {'operations': get_operations(json)}
+        started_at = monotonic()
+        try:
+            response = await self.http_client.post(url=url, json=json)
+            # Read here so the body is recorded, the client reads the cached copy
+            body = await response.read()
+        except asyncio.TimeoutError:
+            self.cassette.write({**event, 'error': 'timeout', 'latency': monotonic() - started_at})
+            raise
+        except aiohttp.ClientConnectionError:
+            self.cassette.write({**event, 'error': 'connection', 'latency': monotonic() - started_at})
+            raise
+
+        headers = {name: response.headers[name] for name in RECORDED_HEADERS if name in response.headers}
+        self.cassette.write({**event, 'status': response.status, 'headers': headers,
+                             'body': body.decode(errors='replace'), 'latency': round(monotonic() - started_at, 6)})
+        return response
+
+
+class CassetteRecorder:
+    """Writes a session's GraphQL responses, Telegram web app data and cached token expiry
+    to a gzipped JSON lines file, one event per line after a header with the wall time.
+
+    Events are buffered and appended CASSETTE_BATCH_EVENTS at a time, each batch as its own
+    gzip member, so no file stays open between batches. `close` writes the rest; recorders
+    still open at exit are closed then.
+
+    Cassettes hold the Telegram auth data and access tokens of the session, keep them as
+    private as the session files."""
+
+    def __init__(self, path: str, session_name: str, session_settings: Settings):
+        self.path = path
+        self.buffer: list[str] = []
+        self.created = False
+        self.closed = False
+        # The settings decide which requests the tapper sends, replays run with the same ones
+        self.write({'version': CASSETTE_VERSION, 'session': session_name, 'started_at': time(),
+                    'settings': session_settings.model_dump(exclude=SECRET_SETTINGS)})
+        self.costs: dict | None = None
+        open_recorders.add(self)
+
+    def write(self, event: dict) -> None:
+        if self.closed:
+            return
+
+        self.buffer.append(json.dumps(event, separators=(',', ':'), ensure_ascii=False) + '\n')
+        if len(self.buffer) >= CASSETTE_BATCH_EVENTS:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.buffer:
+            return
+
+        if not self.created:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        # The first batch replaces a cassette left by an earlier run
+        with gzip.open(self.path, 'at' if self.created else 'wt', encoding='utf-8') as file:
+            file.writelines(self.buffer)
+        self.created = True
+        self.buffer.clear()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+
+        self.flush()
+        self.closed = True
+        open_recorders.discard(self)
+
+    def wrap(self, http_client: aiohttp.ClientSession) -> RecordingClient:
+        return RecordingClient(http_client=http_client, cassette=self)
+
+    async def cached_token(self, cached_token: tuple[str, float] | None) -> tuple[str, float] | None:
+        self.write({'cached_token': cached_token[1] if cached_token else None})
+        return cached_token
+
+    async def web_data(self, request: Callable[[], Awaitable[dict | None]]) -> dict | None:
+        web_data = await request()
+        self.write({'web_data': web_data})
+        return web_data
+
+    def upgrade_costs(self, costs: UpgradeCosts) -> UpgradeCosts:
+        """Records the prices the upgrade planner sees when other sessions have learned new ones."""
+        if costs.data != self.costs:
+            self.costs = copy.deepcopy(costs.data)
+            self.write({'upgrade_costs': self.costs})
+        return costs
+
+
+class CassetteResponse:
+    """The parts of `aiohttp.ClientResponse` that `GraphQLClient` uses."""
+
+    def __init__(self, url: str, status: int, headers: dict, body: str):
+        self.url = url
+        self.status = status
+        self.headers = CIMultiDictProxy(CIMultiDict(headers))
+        self.body = body.encode()
+
+    def raise_for_status(self) -> None:
+        if self.status < 400:
+            return
+
+        request_info = aiohttp.RequestInfo(url=URL(self.url), method='POST', headers=CIMultiDictProxy(CIMultiDict()),
+                                           real_url=URL(self.url))
+        raise aiohttp.ClientResponseError(request_info=request_info, history=(), status=self.status,
+                                          message='', headers=self.headers)
+
+    async def read(self) -> bytes:
+        return self.body
+
+    async def json(self):
+        return json.loads(self.body) if self.body else None
+
+
+class PlaybackClient:
+    """Answers `post` from a cassette instead of the network."""
+
+    def __init__(self, http_client: aiohttp.ClientSession, cassette: 'CassettePlayer'):
+        self.http_client = http_client
+        self.cassette = cassette
+
+    @property
+    def headers(self):
+        return self.http_client.headers
+
+    async def close(self) -> None:
+        await self.http_client.close()
+
+    async def post(self, url: str, json: dict | list) -> CassetteResponse:
+        event = await self.cassette.next('operations', expected=get_operations(json))
+        await asyncio.sleep(event.get('latency', 0))
+
+        if event.get('error') == 'timeout':
+            raise asyncio.TimeoutError()
+        if event.get('error') == 'connection':
+            raise aiohttp.ServerDisconnectedError()
+
+        return CassetteResponse(url=url, status=event['status'], headers=event['headers'], body=event['body'])
+
+
+class CassettePlayer:
+    """Replays a recorded cassette in order.
+
+    When the cassette runs out, or the tapper asks for something else than what was recorded
+    next, `finished` is set and the session waits until it's cancelled."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.header, self.events = read_cassette(path)
+        self.position = 0
+        self.costs = UpgradeCosts(path=None)
+        self.mismatch: str | None = None
+        self.finished = asyncio.Event()
+
+    @property
+    def session_name(self) -> str:
+        return self.header.get('session', '')
+
+    @property
+    def started_at(self) -> float:
+        return self.header.get('started_at', 0)
+
+    @property
+    def settings(self) -> dict:
+        return self.header.get('settings', {})
+
+    async def next(self, key: str, expected=None) -> dict:
+        if self.position >= len(self.events):
+            return await self.finish()
+
+        event = self.events[self.position]
+        if key not in event or (expected is not None and event[key] != expected):
+            self.mismatch = f"event {self.position + 1} is {event.get(key, list(event))}, not {key} {expected}"
+            logger.warning(f"{self.session_name} | Replay diverged from the cassette: {self.mismatch}")
+            return await self.finish()
+
+        self.position += 1
+        return event
+
+    async def finish(self):
+        self.finished.set()
+        await asyncio.Future()
+
+    def wrap(self, http_client: aiohttp.ClientSession) -> PlaybackClient:
+        return PlaybackClient(http_client=http_client, cassette=self)
+
+    async def cached_token(self, cached_token: tuple[str, float] | None) -> tuple[str, float] | None:
+        # The recorded token isn't sent anywhere, only its expiry matters
+        event = await self.next('cached_token')
+        return ('cassette', event['cached_token']) if event['cached_token'] else None
+
+    async def web_data(self, request: Callable[[], Awaitable[dict | None]]) -> dict | None:
+        event = await self.next('web_data')
+        return event['web_data']
+
+    def upgrade_costs(self, costs: UpgradeCosts) -> UpgradeCosts:
+        """The prices the planner saw while recording, rather than what the replayed sessions learned."""
+        if self.position < len(self.events) and 'upgrade_costs' in self.events[self.position]:
+            self.costs.data = self.events[self.position]['upgrade_costs']
+            self.position += 1
+        return self.costs
+
+    def close(self) -> None:
+        pass
+
+
+def read_cassette(path: str) -> tuple[dict, list[dict]]:
+    """The header and events of a cassette. A cassette cut short by a crash is read up to the cut."""
+    lines = []
+    with gzip.open(path, 'rt', encoding='utf-8') as file:
+        try:
+            for line in file:
+                lines.append(line)
+        except EOFError:
+            pass
+
+    events = []
+    for line in lines:
+        try:
+            events.append(json.loads(line))
+        except json.JSONDecodeError:
+            break
+
+    if not events or 'version' not in events[0]:
+        raise ValueError(f"{path} is not a cassette")
+
+    return events[0], events[1:]
+
+
+# Recorders with events that may not be written yet
+open_recorders: set[CassetteRecorder] = set()
+
+
+@atexit.register
+def close_recorders() -> None:
+    for recorder in list(open_recorders):
+        recorder.close()
+
+
+def open_recorder(session_name: str, session_settings: Settings) -> CassetteRecorder | None:
+    """A recorder for the session when CASSETTE_DIR is set and CASSETTE_SESSIONS, if any, match it."""
+    if not settings.CASSETTE_DIR:
+        return None
+    if settings.CASSETTE_SESSIONS and not any(fnmatchcase(session_name, pattern)
+                                              for pattern in settings.CASSETTE_SESSIONS):
+        return None
+    return CassetteRecorder(path=get_cassette_path(settings.CASSETTE_DIR, session_name), session_name=session_name,
+                            session_settings=session_settings)
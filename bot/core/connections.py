@@ -0,0 +1,45 @@
+import aiohttp
+from aiohttp_proxy import ProxyConnector
+
+from bot.config import settings
+from bot.core.Bypass import CustomTLSContext
+
+
+class ConnectorPool:
+    """One pooled connector per egress (proxy URL or direct), shared by every session
+    routed through it. Sessions keep their own ClientSession, so cookies and
+    headers stay isolated."""
+
+    def __init__(self):
+        self._connectors: dict[str | None, aiohttp.BaseConnector] = {}
+
+    def get(self, proxy: str | None) -> aiohttp.BaseConnector:
+        connector = self._connectors.get(proxy)
+        if connector is None or connector.closed:
+            connector = self._connectors[proxy] = self.create(proxy=proxy)
+
+        return connector
+
+    @staticmethod
+    def create(proxy: str | None) -> aiohttp.BaseConnector:
+        options = dict(
+            ssl=CustomTLSContext.get_shared_ssl_context(),
+            limit=settings.CONNECTOR_LIMIT,
+            limit_per_host=settings.CONNECTOR_LIMIT_PER_HOST,
+            keepalive_timeout=settings.CONNECTOR_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=settings.CONNECTOR_DNS_CACHE_TTL,
+        )
+
+        if proxy:
+            return ProxyConnector.from_url(url=proxy, rdns=True, **options)
+
+        return aiohttp.TCPConnector(**options)
+
+    async def close(self) -> None:
+        for connector in self._connectors.values():
+            await connector.close()
+
+        self._connectors.clear()
+
+
+connector_pool = ConnectorPool()
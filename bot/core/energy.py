@@ -0,0 +1,25 @@
+from time import time
+
+from bot.core.models import GameConfig
+
+
+def plan_taps(config: GameConfig, min_taps: int, max_taps: int, at: float | None = None) -> tuple[int, float]:
+    """Returns the tap batch to send and the seconds to wait before sending it.
+
+    Coins per request grow with the batch size and recharged energy is only lost
+    once the bar is full, so the batch is the largest one allowed by `max_taps`
+    and by a full energy bar, sent as soon as the predicted energy covers it."""
+    now = at or time()
+    energy_per_tap = max(config.weapon_level, 1)
+
+    # The API needs a little more energy than the batch costs, as in the unplanned path
+    full_bar_taps = (config.max_energy - 1) // energy_per_tap
+    taps = max(min(max_taps, full_bar_taps), min(min_taps, max_taps))
+    # A batch that needs more than a full bar would never be sent, whatever `min_taps` says
+    taps = max(min(taps, full_bar_taps), 1)
+    needed_energy = taps * energy_per_tap + 1
+
+    if config.predict_energy(now) >= needed_energy:
+        return taps, 0
+
+    return taps, config.seconds_until_energy(needed_energy, now)
@@ -0,0 +1,128 @@
+from time import time
+from datetime import datetime
+from dataclasses import dataclass, field
+
+
+# Energy restored per second for each energyRechargeLevel
+ENERGY_RECHARGE_PER_LEVEL = 1
+# Free boosts are given back once a day, counted from their last recharge
+FREE_BOOSTS_RECHARGE_SECONDS = 24 * 3600
+
+def parse_timestamp(value: str | None) -> float | None:
+    """Converts an ISO-8601 timestamp from the API into a unix timestamp."""
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+@dataclass(slots=True)
+class Boss:
+    level: int
+    current_health: int
+    max_health: int
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Boss':
+        return cls(level=data['level'], current_health=data['currentHealth'], max_health=data['maxHealth'])
+
+
+@dataclass(slots=True)
+class FreeBoosts:
+    turbo_amount: int
+    refill_energy_amount: int
+    max_turbo_amount: int = 0
+    max_refill_energy_amount: int = 0
+    turbo_recharged_at: float | None = None
+    refill_energy_recharged_at: float | None = None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'FreeBoosts':
+        return cls(turbo_amount=data['currentTurboAmount'], refill_energy_amount=data['currentRefillEnergyAmount'],
+                   max_turbo_amount=data.get('maxTurboAmount') or 0,
+                   max_refill_energy_amount=data.get('maxRefillEnergyAmount') or 0,
+                   turbo_recharged_at=parse_timestamp(data.get('turboAmountLastRechargeDate')),
+                   refill_energy_recharged_at=parse_timestamp(data.get('refillEnergyAmountLastRechargeDate')))
+
+    @property
+    def next_turbo_at(self) -> float | None:
+        """When used turbo boosts are given back, None while none are used."""
+        if self.turbo_amount >= self.max_turbo_amount or self.turbo_recharged_at is None:
+            return None
+        return self.turbo_recharged_at + FREE_BOOSTS_RECHARGE_SECONDS
+
+    @property
+    def next_refill_energy_at(self) -> float | None:
+        if self.refill_energy_amount >= self.max_refill_energy_amount or self.refill_energy_recharged_at is None:
+            return None
+        return self.refill_energy_recharged_at + FREE_BOOSTS_RECHARGE_SECONDS
+
+
+@dataclass(slots=True)
+class GameConfig:
+    """`FragmentBossFightConfig` fields the bot uses. Spin fields are only present in QUERY_GAME_CONFIG."""
+    coins_amount: int
+    current_energy: int
+    max_energy: int
+    weapon_level: int
+    energy_limit_level: int
+    energy_recharge_level: int
+    nonce: str
+    boss: Boss
+    free_boosts: FreeBoosts
+    spin_energy_total: int = 0
+    spin_energy_next_recharge_at: float | None = None
+    observed_at: float = field(default_factory=time)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'GameConfig':
+        return cls(coins_amount=data['coinsAmount'],
+                   current_energy=data['currentEnergy'],
+                   max_energy=data['maxEnergy'],
+                   weapon_level=data['weaponLevel'],
+                   energy_limit_level=data['energyLimitLevel'],
+                   energy_recharge_level=data['energyRechargeLevel'],
+                   nonce=data['nonce'],
+                   boss=Boss.from_dict(data['currentBoss']),
+                   free_boosts=FreeBoosts.from_dict(data['freeBoosts']),
+                   spin_energy_total=data.get('spinEnergyTotal') or 0,
+                   spin_energy_next_recharge_at=parse_timestamp(data.get('spinEnergyNextRechargeAt')))
+
+    @property
+    def recharge_per_second(self) -> float:
+        return max(self.energy_recharge_level, 1) * ENERGY_RECHARGE_PER_LEVEL
+
+    def predict_energy(self, at: float | None = None) -> float:
+        """Energy expected at `at` (now by default), recharged since the config was observed."""
+        elapsed = max((at or time()) - self.observed_at, 0)
+        return min(self.current_energy + elapsed * self.recharge_per_second, self.max_energy)
+
+    def seconds_until_energy(self, energy: float, at: float | None = None) -> float:
+        """Seconds from `at` until `energy` is available, capped by `maxEnergy`."""
+        missing_energy = min(energy, self.max_energy) - self.predict_energy(at)
+        return max(missing_energy / self.recharge_per_second, 0)
+
+
+@dataclass(slots=True)
+class TapbotConfig:
+    is_purchased: bool
+    used_attempts: int
+    total_attempts: int
+    damage_per_sec: int
+    ends_at: float | None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'TapbotConfig':
+        return cls(is_purchased=data['isPurchased'],
+                   used_attempts=data['usedAttempts'],
+                   total_attempts=data['totalAttempts'],
+                   damage_per_sec=data.get('damagePerSec') or 0,
+                   ends_at=parse_timestamp(data.get('endsAt')))
+
+
+@dataclass(slots=True)
+class User:
+    is_referral_initial_join_bonus_available: bool
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'User':
+        return cls(is_referral_initial_join_bonus_available=data['isReferralInitialJoinBonusAvailable'])
@@ -0,0 +1,191 @@
+import asyncio
+from time import monotonic
+from dataclasses import dataclass
+
+import aiohttp
+
+from bot.config import settings
+from bot.core.connections import connector_pool
+from bot.utils import logger, metrics
+from bot.utils.proxy import mask_proxy
+from bot.utils.registry import SessionRegistry, session_registry
+
+
+# Weight of the latest sample in the latency and error rate averages
+EWMA_WEIGHT = 0.3
+# Latency assumed for proxies that haven't answered yet
+UNKNOWN_LATENCY = 1.0
+# No response (connection error or timeout), proxy authentication required, bad gateway, gateway timeout
+PROXY_FAILURE_STATUSES = frozenset({0, 407, 502, 504})
+
+proxy_latency = metrics.Gauge('memefi_proxy_latency_seconds', 'Average proxy latency')
+proxy_healthy = metrics.Gauge('memefi_proxy_healthy', 'Whether a proxy is used for new and failed over sessions')
+
+
+@dataclass(slots=True)
+class ProxyHealth:
+    latency: float | None = None
+    error_rate: float = 0
+    consecutive_failures: int = 0
+
+    @property
+    def healthy(self) -> bool:
+        return self.consecutive_failures < settings.PROXY_MAX_FAILURES
+
+    @property
+    def score(self) -> float:
+        """Lower is better: latency inflated by the recent error rate."""
+        return (self.latency or UNKNOWN_LATENCY) * (1 + 4 * self.error_rate)
+
+    def record(self, latency: float | None) -> None:
+        failed = latency is None
+        self.error_rate += EWMA_WEIGHT * (failed - self.error_rate)
+        if failed:
+            self.consecutive_failures += 1
+            return
+
+        self.consecutive_failures = 0
+        self.latency = latency if self.latency is None else self.latency + EWMA_WEIGHT * (latency - self.latency)
+
+
+class ProxyPool:
+    """Proxies from proxies.txt with their health, and the proxy of every session.
+
+    Proxies are probed concurrently at startup and every PROXY_CHECK_INTERVAL seconds,
+    requests made by the sessions count as samples too. A session keeps its proxy
+    (stored in the session registry) while it is healthy, new sessions and sessions
+    on a proxy that failed PROXY_MAX_FAILURES times in a row are moved to the passing
+    proxy with the lowest `(sessions + 1) * score`."""
+
+    def __init__(self, registry: SessionRegistry):
+        self.registry = registry
+        self.health: dict[str, ProxyHealth] = {}
+        self.load: dict[str, int] = {}
+        self.assignments: dict[str, str | None] = {}
+
+    @property
+    def proxies(self) -> list[str]:
+        return list(self.health)
+
+    def add(self, proxies: list[str]) -> None:
+        for proxy in proxies:
+            self.health.setdefault(proxy, ProxyHealth())
+            self.load.setdefault(proxy, 0)
+
+    def record(self, proxy: str, latency: float | None) -> None:
+        health = self.health.get(proxy)
+        if health is None:
+            return
+
+        was_healthy = health.healthy
+        health.record(latency)
+
+        if health.latency is not None:
+            proxy_latency.set(health.latency, proxy=mask_proxy(proxy))
+        proxy_healthy.set(int(health.healthy), proxy=mask_proxy(proxy))
+        if was_healthy and not health.healthy:
+            logger.warning(f"Proxy <y>{mask_proxy(proxy)}</y> failed {health.consecutive_failures} times in a row, "
+                           f"moving its sessions")
+        elif health.healthy and not was_healthy:
+            logger.info(f"Proxy <y>{mask_proxy(proxy)}</y> is healthy again")
+
+    def observe_request(self, session_name: str, operation: str, latency: float, status: int) -> None:
+        """Any response counts as a working proxy, except the ones a proxy sends itself.
+        Other 5xx come from the game server, the endpoint circuit breaker handles those."""
+        proxy = self.assignments.get(session_name)
+        if proxy is not None:
+            self.record(proxy, None if status in PROXY_FAILURE_STATUSES else latency)
+
+    async def probe(self, proxy: str) -> None:
+        started_at = monotonic()
+        try:
+            async with aiohttp.ClientSession(connector=connector_pool.get(proxy), connector_owner=False,
+                                             timeout=aiohttp.ClientTimeout(settings.PROXY_CHECK_TIMEOUT)) as session:
+                async with session.get(url=settings.PROXY_CHECK_URL) as response:
+                    response.raise_for_status()
+                    await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as error:
+            logger.debug(f"Proxy <y>{mask_proxy(proxy)}</y> check failed: {error!r}")
+            self.record(proxy, None)
+        else:
+            self.record(proxy, monotonic() - started_at)
+
+    async def check(self) -> None:
+        """Probes every proxy, at most PROXY_CHECK_CONCURRENCY at a time."""
+        semaphore = asyncio.Semaphore(max(settings.PROXY_CHECK_CONCURRENCY, 1))
+
+        async def probe(proxy: str) -> None:
+            async with semaphore:
+                await self.probe(proxy)
+
+        await asyncio.gather(*(probe(proxy) for proxy in self.proxies))
+
+        healthy = sum(health.healthy for health in self.health.values())
+        logger.info(f"Proxy check: <g>{healthy}</g> healthy | <r>{len(self.health) - healthy}</r> failing")
+
+    def set(self, session_name: str, proxy: str | None) -> None:
+        previous = self.assignments.get(session_name)
+        if previous in self.load:
+            self.load[previous] -= 1
+        if proxy in self.load:
+            self.load[proxy] += 1
+
+        self.assignments[session_name] = proxy
+
+    def pick(self) -> str:
+        # Prefer proxies whose last check passed. With every proxy failing, keep spreading
+        # over all of them rather than going direct
+        candidates = ([proxy for proxy, health in self.health.items() if not health.consecutive_failures]
+                      or [proxy for proxy, health in self.health.items() if health.healthy]
+                      or self.proxies)
+        return min(candidates, key=lambda proxy: (self.load[proxy] + 1) * self.health[proxy].score)
+
+    def move(self, session_name: str) -> str:
+        self.set(session_name, None)
+        proxy = self.pick()
+        self.set(session_name, proxy)
+        self.registry.set(session_name, 'proxy', proxy)
+
+        return proxy
+
+    def assign(self, session_names: list[str]) -> dict[str, str | None]:
+        if not self.health:
+            for session_name in session_names:
+                self.set(session_name, None)
+            return {session_name: None for session_name in session_names}
+
+        for session_name in session_names:
+            proxy = self.registry.get(session_name, 'proxy')
+            if proxy in self.health and self.health[proxy].healthy:
+                self.set(session_name, proxy)
+
+        for session_name in session_names:
+            if self.assignments.get(session_name) is None:
+                self.move(session_name)
+
+        return {session_name: self.assignments[session_name] for session_name in session_names}
+
+    def get(self, session_name: str, default: str | None = None) -> str | None:
+        """The session's proxy, failing over to another one if it's unhealthy."""
+        if session_name not in self.assignments:
+            return default
+
+        proxy = self.assignments[session_name]
+        health = self.health.get(proxy)
+        if health is None or health.healthy:
+            return proxy
+
+        replacement = self.move(session_name)
+        if replacement != proxy:
+            logger.info(f"{session_name} | Proxy <y>{mask_proxy(proxy)}</y> is failing, "
+                        f"switching to <y>{mask_proxy(replacement)}</y>")
+
+        return replacement
+
+    async def run(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await self.check()
+
+
+proxy_pool = ProxyPool(registry=session_registry)
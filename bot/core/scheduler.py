@@ -0,0 +1,85 @@
+import asyncio
+import heapq
+from itertools import count
+from time import monotonic
+
+from bot.utils import logger
+from bot.exceptions import InvalidSession
+from .tapper import Tapper
+
+
+class Scheduler:
+    """Runs every session from one heap of "next due" entries with a fixed pool of workers.
+
+    Each session has at most one entry; after a worker runs `Tapper.step` the session
+    is pushed back with the delay the step returned. Due sessions that are partway
+    through a turn run before sessions starting a new one."""
+
+    def __init__(self, workers: int):
+        self.workers = max(workers, 1)
+        self._heap: list[tuple[float, int, Tapper]] = []
+        self._counter = count()
+        self._changed = asyncio.Event()
+        self.tappers: list[Tapper] = []
+        self._due: asyncio.PriorityQueue[tuple[bool, float, int, Tapper]] = asyncio.PriorityQueue()
+
+    def __len__(self) -> int:
+        return len(self._heap) + self._due.qsize()
+
+    def add(self, tapper: Tapper, proxy: str | None, delay: float = 0) -> None:
+        tapper.proxy = proxy
+        self.tappers.append(tapper)
+        self.schedule(tapper=tapper, delay=delay)
+
+    def schedule(self, tapper: Tapper, delay: float) -> None:
+        heapq.heappush(self._heap, (monotonic() + delay, next(self._counter), tapper))
+        self._changed.set()
+
+    async def _dispatch(self) -> None:
+        while True:
+            self._changed.clear()
+            now = monotonic()
+
+            while self._heap and self._heap[0][0] <= now:
+                due_at, counter, tapper = heapq.heappop(self._heap)
+                # Pauses within a turn are short, finishing it first keeps taps from waiting on logins
+                if tapper.next_phase is not None:
+                    self._due.put_nowait((False, tapper.api.step_started_at, counter, tapper))
+                else:
+                    self._due.put_nowait((True, due_at, counter, tapper))
+
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _work(self) -> None:
+        while True:
+            *_, tapper = await self._due.get()
+            with logger.contextualize(session=tapper.session_name):
+                try:
+                    if tapper.http_client is None:
+                        await tapper.start(proxy=tapper.proxy)
+
+                    delay = await tapper.step()
+                except InvalidSession:
+                    logger.error(f"{tapper.session_name} | ❗️Invalid Session")
+                    await tapper.stop()
+                    continue
+                except Exception as error:
+                    logger.error(f"{tapper.session_name} | ❗️Unknown error in scheduler: {error}")
+                    delay = tapper.get_failure_delay()
+
+            self.schedule(tapper=tapper, delay=delay)
+
+    async def run(self) -> None:
+        workers = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        dispatcher = asyncio.create_task(self._dispatch())
+
+        try:
+            await asyncio.gather(dispatcher, *workers)
+        finally:
+            for task in (dispatcher, *workers):
+                task.cancel()
+            await asyncio.gather(*(tapper.stop() for tapper in self.tappers), return_exceptions=True)
@@ -1,102 +1,124 @@
 import asyncio
 import json
 import random
-from time import time
+from time import time, monotonic
 from random import randint
+from functools import partial
+from dataclasses import dataclass
+from typing import Awaitable, Callable
 from urllib.parse import unquote
-import traceback
-from datetime import datetime
 
 import aiohttp
-from aiohttp_proxy import ProxyConnector
-from better_proxy import Proxy
 from pyrogram import Client
 from pyrogram.errors import Unauthorized, UserDeactivated, AuthKeyUnregistered
 from pyrogram.raw.functions.messages import RequestWebView
 
-from bot.config import settings
-from bot.core.Bypass import CustomTLSContext
-from bot.utils import logger
-from bot.utils.graphql import Query, OperationName
+from bot.config.reloader import settings_reloader
+from bot.core.api import GraphQLClient, is_insufficient_balance
+from bot.core.cassette import CassettePlayer, CassetteRecorder, open_recorder
+from bot.core.telegram import tg_pool, peer_cache, get_proxy_dict
+from bot.core.connections import connector_pool
+from bot.core.proxies import proxy_pool
+from bot.core.models import GameConfig, TapbotConfig, User
+from bot.core.energy import plan_taps
+from bot.core.upgrades import upgrade_costs, plan_upgrade
+from bot.utils import logger, metrics, fast
+from bot.utils.graphql import OperationName
+from bot.utils.limiter import TokenBucket, get_egress_limiter
+from bot.utils.proxy import mask_proxy
+from bot.utils.retry import backoff, jitter
+from bot.utils.tokens import token_store, get_token_expiry
+from bot.utils.registry import session_registry
 from bot.utils.boosts import FreeBoostType, UpgradableBoostType
 from bot.exceptions import InvalidSession
 from .headers import headers
 from .useragents import user_agents
 
+MAX_UPGRADES_PER_STEP = 3
+
+UPGRADE_NAMES = {
+    UpgradableBoostType.TAP: 'Tap',
+    UpgradableBoostType.ENERGY: 'Energy',
+    UpgradableBoostType.CHARGE: 'Charge',
+}
+
+
+@dataclass(slots=True)
+class Turn:
+    """What one pass of the tap loop carries from one phase to the next."""
+    profile_data: GameConfig
+    bot_config: TapbotConfig | None
+    user: User | None
+    balance: int = 0
+    available_energy: int = 0
+    boss_level: int = 0
+    boss_health: int = 0
+    calc_taps: int = 0
+    upgrades: int = 0
+
+
 class Tapper:
-    def __init__(self, tg_client: Client):
+    def __init__(self, tg_client: Client, cassette: CassetteRecorder | CassettePlayer | None = None):
         self.session_name = tg_client.name
         self.tg_client = tg_client
-        self.session_dict = self.load_session_data()
-
-        self.GRAPHQL_URL = 'https://api-gw-tg.memefi.club/graphql'
-        if settings.AUTO_GENERATE_USER_AGENT_FOR_EACH_SESSION == True:
-            headers['User-Agent'] = self.get_user_agent()
+        self.proxy: str | None = None
+        self.http_client: aiohttp.ClientSession | None = None
+        self.api: GraphQLClient | None = None
+
+        self.access_token_expires_at = 0
+        self.turbo_time = 0
+        self.active_turbo = False
+        self.tapped = False
+        self.failed_steps = 0
+        # Set by a step that pauses between requests, runs instead of `play` as the next step
+        self.next_phase: Callable[[], Awaitable[float]] | None = None
+        self.settings = settings_reloader.for_session(self.session_name)
+        self.settings_generation = settings_reloader.generation
+        self.cassette = cassette or open_recorder(self.session_name, session_settings=self.settings)
+        self.limiter = TokenBucket(rate=self.settings.REQUESTS_PER_SECOND, capacity=self.settings.REQUESTS_BURST)
+
+        self.headers = dict(headers)
+        if self.settings.AUTO_GENERATE_USER_AGENT_FOR_EACH_SESSION == True:
+            self.headers['User-Agent'] = self.get_user_agent()
         else:
-            headers['User-Agent'] = user_agents[0]
-
-    def get_random_user_agent(self):
-        """Returns a random user agent from the list."""
-        return random.choice(user_agents)
-
-    # Function to save session data to JSON file
-    def save_session_data(self, session_dict):
-        with open('session_user_agents.json', 'w') as file:
-            json.dump(session_dict, file, indent=4)
+            self.headers['User-Agent'] = user_agents[0]
 
-    # Function to load session data from JSON file
-    def load_session_data(self):
-        try:
-            with open('session_user_agents.json', 'r') as file:
-                return json.load(file)
-        except FileNotFoundError:
-            return {}
-        
     def get_user_agent(self):
         """Returns the user agent for a given session ID.
         If no user agent is assigned to the session ID, assigns a new random one."""
-        if self.session_name in self.session_dict:
-            return self.session_dict[self.session_name]
+        user_agent = session_registry.get(self.session_name, 'user_agent')
+        if user_agent:
+            return user_agent
 
-        # Generate a random user agent and check if it's already assigned to another session
+        # Prefer a user agent no other session uses, reuse one once every agent is taken
         logger.info(f"{self.session_name} | Generating new user agent...")
-        new_user_agent = self.get_random_user_agent()
-        while any(new_user_agent == agent for agent in self.session_dict.values()):
-            new_user_agent = self.get_random_user_agent()
+        unused_user_agents = [agent for agent in user_agents
+                              if not session_registry.sessions_with('user_agent', agent)]
+        user_agent = random.choice(unused_user_agents or user_agents)
 
-        self.session_dict[self.session_name] = new_user_agent
-        self.save_session_data(self.session_dict)
-        return new_user_agent
+        session_registry.set(self.session_name, 'user_agent', user_agent)
+        return user_agent
         
     async def get_tg_web_data(self, proxy: str | None):
-        if proxy:
-            proxy = Proxy.from_str(proxy)
-            proxy_dict = dict(
-                scheme=proxy.protocol,
-                hostname=proxy.host,
-                port=proxy.port,
-                username=proxy.login,
-                password=proxy.password
-            )
-        else:
-            proxy_dict = None
+        if self.cassette is not None:
+            return await self.cassette.web_data(partial(self.request_tg_web_data, proxy))
+        return await self.request_tg_web_data(proxy)
 
-        self.tg_client.proxy = proxy_dict
+    async def request_tg_web_data(self, proxy: str | None):
+        self.tg_client.proxy = get_proxy_dict(proxy)
 
         try:
-            if not self.tg_client.is_connected:
-                try:
-                    await self.tg_client.connect()
-                except (Unauthorized, UserDeactivated, AuthKeyUnregistered):
-                    raise InvalidSession(self.session_name)
-
-            web_view = await self.tg_client.invoke(RequestWebView(
-                peer=await self.tg_client.resolve_peer('memefi_coin_bot'),
-                bot=await self.tg_client.resolve_peer('memefi_coin_bot'),
-                platform='android',
-                from_bot_menu=False,
-                url='https://tg-app.memefi.club/game'
-            ))
+            async with tg_pool.connection(self.tg_client):
+                bot_peer = await peer_cache.get_bot_peer(self.tg_client)
+                web_view = await self.tg_client.invoke(RequestWebView(
+                    peer=bot_peer,
+                    bot=bot_peer,
+                    platform='android',
+                    from_bot_menu=False,
+                    url='https://tg-app.memefi.club/game'
+                ))
+
+                me = await peer_cache.get_me(self.tg_client)
 
             auth_url = web_view.url
             tg_web_data = unquote(
@@ -108,665 +130,527 @@ class Tapper:
             auth_date = tg_web_data.split('auth_date=', maxsplit=1)[1].split('&hash', maxsplit=1)[0]
             hash_ = tg_web_data.split('hash=', maxsplit=1)[1]
 
-            me = await self.tg_client.get_me()
-
-            json_data = {
-                'operationName': OperationName.MutationTelegramUserLogin,
-                'query': Query.MutationTelegramUserLogin,
-                'variables': {
-                    'webAppData': {
-                        'auth_date': int(auth_date),
-                        'hash': hash_,
-                        'query_id': query_id,
-                        'checkDataString': f'auth_date={auth_date}\nquery_id={query_id}\nuser={user_data}',
-                        'user': {
-                            'id': me.id,
-                            'allows_write_to_pm': True,
-                            'first_name': me.first_name,
-                            'last_name': me.last_name if me.last_name else '',
-                            'username': me.username if me.username else '',
-                            'language_code': me.language_code if me.language_code else 'en',
-                            'platform': 'ios',
-                            'version': '7.2'
-                        },
+            web_app_data = {
+                'webAppData': {
+                    'auth_date': int(auth_date),
+                    'hash': hash_,
+                    'query_id': query_id,
+                    'checkDataString': f'auth_date={auth_date}\nquery_id={query_id}\nuser={user_data}',
+                    'user': {
+                        'id': me['id'],
+                        'allows_write_to_pm': True,
+                        'first_name': me['first_name'],
+                        'last_name': me['last_name'] if me['last_name'] else '',
+                        'username': me['username'] if me['username'] else '',
+                        'language_code': me['language_code'] if me['language_code'] else 'en',
+                        'platform': 'ios',
+                        'version': '7.2'
                     },
-                }
+                },
             }
 
-            if self.tg_client.is_connected:
-                await self.tg_client.disconnect()
+            return web_app_data
 
-            return json_data
-
-        except InvalidSession as error:
-            raise error
+        except (Unauthorized, UserDeactivated, AuthKeyUnregistered):
+            raise InvalidSession(self.session_name)
 
         except Exception as error:
             logger.error(f"{self.session_name} | ❗️Unknown error during Authorization: {error}")
-            await asyncio.sleep(delay=3)
+            peer_cache.delete(self.session_name)
+
+    async def get_access_token(self, tg_web_data: dict[str]):
+        data = await self.api.execute(OperationName.MutationTelegramUserLogin, variables=tg_web_data,
+                                      action='getting Access Token')
+        if data:
+            return data['telegramUserLogin']['access_token']
+
+    async def get_profile_data(self) -> GameConfig | None:
+        data = await self.api.execute(OperationName.QUERY_GAME_CONFIG, action='getting Profile Data')
+        if data:
+            return GameConfig.from_dict(data['telegramGameGetConfig'])
+
+    async def get_user_data(self) -> User | None:
+        data = await self.api.execute(OperationName.QueryTelegramUserMe, action='getting User Data')
+        if data:
+            return User.from_dict(data['telegramUserMe'])
+
+    async def set_next_boss(self):
+        data = await self.api.execute(OperationName.telegramGameSetNextBoss, action='Setting Next Boss')
+        return data is not None
+
+    async def get_bot_config(self) -> TapbotConfig | None:
+        data = await self.api.execute(OperationName.TapbotConfig, action='getting Bot Config')
+        if data:
+            return TapbotConfig.from_dict(data['telegramGameTapbotGetConfig'])
+
+    async def start_bot(self):
+        data = await self.api.execute(OperationName.TapbotStart, action='Starting Bot')
+        return data is not None
+
+    async def claim_bot(self):
+        data = await self.api.execute(OperationName.TapbotClaim, action='Claiming Bot')
+        if data is None or data.get("telegramGameTapbotClaimCoins") is None:
+            return {"isClaimed": True, "data": None}
+
+        return {"isClaimed": False, "data": TapbotConfig.from_dict(data["telegramGameTapbotClaimCoins"])}
+
+    async def spin_game(self):
+        data = await self.api.execute(OperationName.Spinner, action='Spinning')
+        return data or False
+
+    async def claim_referral_bonus(self):
+        data = await self.api.execute(OperationName.Mutation, action='Claiming Referral Bonus')
+        return data is not None
+
+    async def apply_boost(self, boost_type: FreeBoostType):
+        data = await self.api.execute(OperationName.telegramGameActivateBooster,
+                                      variables={'boosterType': boost_type},
+                                      action=f'Apply {boost_type} Boost')
+        return data is not None
+
+    async def upgrade_boost(self, boost_type: UpgradableBoostType) -> tuple[GameConfig | None, bool]:
+        """The profile after the purchase, and whether a failed purchase was refused for the balance.
+        Other failures (rate limits, server and connection errors) say nothing about the price."""
+        errors = []
+        data = await self.api.execute(OperationName.telegramGamePurchaseUpgrade,
+                                      variables={'upgradeType': boost_type},
+                                      action=f'Upgrading {boost_type}', errors=errors)
+        if data:
+            return GameConfig.from_dict(data['telegramGamePurchaseUpgrade']), False
+        return None, is_insufficient_balance(errors)
+
+    async def get_game_state(self) -> tuple[TapbotConfig | None, User | None, GameConfig | None]:
+        """Fetches bot config, user data and profile data, batched into one request when enabled."""
+        bot_config, user_data, profile_data = await self.api.execute_batch([
+            (OperationName.TapbotConfig, None),
+            (OperationName.QueryTelegramUserMe, None),
+            (OperationName.QUERY_GAME_CONFIG, None),
+        ])
+
+        return (TapbotConfig.from_dict(bot_config['telegramGameTapbotGetConfig']) if bot_config else None,
+                User.from_dict(user_data['telegramUserMe']) if user_data else None,
+                GameConfig.from_dict(profile_data['telegramGameGetConfig']) if profile_data else None)
+
+    async def send_taps(self, nonce: str, taps: int) -> GameConfig | None:
+        vectorArray = []
+        for tap in range(taps):
+            """ check if tap is greater than 4 or less than 1 and set tap to random number between 1 and 4"""
+            if tap > 4 or tap < 1:
+                tap = randint(1, 4)
+            vectorArray.append(tap)
+
+        vector = ",".join(str(x) for x in vectorArray)
+        data = await self.api.execute(OperationName.MutationGameProcessTapsBatch,
+                                      variables={
+                                          'payload': {
+                                              'nonce': nonce,
+                                              'tapsCount': taps,
+                                              'vector': vector
+                                          },
+                                      },
+                                      action='Tapping')
+        if data:
+            return GameConfig.from_dict(data['telegramGameProcessTapsBatch'])
+
+    async def start(self, proxy: str | None) -> None:
+        self.proxy = proxy
+
+        json_serialize = fast.dumps if self.settings.FAST_MODE else json.dumps
+        self.http_client = aiohttp.ClientSession(headers=self.headers, connector=connector_pool.get(proxy),
+                                                 connector_owner=False, json_serialize=json_serialize)
+        if self.cassette is not None:
+            self.http_client = self.cassette.wrap(self.http_client)
+        self.api = GraphQLClient(http_client=self.http_client, session_name=self.session_name, limiter=self.limiter,
+                                 egress_limiter=get_egress_limiter(proxy),
+                                 batching=self.settings.USE_BATCH_REQUESTS,
+                                 slim_queries=self.settings.GRAPHQL_SLIM_QUERIES,
+                                 persisted_queries=self.settings.GRAPHQL_PERSISTED_QUERIES,
+                                 settings=self.settings)
+
+        metrics.session_info.set(1, session=self.session_name, proxy=mask_proxy(proxy))
+
+        cached_token = token_store.get(self.session_name, margin=self.settings.TOKEN_REFRESH_MARGIN)
+        if self.cassette is not None:
+            cached_token = await self.cassette.cached_token(cached_token)
+        if cached_token:
+            self.set_access_token(*cached_token)
+            logger.info(f"{self.session_name} | Using cached access token")
+
+    def set_access_token(self, access_token: str, expires_at: float) -> None:
+        self.http_client.headers["Authorization"] = f"Bearer {access_token}"
+        self.access_token_expires_at = expires_at
+
+    async def close(self) -> None:
+        if self.http_client is not None:
+            await self.http_client.close()
+            self.http_client = None
+
+    async def stop(self) -> None:
+        """Closes the session for good, `close` alone is also used to switch proxies."""
+        await self.close()
+        if self.cassette is not None:
+            self.cassette.close()
 
-    async def get_access_token(self, http_client: aiohttp.ClientSession, tg_web_data: dict[str]):
+    async def run(self, proxy: str | None):
+        await self.start(proxy=proxy)
         try:
-            response = await http_client.post(url=self.GRAPHQL_URL, json=tg_web_data)
-            response.raise_for_status()
-
-            response_json = await response.json()
-            access_token = response_json['data']['telegramUserLogin']['access_token']
-
-            return access_token
-        except aiohttp.ClientResponseError as error:
-            if error.status == 429:
-                if 'Retry-After' in error.headers:
-                    retry_after = int(error.headers['Retry-After'])
-                    logger.error(f"{self.session_name} | Too many requests. Sleeping for {retry_after} seconds...")
-                    await asyncio.sleep(retry_after)
-                else:
-                    logger.error(f"{self.session_name} | Too many requests. Sleeping for 60 seconds...")
-                    await asyncio.sleep(60)  # Wait for 60 seconds
-            else:
-                logger.error(f"{self.session_name} | ❗️Unknown error while getting Access Token: {error}")
-                await asyncio.sleep(delay=3)
-
-    async def get_profile_data(self, http_client: aiohttp.ClientSession):
+            while True:
+                delay = await self.step()
+                await asyncio.sleep(delay=delay)
+        finally:
+            await self.stop()
+
+    async def switch_proxy(self, proxy: str | None) -> None:
+        metrics.session_info.set(0, session=self.session_name, proxy=mask_proxy(self.proxy))
+        await self.close()
+        await self.start(proxy=proxy)
+
+    def apply_settings(self) -> None:
+        """Switches the session, its rate limiter and its GraphQL client to the reloaded settings."""
+        self.settings = settings_reloader.for_session(self.session_name)
+        self.settings_generation = settings_reloader.generation
+        self.limiter.configure(rate=self.settings.REQUESTS_PER_SECOND, capacity=self.settings.REQUESTS_BURST)
+        if self.api is not None:
+            self.api.configure(self.settings)
+
+    def get_failure_delay(self) -> float:
+        """Delay after a failed step: exponential backoff with jitter while steps keep failing,
+        at least until an open circuit or a Retry-After lets the session send requests again."""
+        self.failed_steps += 1
+        delay = backoff(self.failed_steps - 1, base=self.settings.RETRY_BASE_DELAY,
+                        maximum=self.settings.RETRY_MAX_DELAY)
+        parked_for = self.api.parked_for() if self.api is not None else 0
+
+        return max(delay, jitter(parked_for))
+
+    async def step(self) -> float:
+        """Runs one iteration of the tap loop and returns the delay in seconds until it's due again."""
+        # Picked up once per step, so a reload never changes settings halfway through one
+        if self.settings_generation != settings_reloader.generation:
+            self.apply_settings()
+        proxy = proxy_pool.get(self.session_name, default=self.proxy)
+        if proxy != self.proxy:
+            await self.switch_proxy(proxy)
+
+        if self.api is not None and self.api.parked_for() > 0:
+            return jitter(self.api.parked_for())
+
+        phase, self.next_phase = self.next_phase, None
+        if phase is None:
+            phase = self.play
+            # Later phases of the turn keep its place in the egress queue
+            self.api.step_started_at = monotonic()
         try:
-            json_data = {
-                'operationName': OperationName.QUERY_GAME_CONFIG,
-                'query': Query.QUERY_GAME_CONFIG,
-                'variables': {}
-            }
+            return await phase()
 
-            response = await http_client.post(url=self.GRAPHQL_URL, json=json_data)
-            response.raise_for_status()
-
-            response_json = await response.json()
-            profile_data = response_json['data']['telegramGameGetConfig']
-            
-            return profile_data
-        except aiohttp.ClientResponseError as error:
-            if error.status == 429:
-                if 'Retry-After' in error.headers:
-                    retry_after = int(error.headers['Retry-After'])
-                    logger.error(f"{self.session_name} | Too many requests. Sleeping for {retry_after} seconds...")
-                    await asyncio.sleep(retry_after)
-                else:
-                    logger.error(f"{self.session_name} | Too many requests. Sleeping for 60 seconds...")
-                    await asyncio.sleep(60)  # Wait for 60 seconds
-            else:
-                logger.error(f"{self.session_name} | ❗️Unknown error while getting Profile Data: {error}")
-                await asyncio.sleep(delay=3)
-
-    async def get_user_data(self, http_client: aiohttp.ClientSession):
-        try:
-            json_data = {
-                'operationName': OperationName.QueryTelegramUserMe,
-                'query': Query.QueryTelegramUserMe,
-                'variables': {}
-            }
+        except InvalidSession as error:
+            raise error
 
-            response = await http_client.post(url=self.GRAPHQL_URL, json=json_data)
-            response.raise_for_status()
-
-            response_json = await response.json()
-            user_data = response_json['data']['telegramUserMe']
-            
-
-            return user_data
-        except aiohttp.ClientResponseError as error:
-            if error.status == 429:
-                if 'Retry-After' in error.headers:
-                    retry_after = int(error.headers['Retry-After'])
-                    logger.error(f"{self.session_name} | Too many requests. Sleeping for {retry_after} seconds...")
-                    await asyncio.sleep(retry_after)
-                else:
-                    logger.error(f"{self.session_name} | Too many requests. Sleeping for 60 seconds...")
-                    await asyncio.sleep(60)  # Wait for 60 seconds
-            else:
-                logger.error(f"{self.session_name} | ❗️Unknown error while getting User Data: {error}")
-                await asyncio.sleep(delay=3)
-
-    async def set_next_boss(self, http_client: aiohttp.ClientSession):
-        try:
-            json_data = {
-                'operationName': OperationName.telegramGameSetNextBoss,
-                'query': Query.telegramGameSetNextBoss,
-                'variables': {}
-            }
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as error:
+            if self.proxy:
+                proxy_pool.record(self.proxy, None)
+            logger.warning(f"{self.session_name} | Connection error: {error!r}")
+            return self.get_failure_delay()
 
-            response = await http_client.post(url=self.GRAPHQL_URL, json=json_data)
-            response.raise_for_status()
-
-            return True
-        except aiohttp.ClientResponseError as error:
-            if error.status == 429:
-                if 'Retry-After' in error.headers:
-                    retry_after = int(error.headers['Retry-After'])
-                    logger.error(f"{self.session_name} | Too many requests. Sleeping for {retry_after} seconds...")
-                    await asyncio.sleep(retry_after)
-                else:
-                    logger.error(f"{self.session_name} | Too many requests. Sleeping for 60 seconds...")
-                    await asyncio.sleep(60)  # Wait for 60 seconds
-            else:
-                logger.error(f"{self.session_name} | ❗️Unknown error while Setting Next Boss: {error}")
-                await asyncio.sleep(delay=3)
+        except Exception as error:
+            # Without colors, so markup-like text in the traceback (`<listcomp>`) isn't parsed
+            logger.opt(exception=error).error(f"{self.session_name} | ❗️Unknown error with Tapper: {error}")
+            return self.get_failure_delay()
 
-            return False
-        
-    async def get_bot_config(self, http_client: aiohttp.ClientSession):
-        try:
-            json_data = {
-                'operationName': OperationName.TapbotConfig,
-                'query': Query.TapbotConfig,
-                'variables': {}
-            }
+    def get_due_delay(self, delay: float, profile_data: GameConfig, bot_config: TapbotConfig | None) -> float:
+        """Shortens `delay` so the session wakes up when the tapbot can be claimed, a spin recharges
+        or the daily boosts it applies are given back."""
+        timestamps = []
 
-            response = await http_client.post(url=self.GRAPHQL_URL, json=json_data)
-            response.raise_for_status()
-
-            response_json = await response.json()
-            bot_config = response_json['data']['telegramGameTapbotGetConfig']
-            return bot_config
-        except aiohttp.ClientResponseError as error:
-            if error.status == 429:
-                if 'Retry-After' in error.headers:
-                    retry_after = int(error.headers['Retry-After'])
-                    logger.error(f"{self.session_name} | Too many requests. Sleeping for {retry_after} seconds...")
-                    await asyncio.sleep(retry_after)
-                else:
-                    logger.error(f"{self.session_name} | Too many requests. Sleeping for 60 seconds...")
-                    await asyncio.sleep(60)  # Wait for 60 seconds
-            else:
-                logger.error(f"{self.session_name} | ❗️Unknown error while getting Bot Config: {error}")
-                await asyncio.sleep(delay=3)
-    
-    async def start_bot(self, http_client: aiohttp.ClientSession):
-        try:
-            json_data = {
-                'operationName': OperationName.TapbotStart,
-                'query': Query.TapbotStart,
-                'variables': {}
-            }
+        if bot_config and bot_config.is_purchased and bot_config.ends_at:
+            timestamps.append(bot_config.ends_at)
 
-            response = await http_client.post(url=self.GRAPHQL_URL, json=json_data)
-            response.raise_for_status()
-
-            return True
-        except aiohttp.ClientResponseError as error:
-            if error.status == 429:
-                if 'Retry-After' in error.headers:
-                    retry_after = int(error.headers['Retry-After'])
-                    logger.error(f"{self.session_name} | Too many requests. Sleeping for {retry_after} seconds...")
-                    await asyncio.sleep(retry_after)
-                else:
-                    logger.error(f"{self.session_name} | Too many requests. Sleeping for 60 seconds...")
-                    await asyncio.sleep(60)  # Wait for 60 seconds
-            else:
-                logger.error(f"{self.session_name} | ❗️Unknown error while Starting Bot: {error}")
-                await asyncio.sleep(delay=3)
+        if self.settings.AUTO_SPIN is True and profile_data.spin_energy_next_recharge_at:
+            timestamps.append(profile_data.spin_energy_next_recharge_at)
 
-            return False
-    
-    async def claim_bot(self, http_client: aiohttp.ClientSession):
-        try:
-            json_data = {
-                'operationName': OperationName.TapbotClaim,
-                'query': Query.TapbotClaim,
-                'variables': {}
-            }
+        if self.settings.APPLY_DAILY_TURBO is True and profile_data.free_boosts.next_turbo_at:
+            timestamps.append(profile_data.free_boosts.next_turbo_at)
 
-            response = await http_client.post(url=self.GRAPHQL_URL, json=json_data)
-            response.raise_for_status()
-            response_json = await response.json()
-            if response_json is None:
-                logger.error("Response JSON is None")
-                return None
-
-            data = response_json.get('data')
-            
-            if data is None:
-                logger.error("'data' key not found or is None in the response JSON")
-                return None
-
-            tapbotClaim = data.get("telegramGameTapbotClaimCoins")
-            
-            if tapbotClaim is None:
-                logger.error("'telegramGameTapbotClaimCoins' key not found or is None in 'data'")
-                return None
-
-            return  {"isClaimed": False, "data": tapbotClaim}
-        except aiohttp.ClientResponseError as error:
-            if error.status == 429:
-                if 'Retry-After' in error.headers:
-                    retry_after = int(error.headers['Retry-After'])
-                    logger.error(f"{self.session_name} | Too many requests. Sleeping for {retry_after} seconds...")
-                    await asyncio.sleep(retry_after)
-                    return {"isClaimed": True, "data": None}
-                else:
-                    logger.error(f"{self.session_name} | Too many requests. Sleeping for 60 seconds...")
-                    await asyncio.sleep(60)  # Wait for 60 seconds
-                    return {"isClaimed": True, "data": None}
-            else:
-                return {"isClaimed": True, "data": None}
-        
-    async def spin_game(self, http_client: aiohttp.ClientSession):
-        try:
-            json_data = {
-                'operationName': OperationName.Spinner,
-                'query': Query.Spinner,
-                'variables': {}
-            }
+        if self.settings.APPLY_DAILY_ENERGY is True and profile_data.free_boosts.next_refill_energy_at:
+            timestamps.append(profile_data.free_boosts.next_refill_energy_at)
 
-            response = await http_client.post(url=self.GRAPHQL_URL, json=json_data)
-            response.raise_for_status()
-
-            response_json = await response.json()
-            return response_json["data"]
-        except aiohttp.ClientResponseError as error:
-            if error.status == 429:
-                if 'Retry-After' in error.headers:
-                    retry_after = int(error.headers['Retry-After'])
-                    logger.error(f"{self.session_name} | Too many requests. Sleeping for {retry_after} seconds...")
-                    await asyncio.sleep(retry_after)
-                else:
-                    logger.error(f"{self.session_name} | Too many requests. Sleeping for 60 seconds...")
-                    await asyncio.sleep(60)  # Wait for 60 seconds
-            else:
-                logger.error(f"{self.session_name} | ❗️Unknown error while Claiming Referral Bonus: {error}")
-                await asyncio.sleep(delay=3)
+        now = time()
+        due_in = [delay] + [timestamp - now for timestamp in timestamps if timestamp > now]
 
-            return False
-        
-    async def claim_referral_bonus(self, http_client: aiohttp.ClientSession):
-        try:
-            json_data = {
-                'operationName': OperationName.Mutation,
-                'query': Query.Mutation,
-                'variables': {}
-            }
+        return max(min(due_in), 1)
 
-            response = await http_client.post(url=self.GRAPHQL_URL, json=json_data)
-            response.raise_for_status()
-
-            return True
-        except aiohttp.ClientResponseError as error:
-            if error.status == 429:
-                if 'Retry-After' in error.headers:
-                    retry_after = int(error.headers['Retry-After'])
-                    logger.error(f"{self.session_name} | Too many requests. Sleeping for {retry_after} seconds...")
-                    await asyncio.sleep(retry_after)
-                else:
-                    logger.error(f"{self.session_name} | Too many requests. Sleeping for 60 seconds...")
-                    await asyncio.sleep(60)  # Wait for 60 seconds
-            else:
-                logger.error(f"{self.session_name} | ❗️Unknown error while Spinning: {error}")
-                await asyncio.sleep(delay=3)
+    def get_energy_delay(self, profile_data: GameConfig, needed_energy: int) -> float:
+        """Seconds until `needed_energy` is available at the current recharge level."""
+        return max(profile_data.seconds_until_energy(needed_energy), 1)
 
+    async def buy_upgrade(self, turn: Turn) -> bool:
+        """Buys the planned upgrade if the balance covers it and learns its price from the balance change."""
+        costs = self.cassette.upgrade_costs(upgrade_costs) if self.cassette is not None else upgrade_costs
+        upgrade = plan_upgrade(config=turn.profile_data, tapbot=turn.bot_config, settings=self.settings, costs=costs)
+        if upgrade is None:
             return False
 
-    async def apply_boost(self, http_client: aiohttp.ClientSession, boost_type: FreeBoostType):
-        try:
-            json_data = {
-                'operationName': OperationName.telegramGameActivateBooster,
-                'query': Query.telegramGameActivateBooster,
-                'variables': {
-                    'boosterType': boost_type
-                }
-            }
-
-            response = await http_client.post(url=self.GRAPHQL_URL, json=json_data)
-            response.raise_for_status()
-
-            return True
-        except aiohttp.ClientResponseError as error:
-            if error.status == 429:
-                if 'Retry-After' in error.headers:
-                    retry_after = int(error.headers['Retry-After'])
-                    logger.error(f"{self.session_name} | Too many requests. Sleeping for {retry_after} seconds...")
-                    await asyncio.sleep(retry_after)
-                else:
-                    logger.error(f"{self.session_name} | Too many requests. Sleeping for 60 seconds...")
-                    await asyncio.sleep(60)  # Wait for 60 seconds
-            else:
-                logger.error(f"{self.session_name} | ❗️Unknown error while Apply {boost_type} Boost: {error}")
-                await asyncio.sleep(delay=3)
-
+        result, insufficient_balance = await self.upgrade_boost(boost_type=upgrade.boost_type)
+        if result is None:
+            if insufficient_balance:
+                upgrade_costs.record_failure(upgrade.boost_type, upgrade.level,
+                                             balance=turn.profile_data.coins_amount)
             return False
 
-    async def upgrade_boost(self, http_client: aiohttp.ClientSession, boost_type: UpgradableBoostType):
-        try:
-            json_data = {
-                'operationName': OperationName.telegramGamePurchaseUpgrade,
-                'query': Query.telegramGamePurchaseUpgrade,
-                'variables': {
-                    'upgradeType': boost_type
-                }
-            }
-
-            response = await http_client.post(url=self.GRAPHQL_URL, json=json_data)
-            response.raise_for_status()
-
-            return True
-        except aiohttp.ClientResponseError as error:
-            if error.status == 429:
-                if 'Retry-After' in error.headers:
-                    retry_after = int(error.headers['Retry-After'])
-                    logger.error(f"{self.session_name} | Too many requests. Sleeping for {retry_after} seconds...")
-                    await asyncio.sleep(retry_after)
-                else:
-                    logger.error(f"{self.session_name} | Too many requests. Sleeping for 60 seconds...")
-                    await asyncio.sleep(60)  # Wait for 60 seconds
-            else:
-                return False
-
-    async def send_taps(self, http_client: aiohttp.ClientSession, nonce: str, taps: int):
-        try:
-            vectorArray = []
-            for tap in range(taps):
-                """ check if tap is greater than 4 or less than 1 and set tap to random number between 1 and 4"""
-                if tap > 4 or tap < 1:
-                    tap = randint(1, 4)
-                vectorArray.append(tap)
-
-            vector = ",".join(str(x) for x in vectorArray)            
-            json_data = {
-                'operationName': OperationName.MutationGameProcessTapsBatch,
-                'query': Query.MutationGameProcessTapsBatch,
-                'variables': {
-                    'payload': {
-                        'nonce': nonce,
-                        'tapsCount': taps,
-                        'vector': vector
-                    },
-                }
-            }
-
-            response = await http_client.post(url=self.GRAPHQL_URL, json=json_data)
-            response.raise_for_status()
-
-            response_json = await response.json()
-            profile_data = response_json['data']['telegramGameProcessTapsBatch']
-            return profile_data
-        except aiohttp.ClientResponseError as error:
-            if error.status == 429:
-                if 'Retry-After' in error.headers:
-                    retry_after = int(error.headers['Retry-After'])
-                    logger.error(f"{self.session_name} | Too many requests. Sleeping for {retry_after} seconds...")
-                    await asyncio.sleep(retry_after)
-                else:
-                    logger.error(f"{self.session_name} | Too many requests. Sleeping for 60 seconds...")
-                    await asyncio.sleep(60)  # Wait for 60 seconds
-            else:
-                logger.error(f"{self.session_name} | Unknown error when Tapping: {error}")
-                await asyncio.sleep(10)
-
-    async def check_proxy(self, http_client: aiohttp.ClientSession, proxy: Proxy) -> None:
-        try:
-            response = await http_client.get(url='https://api.ipify.org?format=json', timeout=aiohttp.ClientTimeout(10))
-            ip = (await response.json()).get('ip')
-            logger.info(f"{self.session_name} | Proxy IP: {ip}")
-        except aiohttp.ClientResponseError as error:
-            logger.error(f"{self.session_name} | Proxy: {proxy} | Error: {error}")
-
-    async def run(self, proxy: str | None):
-        access_token_created_time = 0
-        turbo_time = 0
-        active_turbo = False
-        noBalance = False
-       
-        context = CustomTLSContext.create_custom_ssl_context()
-        connector = ProxyConnector().from_url(url=proxy, rdns=True, ssl=context) if proxy \
-            else aiohttp.TCPConnector(ssl=context)
-
-        async with aiohttp.ClientSession(headers=headers, connector=connector) as http_client:
-            if proxy:
-                await self.check_proxy(http_client=http_client, proxy=proxy)
-
-            while True:
-                noBalance = False
-                try:
-                    if time() - access_token_created_time >= 3600:
-                        tg_web_data = await self.get_tg_web_data(proxy=proxy)
-                        access_token = await self.get_access_token(http_client=http_client, tg_web_data=tg_web_data)
-
-                        http_client.headers["Authorization"] = f"Bearer {access_token}"
-                        headers["Authorization"] = f"Bearer {access_token}"
-
-                        access_token_created_time = time()
-
-                        profile_data = await self.get_profile_data(http_client=http_client)
-
-                        balance = profile_data['coinsAmount']
-
-                        nonce = profile_data['nonce']
-
-                        current_boss = profile_data['currentBoss']
-                        current_boss_level = current_boss['level']
-                        boss_max_health = current_boss['maxHealth']
-                        boss_current_health = current_boss['currentHealth']
-
-                        logger.info(f"{self.session_name} | Current boss level: <m>{current_boss_level}</m> | "
-                                    f"Boss health: <e>{boss_current_health}</e> out of <r>{boss_max_health}</r>")
-
-                        await asyncio.sleep(delay=.5)
-
-
-                    taps = randint(a=settings.RANDOM_TAPS_COUNT[0], b=settings.RANDOM_TAPS_COUNT[1])
-                    bot_config = await self.get_bot_config(http_client=http_client)
-                    telegramMe = await self.get_user_data(http_client=http_client)
-
-                    profile_data = await self.get_profile_data(http_client=http_client)
-
-                    if not profile_data:
-                        continue
-
-                    available_energy = profile_data['currentEnergy']
-
-                    free_boosts = profile_data['freeBoosts']
-                    turbo_boost_count = free_boosts['currentTurboAmount']
-                    energy_boost_count = free_boosts['currentRefillEnergyAmount']
-
-                    next_tap_level = profile_data['weaponLevel'] + 1
-                    next_energy_level = profile_data['energyLimitLevel'] + 1
-                    next_charge_level = profile_data['energyRechargeLevel'] + 1
-
-                    nonce = profile_data['nonce']
-
-                    current_boss = profile_data['currentBoss']
-                    current_boss_level = current_boss['level']
-                    boss_current_health = current_boss['currentHealth']
-                    min_energy = taps * profile_data['weaponLevel']
-                    balance = profile_data['coinsAmount']
-                    spinEnergyTotal = profile_data["spinEnergyTotal"]
-                    rewardAmount = 0
-                    rewardType = ""
-
-                    if spinEnergyTotal > 0 and settings.AUTO_SPIN is True:
-                        game_result = await self.spin_game(http_client=http_client)
-                        if game_result:
-                            rewardAmount = game_result["slotMachineSpin"]["rewardAmount"]
-                            rewardType = game_result["slotMachineSpin"]["rewardType"]
-                            profile_data = await self.get_profile_data(http_client=http_client)
-                            spinEnergyTotal = profile_data["spinEnergyTotal"]
-                            balance = profile_data["coinsAmount"]
-                            logger.info(f"{self.session_name} | 🔥Reward Amount: <c>{rewardAmount}</c> | Reward Type: <m>{rewardType}</m> | Available Spin: <e>{spinEnergyTotal}</e>")
-
-                            await asyncio.sleep(delay=1)
-
-                    if min_energy >= available_energy:
-                        logger.warning(f"{self.session_name} | Not enough energy to send {taps} taps. "
-                                       f"Needed <le>{min_energy+1}</le> energy to send taps"
-                                       f" | Available: <ly>{available_energy}</ly>")
-                        if (energy_boost_count > 0
-                            and settings.APPLY_DAILY_ENERGY is True):
-                            logger.info(f"{self.session_name} | 😴 Sleep 5s before activating the daily energy boost")
-                            await asyncio.sleep(delay=5)
-
-                            status = await self.apply_boost(http_client=http_client, boost_type=FreeBoostType.ENERGY)
-                            if status is True:
-                                logger.success(f"{self.session_name} | 👉 Energy boost applied")
-
-                                await asyncio.sleep(delay=1)
-
-                            continue
-
-
-                        logger.info("Sleep 50s")
-                        await asyncio.sleep(delay=50)
-
-                        profile_data = await self.get_profile_data(http_client=http_client)
-
-                        continue
-
-                    if active_turbo:
-                        taps += settings.ADD_TAPS_ON_TURBO
-                        if time() - turbo_time > 10:
-                            active_turbo = False
-                            turbo_time = 0
-
-                    profile_data = await self.send_taps(http_client=http_client, nonce=nonce, taps=taps)
-                    new_balance = profile_data['coinsAmount']
-                    calc_taps = new_balance - balance
-                    balance = new_balance
-
-                    if telegramMe['isReferralInitialJoinBonusAvailable'] is True:
-                        await self.claim_referral_bonus(http_client=http_client)
-                        logger.info(f"{self.session_name} | 🔥Referral bonus was claimed")
-                    
-                    if bot_config['isPurchased'] is False and settings.AUTO_BUY_TAPBOT is True:
-                        if  balance >= 200000:
-                            await self.upgrade_boost(http_client=http_client, boost_type=UpgradableBoostType.TAPBOT)
-                            logger.info(f"{self.session_name} | 👉 Tapbot was purchased - 😴 Sleep 3s")
-                            await asyncio.sleep(delay=3)
-                            bot_config = await self.get_bot_config(http_client=http_client)
-                        else:
-                            logger.info(f"{self.session_name} | 👉 Tapbot wasn't purchased due to insufficient balance - 😴 Sleep 3s")
-                            await asyncio.sleep(delay=3)
-                            bot_config = await self.get_bot_config(http_client=http_client)
-                    if bot_config['isPurchased'] is True:
-                        if bot_config['usedAttempts'] < bot_config['totalAttempts'] and bot_config['endsAt'] is None:
-                            await self.start_bot(http_client=http_client)
-                            bot_config = await self.get_bot_config(http_client=http_client)
-                            logger.info(f"{self.session_name} | 👉 Tapbot is started")
-
-                        else:
-                            if bot_config['endsAt'] is not None:
-                                current_datetime_utc = datetime.now().astimezone()
-                                given_datetime_str = bot_config['endsAt']
-                                given_datetime = datetime.fromisoformat(given_datetime_str.replace("Z", "+00:00"))
-
-                                if(given_datetime <= current_datetime_utc):
-                                    tapbotClaim = await self.claim_bot(http_client=http_client)
-                                    if tapbotClaim['isClaimed'] == False and tapbotClaim['data']:
-                                        logger.info(f"{self.session_name} | 👉 Tapbot was claimed - 😴 Sleep 5s before starting again")
-                                        await asyncio.sleep(delay=3)
-                                        bot_config = tapbotClaim['data']
-                                        await asyncio.sleep(delay=2)
-
-                                        if bot_config['usedAttempts'] < bot_config['totalAttempts']:
-                                            await self.start_bot(http_client=http_client)
-                                            logger.info(f"{self.session_name} | 👉 Tapbot is started - 😴 Sleep 5s")
-                                            await asyncio.sleep(delay=5)
-                                            bot_config = await self.get_bot_config(http_client=http_client)
-                    
-                    if calc_taps > 0:
-                        logger.success(f"{self.session_name} | ✅ Successful tapped! 🔨 | "
-                                    f"Balance: <c>{balance}</c> (<g>+{calc_taps} 😊</g>) | "
-                                    f"Boss health: <e>{boss_current_health}</e>")
-                    else:
-                        noBalance = True
-
-                    if boss_current_health <= 0:
-                        logger.info(f"{self.session_name} | 👉 Setting next boss: <m>{current_boss_level+1}</m> lvl")
-
-                        status = await self.set_next_boss(http_client=http_client)
-                        if status is True:
-                            logger.success(f"{self.session_name} | ✅ Successful setting next boss: "
-                                        f"<m>{current_boss_level+1}</m>")
-
-
-                    if active_turbo is False:
-                        if (energy_boost_count > 0
-                            and available_energy < settings.MIN_AVAILABLE_ENERGY
-                            and settings.APPLY_DAILY_ENERGY is True):
-                            logger.info(f"{self.session_name} | 😴 Sleep 5s before activating the daily energy boost")
-                            await asyncio.sleep(delay=5)
-
-                            status = await self.apply_boost(http_client=http_client, boost_type=FreeBoostType.ENERGY)
-                            if status is True:
-                                logger.success(f"{self.session_name} | 👉 Energy boost applied")
-
-                                await asyncio.sleep(delay=1)
-
-                            continue
-
-                        if turbo_boost_count > 0 and settings.APPLY_DAILY_TURBO is True:
-                            logger.info(f"{self.session_name} | 😴 Sleep 5s before activating the daily turbo boost")
-                            await asyncio.sleep(delay=5)
-
-                            status = await self.apply_boost(http_client=http_client, boost_type=FreeBoostType.TURBO)
-                            if status is True:
-                                logger.success(f"{self.session_name} | 👉 Turbo boost applied")
-
-                                await asyncio.sleep(delay=10)
-
-                                active_turbo = True
-                                turbo_time = time()
-
-                            continue
-
-                        if settings.AUTO_UPGRADE_TAP is True and next_tap_level <= settings.MAX_TAP_LEVEL:
-                            status = await self.upgrade_boost(http_client=http_client,
-                                                            boost_type=UpgradableBoostType.TAP)
-                            if status is True:
-                                logger.success(f"{self.session_name} | 👉 Tap upgraded to {next_tap_level} lvl")
-
-                                await asyncio.sleep(delay=1)
-
-
-                        if settings.AUTO_UPGRADE_ENERGY is True and next_energy_level <= settings.MAX_ENERGY_LEVEL:
-                            status = await self.upgrade_boost(http_client=http_client,
-                                                            boost_type=UpgradableBoostType.ENERGY)
-                            if status is True:
-                                logger.success(f"{self.session_name} | 👉 Energy upgraded to {next_energy_level} lvl")
-
-                                await asyncio.sleep(delay=1)
-
-                        if settings.AUTO_UPGRADE_CHARGE is True and next_charge_level <= settings.MAX_CHARGE_LEVEL:
-                            status = await self.upgrade_boost(http_client=http_client,
-                                                            boost_type=UpgradableBoostType.CHARGE)
-                            if status is True:
-                                logger.success(f"{self.session_name} | 👉 Charge upgraded to {next_charge_level} lvl")
-
-                                await asyncio.sleep(delay=1)
-                            
-                        if available_energy < settings.MIN_AVAILABLE_ENERGY:
-                            logger.info(f"{self.session_name} | 👉 Minimum energy reached: {available_energy}")
-                            logger.info(f"{self.session_name} | 😴 Sleep {settings.SLEEP_BY_MIN_ENERGY}s")
-
-                            await asyncio.sleep(delay=settings.SLEEP_BY_MIN_ENERGY)
-
-                            continue
-
-                except InvalidSession as error:
-                    raise error
-
-                except Exception as error:
-                    logger.error(f"{self.session_name} | ❗️Unknown error with Tapper (unkwnown): {error} | {traceback.format_exc()}")
-                    await asyncio.sleep(delay=3)
-
-                else:
-                    sleep_between_clicks = randint(a=settings.SLEEP_BETWEEN_TAP[0], b=settings.SLEEP_BETWEEN_TAP[1])
-
-                    if active_turbo is True:
-                        sleep_between_clicks = 4
-                    elif noBalance is True:
-                        sleep_between_clicks = 200
-
-                    logger.info(f"😴 Sleep {sleep_between_clicks}s")
-                    await asyncio.sleep(delay=sleep_between_clicks)
+        upgrade_costs.record_purchase(upgrade.boost_type, upgrade.level,
+                                      cost=turn.profile_data.coins_amount - result.coins_amount)
+        if upgrade.boost_type == UpgradableBoostType.TAPBOT:
+            logger.success(f"{self.session_name} | 👉 Tapbot was purchased")
+            turn.bot_config = await self.get_bot_config() or turn.bot_config
+        else:
+            logger.success(f"{self.session_name} | 👉 {UPGRADE_NAMES[upgrade.boost_type]} upgraded to "
+                           f"{upgrade.level} lvl | Payback: <e>{upgrade.payback_hours:.1f}h</e>")
+
+        result.spin_energy_next_recharge_at = turn.profile_data.spin_energy_next_recharge_at
+        turn.profile_data = result
+        return True
+
+    def then(self, phase: Callable[[], Awaitable[float]], delay: float) -> float:
+        """Makes `phase` the next step, due in `delay` seconds, so pauses between requests
+        don't hold a scheduler worker."""
+        self.next_phase = phase
+        return delay
+
+    def wait_for_boost(self, boost_type: FreeBoostType) -> float:
+        name = 'energy' if boost_type == FreeBoostType.ENERGY else 'turbo'
+        logger.info(f"{self.session_name} | 😴 Sleep 5s before activating the daily {name} boost")
+        return self.then(partial(self.activate_boost, boost_type), delay=5)
+
+    async def activate_boost(self, boost_type: FreeBoostType) -> float:
+        status = await self.apply_boost(boost_type=boost_type)
+        if status is not True:
+            return 0
+
+        if boost_type == FreeBoostType.ENERGY:
+            logger.success(f"{self.session_name} | 👉 Energy boost applied")
+            return 1
+
+        logger.success(f"{self.session_name} | 👉 Turbo boost applied")
+        self.active_turbo = True
+        self.turbo_time = time() + 10
+        return 10
+
+    async def play(self) -> float:
+        """Logs in when the token is due for a refresh, fetches the game state and spins."""
+        if self.api.unauthorized:
+            self.api.unauthorized = False
+            self.access_token_expires_at = 0
+            token_store.delete(self.session_name)
+
+        if self.access_token_expires_at - time() <= self.settings.TOKEN_REFRESH_MARGIN:
+            tg_web_data = await self.get_tg_web_data(proxy=self.proxy)
+            access_token = await self.get_access_token(tg_web_data=tg_web_data) if tg_web_data else None
+            if not access_token:
+                return self.get_failure_delay()
+
+            self.set_access_token(access_token=access_token,
+                                  expires_at=get_token_expiry(access_token) or time() + 3600)
+            token_store.set(self.session_name, access_token)
+            metrics.token_refreshes_total.inc(session=self.session_name)
+
+            profile_data = await self.get_profile_data()
+            if profile_data:
+                current_boss = profile_data.boss
+                logger.info(f"{self.session_name} | Current boss level: <m>{current_boss.level}</m> | "
+                            f"Boss health: <e>{current_boss.current_health}</e> out of <r>{current_boss.max_health}</r>")
+
+            return self.then(self.play, delay=.5)
+
+        bot_config, telegramMe, profile_data = await self.get_game_state()
+
+        if not profile_data:
+            return self.get_failure_delay()
+        self.failed_steps = 0
+
+        turn = Turn(profile_data=profile_data, bot_config=bot_config, user=telegramMe)
+
+        if profile_data.spin_energy_total > 0 and self.settings.AUTO_SPIN is True:
+            game_result = await self.spin_game()
+            if game_result:
+                rewardAmount = game_result["slotMachineSpin"]["rewardAmount"]
+                rewardType = game_result["slotMachineSpin"]["rewardType"]
+                turn.profile_data = await self.get_profile_data() or profile_data
+                spinEnergyTotal = turn.profile_data.spin_energy_total
+                logger.info(f"{self.session_name} | 🔥Reward Amount: <c>{rewardAmount}</c> | Reward Type: <m>{rewardType}</m> | Available Spin: <e>{spinEnergyTotal}</e>")
+
+                return self.then(partial(self.tap, turn), delay=1)
+
+        return await self.tap(turn)
+
+    async def tap(self, turn: Turn) -> float:
+        """Sends a batch of taps when there is energy for it, otherwise sleeps or refills energy."""
+        profile_data = turn.profile_data
+        turn.balance = profile_data.coins_amount
+        turn.available_energy = profile_data.current_energy
+        turn.boss_level = profile_data.boss.level
+        turn.boss_health = profile_data.boss.current_health
+
+        taps = randint(a=self.settings.RANDOM_TAPS_COUNT[0], b=self.settings.RANDOM_TAPS_COUNT[1])
+        if self.settings.USE_ENERGY_MODEL is True:
+            taps, energy_delay = plan_taps(config=profile_data, min_taps=self.settings.RANDOM_TAPS_COUNT[0],
+                                           max_taps=self.settings.RANDOM_TAPS_COUNT[1])
+        min_energy = taps * profile_data.weapon_level
+
+        if self.settings.USE_ENERGY_MODEL is True:
+            # Turbo taps don't spend energy
+            enough_energy = energy_delay == 0 or self.active_turbo
+        else:
+            enough_energy = min_energy < turn.available_energy
+
+        if not enough_energy:
+            logger.warning(f"{self.session_name} | Not enough energy to send {taps} taps. "
+                           f"Needed <le>{min_energy+1}</le> energy to send taps"
+                           f" | Available: <ly>{turn.available_energy}</ly>")
+            if (profile_data.free_boosts.refill_energy_amount > 0
+                and self.settings.APPLY_DAILY_ENERGY is True):
+                return self.wait_for_boost(FreeBoostType.ENERGY)
+
+            sleep_by_energy = self.get_energy_delay(profile_data=profile_data, needed_energy=min_energy + 1)
+            sleep_by_energy = self.get_due_delay(delay=sleep_by_energy, profile_data=profile_data,
+                                                 bot_config=turn.bot_config)
+            logger.info(f"{self.session_name} | 😴 Sleep {sleep_by_energy:.0f}s")
+
+            return sleep_by_energy
+
+        if self.active_turbo:
+            taps += self.settings.ADD_TAPS_ON_TURBO
+            if time() - self.turbo_time > 10:
+                self.active_turbo = False
+                self.turbo_time = 0
+
+        tap_result = await self.send_taps(nonce=profile_data.nonce, taps=taps)
+        if not tap_result:
+            return self.get_failure_delay()
+
+        # The taps response has no spin fields, keep them from the full config for the due delay
+        tap_result.spin_energy_next_recharge_at = profile_data.spin_energy_next_recharge_at
+        turn.profile_data = profile_data = tap_result
+        new_balance = profile_data.coins_amount
+        turn.calc_taps = new_balance - turn.balance
+        balance = turn.balance = new_balance
+
+        metrics.taps_sent_total.inc(taps, session=self.session_name)
+        if not self.tapped:
+            self.tapped = True
+            metrics.observe_first_tap(self.session_name)
+        if turn.calc_taps > 0:
+            metrics.coins_gained_total.inc(turn.calc_taps, session=self.session_name)
+        metrics.balance.set(balance, session=self.session_name)
+        metrics.energy.set(profile_data.current_energy, session=self.session_name)
+        metrics.boss_level.set(profile_data.boss.level, session=self.session_name)
+        session_registry.set(self.session_name, 'game_state', {
+            'balance': balance,
+            'energy': profile_data.current_energy,
+            'max_energy': profile_data.max_energy,
+            'boss_level': profile_data.boss.level,
+            'weapon_level': profile_data.weapon_level,
+            'energy_limit_level': profile_data.energy_limit_level,
+            'energy_recharge_level': profile_data.energy_recharge_level,
+            'observed_at': profile_data.observed_at,
+        })
+
+        if turn.user and turn.user.is_referral_initial_join_bonus_available is True:
+            await self.claim_referral_bonus()
+            logger.info(f"{self.session_name} | 🔥Referral bonus was claimed")
+
+        return await self.upgrade(turn)
+
+    async def upgrade(self, turn: Turn) -> float:
+        """Buys at most MAX_UPGRADES_PER_STEP upgrades, a second apart."""
+        if self.active_turbo is False and turn.upgrades < MAX_UPGRADES_PER_STEP and await self.buy_upgrade(turn):
+            turn.upgrades += 1
+            return self.then(partial(self.upgrade, turn), delay=1)
+
+        return await self.claim_tapbot(turn)
+
+    async def claim_tapbot(self, turn: Turn) -> float:
+        bot_config = turn.bot_config
+        if bot_config and bot_config.is_purchased is True:
+            if bot_config.used_attempts < bot_config.total_attempts and bot_config.ends_at is None:
+                await self.start_bot()
+                turn.bot_config = await self.get_bot_config()
+                logger.info(f"{self.session_name} | 👉 Tapbot is started")
+
+            elif bot_config.ends_at is not None and bot_config.ends_at <= time():
+                tapbotClaim = await self.claim_bot()
+                if tapbotClaim['isClaimed'] == False and tapbotClaim['data']:
+                    logger.info(f"{self.session_name} | 👉 Tapbot was claimed - 😴 Sleep 5s before starting again")
+                    turn.bot_config = tapbotClaim['data']
+                    return self.then(partial(self.restart_tapbot, turn), delay=5)
+
+        return await self.finish(turn)
+
+    async def restart_tapbot(self, turn: Turn) -> float:
+        if turn.bot_config.used_attempts < turn.bot_config.total_attempts:
+            await self.start_bot()
+            logger.info(f"{self.session_name} | 👉 Tapbot is started - 😴 Sleep 5s")
+            return self.then(partial(self.refresh_tapbot, turn), delay=5)
+
+        return await self.finish(turn)
+
+    async def refresh_tapbot(self, turn: Turn) -> float:
+        turn.bot_config = await self.get_bot_config()
+        return await self.finish(turn)
+
+    async def finish(self, turn: Turn) -> float:
+        """Moves on to the next boss, applies the daily boosts and returns the delay until the next turn."""
+        profile_data, bot_config = turn.profile_data, turn.bot_config
+
+        if turn.calc_taps > 0:
+            logger.success(f"{self.session_name} | ✅ Successful tapped! 🔨 | "
+                        f"Balance: <c>{turn.balance}</c> (<g>+{turn.calc_taps} 😊</g>) | "
+                        f"Boss health: <e>{turn.boss_health}</e>")
+
+        if turn.boss_health <= 0:
+            logger.info(f"{self.session_name} | 👉 Setting next boss: <m>{turn.boss_level+1}</m> lvl")
+
+            status = await self.set_next_boss()
+            if status is True:
+                logger.success(f"{self.session_name} | ✅ Successful setting next boss: "
+                            f"<m>{turn.boss_level+1}</m>")
+
+
+        if self.active_turbo is False:
+            if (profile_data.free_boosts.refill_energy_amount > 0
+                and turn.available_energy < self.settings.MIN_AVAILABLE_ENERGY
+                and self.settings.APPLY_DAILY_ENERGY is True):
+                return self.wait_for_boost(FreeBoostType.ENERGY)
+
+            if profile_data.free_boosts.turbo_amount > 0 and self.settings.APPLY_DAILY_TURBO is True:
+                return self.wait_for_boost(FreeBoostType.TURBO)
+
+            if turn.available_energy < self.settings.MIN_AVAILABLE_ENERGY and self.settings.USE_ENERGY_MODEL is False:
+                logger.info(f"{self.session_name} | 👉 Minimum energy reached: {turn.available_energy}")
+                logger.info(f"{self.session_name} | 😴 Sleep {self.settings.SLEEP_BY_MIN_ENERGY}s")
+
+                return self.get_due_delay(delay=self.settings.SLEEP_BY_MIN_ENERGY, profile_data=profile_data,
+                                          bot_config=bot_config)
+
+        sleep_between_clicks = randint(a=self.settings.SLEEP_BETWEEN_TAP[0], b=self.settings.SLEEP_BETWEEN_TAP[1])
+
+        if self.active_turbo is True:
+            sleep_between_clicks = 4
+        elif turn.calc_taps <= 0:
+            sleep_between_clicks = self.get_due_delay(delay=200, profile_data=profile_data, bot_config=bot_config)
+        elif self.settings.USE_ENERGY_MODEL is True:
+            _, next_batch_in = plan_taps(config=profile_data, min_taps=self.settings.RANDOM_TAPS_COUNT[0],
+                                         max_taps=self.settings.RANDOM_TAPS_COUNT[1])
+            sleep_between_clicks = self.get_due_delay(delay=max(sleep_between_clicks, next_batch_in),
+                                                      profile_data=profile_data, bot_config=bot_config)
+
+        logger.info(f"{self.session_name} | 😴 Sleep {sleep_between_clicks:.0f}s")
+
+        return sleep_between_clicks
 
 
 async def run_tapper(tg_client: Client, proxy: str | None):
-    try:
-        await Tapper(tg_client=tg_client).run(proxy=proxy)
-    except InvalidSession:
-        logger.error(f"{tg_client.name} | ❗️Invalid Session")
+    with logger.contextualize(session=tg_client.name):
+        try:
+            await Tapper(tg_client=tg_client).run(proxy=proxy)
+        except InvalidSession:
+            logger.error(f"{tg_client.name} | ❗️Invalid Session")
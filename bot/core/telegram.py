@@ -0,0 +1,150 @@
+import asyncio
+from contextlib import asynccontextmanager
+from time import monotonic
+
+from better_proxy import Proxy
+from pyrogram import Client
+from pyrogram.raw.types import InputPeerUser
+
+from bot.config import settings
+from bot.utils import logger
+from bot.utils.registry import SessionRegistry, session_registry
+
+
+BOT_USERNAME = 'memefi_coin_bot'
+
+
+def get_proxy_dict(proxy: str | None) -> dict | None:
+    """Pyrogram's proxy settings for a proxy URL."""
+    if not proxy:
+        return None
+
+    proxy = Proxy.from_str(proxy)
+    return dict(
+        scheme=proxy.protocol,
+        hostname=proxy.host,
+        port=proxy.port,
+        username=proxy.login,
+        password=proxy.password
+    )
+
+
+class ClientPool:
+    """Limits how many Pyrogram clients are connected at once and keeps released
+    clients connected for `idle_timeout` seconds so the next refresh reuses them.
+
+    Idle clients still hold a slot; they are evicted (oldest first) when another
+    session needs a connection and the pool is full, and released clients aren't
+    kept at all while sessions are waiting for a slot."""
+
+    def __init__(self, max_connections: int, idle_timeout: float):
+        self.idle_timeout = idle_timeout
+        self._slots = asyncio.Semaphore(max(max_connections, 1))
+        self._idle: dict[str, tuple[Client, float]] = {}
+        self._timers: dict[str, asyncio.TimerHandle] = {}
+        self._waiting = 0
+
+    @asynccontextmanager
+    async def connection(self, tg_client: Client):
+        await self.acquire(tg_client)
+        try:
+            yield tg_client
+        finally:
+            self.release(tg_client)
+
+    async def acquire(self, tg_client: Client) -> None:
+        if self._idle.pop(tg_client.name, None) is not None:
+            self._cancel_timer(tg_client.name)
+            if tg_client.is_connected:
+                return
+
+            self._slots.release()
+
+        if self._slots.locked() and self._idle:
+            oldest_name = min(self._idle, key=lambda name: self._idle[name][1])
+            await self._disconnect(oldest_name)
+
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+
+        try:
+            if not tg_client.is_connected:
+                await tg_client.connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, tg_client: Client) -> None:
+        if not tg_client.is_connected or self.idle_timeout <= 0 or self._waiting:
+            asyncio.ensure_future(self._close(tg_client))
+            return
+
+        self._idle[tg_client.name] = (tg_client, monotonic())
+        self._timers[tg_client.name] = asyncio.get_running_loop().call_later(
+            self.idle_timeout, lambda: asyncio.ensure_future(self._disconnect(tg_client.name)))
+
+    def _cancel_timer(self, name: str) -> None:
+        timer = self._timers.pop(name, None)
+        if timer is not None:
+            timer.cancel()
+
+    async def _disconnect(self, name: str) -> None:
+        self._cancel_timer(name)
+        idle = self._idle.pop(name, None)
+        if idle is not None:
+            await self._close(idle[0])
+
+    async def _close(self, tg_client: Client) -> None:
+        try:
+            if tg_client.is_connected:
+                await tg_client.disconnect()
+        except Exception as error:
+            logger.warning(f"{tg_client.name} | Error while disconnecting: {error}")
+        finally:
+            self._slots.release()
+
+    async def close(self) -> None:
+        for name in list(self._idle):
+            await self._disconnect(name)
+
+
+class PeerCache:
+    """Resolved bot peer and `get_me` fields per session, kept across refreshes and restarts."""
+
+    def __init__(self, registry: SessionRegistry):
+        self.registry = registry
+
+    async def get_bot_peer(self, tg_client: Client) -> InputPeerUser:
+        cached = self.registry.get(tg_client.name, 'bot_peer')
+        if cached:
+            return InputPeerUser(user_id=cached['user_id'], access_hash=cached['access_hash'])
+
+        peer = await tg_client.resolve_peer(BOT_USERNAME)
+        self.update(tg_client.name, bot_peer=dict(user_id=peer.user_id, access_hash=peer.access_hash))
+
+        return peer
+
+    async def get_me(self, tg_client: Client) -> dict:
+        cached = self.registry.get(tg_client.name, 'me')
+        if cached:
+            return cached
+
+        me = await tg_client.get_me()
+        me = dict(id=me.id, first_name=me.first_name, last_name=me.last_name,
+                  username=me.username, language_code=me.language_code)
+        self.update(tg_client.name, me=me)
+
+        return me
+
+    def update(self, session_name: str, **values) -> None:
+        self.registry.update(session_name, **values)
+
+    def delete(self, session_name: str) -> None:
+        self.registry.delete(session_name, 'bot_peer', 'me')
+
+
+tg_pool = ClientPool(max_connections=settings.TG_MAX_CONNECTIONS, idle_timeout=settings.TG_IDLE_TIMEOUT)
+peer_cache = PeerCache(registry=session_registry)
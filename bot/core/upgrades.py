@@ -0,0 +1,260 @@
+import json
+import atexit
+import asyncio
+import sqlite3
+import threading
+from dataclasses import dataclass
+
+from bot.config import settings
+from bot.config.config import Settings
+from bot.core.models import GameConfig, TapbotConfig, ENERGY_RECHARGE_PER_LEVEL
+from bot.utils.boosts import UpgradableBoostType
+from bot.utils.registry import REGISTRY_FILE, read_json
+
+
+# JSON file used before the prices moved to the registry database, imported once
+LEGACY_UPGRADE_COSTS_FILE = 'upgrade_costs.json'
+
+TAPBOT_PRICE = 200000
+
+# Rough usage assumptions behind the coins/hour estimates
+FREE_BOOSTS_PER_DAY = 3
+TURBO_DAMAGE_MULTIPLIER = 5
+TAPBOT_HOURS_PER_ATTEMPT = 3
+
+# An unknown price is assumed to be this many times the previous level's price
+PRICE_GROWTH_FACTOR = 2
+
+# A failed purchase at balance B means the price is above B, retry once the balance is this much higher
+RETRY_BALANCE_FACTOR = 1.5
+
+
+def merge_costs(first: dict | None, second: dict | None) -> dict:
+    """Exact prices win over lower bounds, `second` over `first`; of two lower bounds the higher one."""
+    first, second = first or {}, second or {}
+    if 'cost' in second:
+        return second
+    if 'cost' in first:
+        return first
+    return {'min_cost': max(first.get('min_cost', 0), second.get('min_cost', 0))}
+
+
+class UpgradeCosts:
+    """Upgrade prices learned from purchases, shared by all sessions.
+
+    Keys are `<type>:<level>` for the level being bought. A value is either the
+    exact `cost` seen on a successful purchase or the `min_cost` implied by a
+    purchase the balance couldn't cover.
+
+    Prices live in the `upgrade_costs` table of the session registry database and are
+    served from memory. `flush`, which `run` calls periodically from a worker thread,
+    merges the changed prices into the table in one transaction and reads back what
+    other worker processes learned. Without a `path` nothing is stored."""
+
+    def __init__(self, path: str | None = REGISTRY_FILE):
+        self.path = path
+        self._data: dict[str, dict] | None = None
+        self.dirty: set[str] = set()
+        self.write_lock = threading.Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('CREATE TABLE IF NOT EXISTS upgrade_costs (key TEXT PRIMARY KEY, data TEXT NOT NULL)')
+        return connection
+
+    @property
+    def data(self) -> dict[str, dict]:
+        if self._data is None:
+            self._data = self.load()
+            if self.path is not None:
+                atexit.register(self.flush)
+
+        return self._data
+
+    @data.setter
+    def data(self, data: dict[str, dict]) -> None:
+        self._data = data
+
+    def load(self) -> dict[str, dict]:
+        if self.path is None:
+            return {}
+
+        connection = self.connect()
+        try:
+            data = self.read(connection)
+        finally:
+            connection.close()
+
+        if not data:
+            data = read_json(LEGACY_UPGRADE_COSTS_FILE)
+            self.dirty.update(data)
+
+        return data
+
+    @staticmethod
+    def read(connection: sqlite3.Connection) -> dict[str, dict]:
+        return {key: json.loads(data) for key, data in connection.execute('SELECT key, data FROM upgrade_costs')}
+
+    def set(self, key: str, value: dict) -> None:
+        self.data[key] = value
+        self.dirty.add(key)
+
+    def snapshot(self) -> dict[str, dict]:
+        """The changed prices. Must run on the thread that modifies the prices."""
+        if self._data is None:
+            return {}
+
+        entries = {key: self._data[key] for key in self.dirty}
+        self.dirty.clear()
+        return entries
+
+    def write(self, entries: dict[str, dict]) -> dict[str, dict]:
+        """Merges `entries` into the stored prices and returns all of them."""
+        with self.write_lock:
+            connection = self.connect()
+            try:
+                with connection:
+                    # Taken before reading, so processes flushing at once don't drop each other's prices
+                    connection.execute('BEGIN IMMEDIATE')
+                    stored = self.read(connection)
+                    rows = []
+                    for key, entry in entries.items():
+                        merged = merge_costs(stored.get(key), entry)
+                        if merged != stored.get(key):
+                            stored[key] = merged
+                            rows.append((key, json.dumps(merged)))
+                    connection.executemany('INSERT OR REPLACE INTO upgrade_costs (key, data) VALUES (?, ?)', rows)
+            finally:
+                connection.close()
+
+        return stored
+
+    def merge(self, stored: dict[str, dict]) -> None:
+        for key, entry in stored.items():
+            self.data[key] = merge_costs(self.data.get(key), entry)
+
+    def flush(self) -> None:
+        if self.path is not None and self._data is not None:
+            self.merge(self.write(self.snapshot()))
+
+    async def run(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            if self.path is not None and self._data is not None:
+                self.merge(await asyncio.to_thread(self.write, self.snapshot()))
+
+    @staticmethod
+    def key(boost_type: UpgradableBoostType, level: int) -> str:
+        return f'{boost_type.value}:{level}'
+
+    def estimate(self, boost_type: UpgradableBoostType, level: int, balance: int = 0) -> float:
+        """Known price of `level`, otherwise a conservative guess: the previous level's price
+        times PRICE_GROWTH_FACTOR, or the whole balance when that isn't known either."""
+        if boost_type == UpgradableBoostType.TAPBOT:
+            return TAPBOT_PRICE
+
+        entry = self.data.get(self.key(boost_type, level)) or {}
+        if 'cost' in entry:
+            return entry['cost']
+
+        previous = (self.data.get(self.key(boost_type, level - 1)) or {}).get('cost')
+        guess = previous * PRICE_GROWTH_FACTOR if previous else max(balance, 1)
+        return max(entry.get('min_cost', 0), guess)
+
+    def record_purchase(self, boost_type: UpgradableBoostType, level: int, cost: int) -> None:
+        if cost > 0:
+            self.set(self.key(boost_type, level), {'cost': cost})
+
+    def record_failure(self, boost_type: UpgradableBoostType, level: int, balance: int) -> None:
+        entry = self.data.get(self.key(boost_type, level)) or {}
+        if 'cost' in entry:
+            return
+
+        min_cost = int(max(balance, 1) * RETRY_BALANCE_FACTOR)
+        if min_cost > entry.get('min_cost', 0):
+            self.set(self.key(boost_type, level), {'min_cost': min_cost})
+
+
+upgrade_costs = UpgradeCosts()
+
+
+@dataclass(slots=True)
+class Upgrade:
+    boost_type: UpgradableBoostType
+    level: int
+    cost: float
+    gain: float
+
+    @property
+    def payback_hours(self) -> float:
+        return self.cost / self.gain if self.gain > 0 else float('inf')
+
+
+def estimate_gain(boost_type: UpgradableBoostType, config: GameConfig, tapbot: TapbotConfig | None,
+                  settings: Settings = settings) -> float:
+    """Extra coins per hour from buying the next level of `boost_type`.
+
+    Every tap spends as much energy as it deals damage, so outside turbo coins
+    are bound by the recharge rate rather than by the tap level."""
+    if boost_type == UpgradableBoostType.CHARGE:
+        return ENERGY_RECHARGE_PER_LEVEL * 3600
+
+    if boost_type == UpgradableBoostType.ENERGY:
+        if not settings.APPLY_DAILY_ENERGY:
+            return 0
+        # Each daily refill fills a bar that is one level larger
+        return config.max_energy / max(config.energy_limit_level, 1) * FREE_BOOSTS_PER_DAY / 24
+
+    if boost_type == UpgradableBoostType.TAP:
+        if not settings.APPLY_DAILY_TURBO:
+            return 0
+        return settings.ADD_TAPS_ON_TURBO * TURBO_DAMAGE_MULTIPLIER * FREE_BOOSTS_PER_DAY / 24
+
+    if boost_type == UpgradableBoostType.TAPBOT:
+        if tapbot is None:
+            return 0
+        running_share = min(tapbot.total_attempts * TAPBOT_HOURS_PER_ATTEMPT / 24, 1)
+        return max(tapbot.damage_per_sec, 1) * 3600 * running_share
+
+    return 0
+
+
+def get_upgrade_candidates(config: GameConfig, tapbot: TapbotConfig | None, settings: Settings = settings,
+                           costs: UpgradeCosts = upgrade_costs) -> list[Upgrade]:
+    """Enabled upgrades within the level caps and the payback horizon, best return first."""
+    levels = [
+        (UpgradableBoostType.TAP, settings.AUTO_UPGRADE_TAP, config.weapon_level + 1, settings.MAX_TAP_LEVEL),
+        (UpgradableBoostType.ENERGY, settings.AUTO_UPGRADE_ENERGY, config.energy_limit_level + 1,
+         settings.MAX_ENERGY_LEVEL),
+        (UpgradableBoostType.CHARGE, settings.AUTO_UPGRADE_CHARGE, config.energy_recharge_level + 1,
+         settings.MAX_CHARGE_LEVEL),
+    ]
+    if tapbot is not None and not tapbot.is_purchased:
+        levels.append((UpgradableBoostType.TAPBOT, settings.AUTO_BUY_TAPBOT, 1, None))
+
+    candidates = []
+    for boost_type, enabled, level, max_level in levels:
+        if not enabled or (max_level is not None and level > max_level):
+            continue
+
+        upgrade = Upgrade(boost_type=boost_type, level=level,
+                          cost=costs.estimate(boost_type, level, balance=config.coins_amount),
+                          gain=estimate_gain(boost_type, config=config, tapbot=tapbot, settings=settings))
+        if upgrade.gain > 0 and upgrade.payback_hours <= settings.UPGRADE_PAYBACK_HOURS:
+            candidates.append(upgrade)
+
+    return sorted(candidates, key=lambda upgrade: upgrade.payback_hours)
+
+
+def plan_upgrade(config: GameConfig, tapbot: TapbotConfig | None, settings: Settings = settings,
+                 costs: UpgradeCosts = upgrade_costs) -> Upgrade | None:
+    """The upgrade with the best return if the balance covers it.
+
+    Nothing is bought while saving up for a better upgrade, so cheap upgrades
+    with a worse return don't delay it."""
+    candidates = get_upgrade_candidates(config=config, tapbot=tapbot, settings=settings, costs=costs)
+    if candidates and candidates[0].cost <= config.coins_amount:
+        return candidates[0]
+
+    return None
@@ -0,0 +1,2 @@
+from .server import StandInServer, start_server
+from .telegram import FakeClient
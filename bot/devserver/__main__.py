@@ -0,0 +1,32 @@
+import asyncio
+import argparse
+from contextlib import suppress
+
+from bot.utils import logger
+from .server import StandInServer, start_server
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description='Local stand-in for the MemeFi GraphQL API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0, help='Fixed latency per request in seconds')
+    parser.add_argument('--jitter', type=float, default=0, help='Random extra latency in seconds')
+    parser.add_argument('--rate-limit', type=float, default=0, help='Probability of answering with 429')
+    parser.add_argument('--retry-after', type=float, default=1, help='Retry-After sent with 429 responses')
+    parser.add_argument('--token-lifetime', type=int, default=3600)
+    parser.add_argument('--tapbot-duration', type=float, default=3 * 3600)
+    args = parser.parse_args()
+
+    server = StandInServer(latency=args.latency, jitter=args.jitter, rate_limit_probability=args.rate_limit,
+                           retry_after=args.retry_after, token_lifetime=args.token_lifetime,
+                           tapbot_duration=args.tapbot_duration)
+    await start_server(server=server, host=args.host, port=args.port)
+
+    logger.info(f"Stand-in GraphQL server listening on <e>http://{args.host}:{args.port}/graphql</e>")
+    await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    with suppress(KeyboardInterrupt):
+        asyncio.run(main())
@@ -0,0 +1,221 @@
+import os
+import sys
+import json
+import asyncio
+import argparse
+import resource
+import tempfile
+from time import monotonic, time, process_time
+
+from bot.config import settings
+from bot.core import api
+from bot.utils import logger
+from bot.utils.graphql import OperationName
+from bot.utils.fast import install_uvloop
+from bot.utils.launcher import run_tasks
+from .server import StandInServer, start_server
+from .telegram import FakeClient
+
+
+def percentile(values: list[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * percent / 100), len(values) - 1)]
+
+
+def get_peak_rss() -> int:
+    """Peak resident set size of this process in bytes."""
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+class Collector:
+    """Collects request latencies, time-to-first-tap and event loop lag during a run."""
+
+    def __init__(self):
+        self.started_at = monotonic()
+        self.cpu_started_at = process_time()
+        self.latencies: dict[str, list[float]] = {}
+        self.statuses: dict[str, dict[int, int]] = {}
+        self.first_taps: dict[str, float] = {}
+        self.timeline: dict[int, dict[str, int]] = {}
+        self.loop_lag: list[float] = []
+
+    def observe(self, session_name: str, operation: str, latency: float, status: int) -> None:
+        self.latencies.setdefault(operation, []).append(latency)
+        statuses = self.statuses.setdefault(operation, {})
+        statuses[status] = statuses.get(status, 0) + 1
+
+        second = self.timeline.setdefault(int(monotonic() - self.started_at), {'requests': 0, 'failed': 0})
+        second['requests'] += 1
+        if status == 0 or status >= 500:
+            second['failed'] += 1
+
+        if operation == OperationName.MutationGameProcessTapsBatch and status < 400:
+            self.first_taps.setdefault(session_name, monotonic() - self.started_at)
+
+    async def sample_loop_lag(self, interval: float = 0.1) -> None:
+        while True:
+            started_at = monotonic()
+            await asyncio.sleep(interval)
+            self.loop_lag.append(max(monotonic() - started_at - interval, 0))
+
+    def report(self, sessions: int, duration: float, baseline_rss: int) -> dict:
+        total_requests = sum(len(latencies) for latencies in self.latencies.values())
+        first_taps = list(self.first_taps.values())
+        peak_rss = get_peak_rss()
+        cpu_seconds = process_time() - self.cpu_started_at
+
+        return {
+            'timestamp': int(time()),
+            'sessions': sessions,
+            'duration': round(duration, 3),
+            'requests': total_requests,
+            'requests_per_second': round(total_requests / duration, 3) if duration else 0,
+            'rate_limited': sum(statuses.get(429, 0) for statuses in self.statuses.values()),
+            'fast_mode': settings.FAST_MODE,
+            'event_loop': type(asyncio.get_running_loop()).__module__,
+            # Includes the stand-in server, which runs in the same process
+            'cpu_seconds': round(cpu_seconds, 3),
+            'cpu_seconds_per_request': round(cpu_seconds / total_requests, 6) if total_requests else 0,
+            'operations': {
+                operation: {
+                    'count': len(latencies),
+                    'statuses': self.statuses[operation],
+                    'p50': round(percentile(latencies, 50), 6),
+                    'p95': round(percentile(latencies, 95), 6),
+                    'p99': round(percentile(latencies, 99), 6),
+                } for operation, latencies in sorted(self.latencies.items())
+            },
+            'loop_lag': {
+                'p50': round(percentile(self.loop_lag, 50), 6),
+                'p99': round(percentile(self.loop_lag, 99), 6),
+                'max': round(max(self.loop_lag, default=0), 6),
+            },
+            'time_to_first_tap': {
+                'sessions': len(first_taps),
+                'first': round(min(first_taps, default=0), 3),
+                'p50': round(percentile(first_taps, 50), 3),
+                'p99': round(percentile(first_taps, 99), 3),
+                'max': round(max(first_taps, default=0), 3),
+            },
+            # Requests and failed requests (5xx, no response) per second of the run
+            'timeline': [self.timeline.get(second, {'requests': 0, 'failed': 0})
+                         for second in range(int(duration) + 1)],
+            'peak_rss_bytes': peak_rss,
+            'rss_per_session_bytes': max(peak_rss - baseline_rss, 0) // sessions if sessions else 0,
+        }
+
+
+async def run_outage(server: StandInServer, outage: tuple[float, float]) -> None:
+    start, duration = outage
+    await asyncio.sleep(start)
+    server.start_outage(duration)
+
+
+async def run_benchmark(sessions: int, duration: float, port: int, latency: float, jitter: float,
+                        rate_limit: float, telegram_latency: float, use_scheduler: bool = False,
+                        slim_queries: bool = False, persisted_queries: bool = False,
+                        energy_model: bool = False, error_rate: float = 0,
+                        outage: tuple[float, float] | None = None, rate_limit_rps: float = 0) -> dict:
+    server = StandInServer(latency=latency, jitter=jitter, rate_limit_probability=rate_limit, retry_after=1,
+                           error_probability=error_rate, requests_per_second=rate_limit_rps)
+    runner = await start_server(server=server, port=port)
+
+    settings.GRAPHQL_URL = f'http://127.0.0.1:{port}/graphql'
+    settings.USE_PROXY_FROM_FILE = False
+    settings.AUTO_GENERATE_USER_AGENT_FOR_EACH_SESSION = False
+    settings.USE_SCHEDULER = use_scheduler
+    settings.GRAPHQL_SLIM_QUERIES = slim_queries
+    settings.GRAPHQL_PERSISTED_QUERIES = persisted_queries
+    settings.USE_ENERGY_MODEL = energy_model
+
+    collector = Collector()
+    api.request_observers.append(collector.observe)
+    lag_task = asyncio.create_task(collector.sample_loop_lag())
+    outage_task = asyncio.create_task(run_outage(server=server, outage=outage)) if outage else None
+    baseline_rss = get_peak_rss()
+
+    tg_clients = [FakeClient(name=f'bench-{index}', user_id=index + 1, latency=telegram_latency)
+                  for index in range(sessions)]
+
+    started_at = monotonic()
+    try:
+        await asyncio.wait_for(run_tasks(tg_clients=tg_clients), timeout=duration)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        elapsed = monotonic() - started_at
+        lag_task.cancel()
+        if outage_task is not None:
+            outage_task.cancel()
+        api.request_observers.remove(collector.observe)
+        await runner.cleanup()
+
+    report = collector.report(sessions=sessions, duration=elapsed, baseline_rss=baseline_rss)
+    report['upload_bytes'] = server.bytes_received
+    report['upload_bytes_per_request'] = server.bytes_received // report['requests'] if report['requests'] else 0
+    report['coins'] = sum(player.coins_earned for player in server.players.values())
+    report['balance'] = sum(player.coins for player in server.players.values())
+    report['coins_per_session_hour'] = round(report['coins'] * 3600 / elapsed / sessions, 1) if sessions else 0
+    report['coins_per_request'] = round(report['coins'] / report['requests'], 3) if report['requests'] else 0
+
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Run N simulated sessions against the stand-in API')
+    parser.add_argument('-n', '--sessions', type=int, default=100)
+    parser.add_argument('-d', '--duration', type=float, default=60, help='Benchmark duration in seconds')
+    parser.add_argument('-o', '--output', default='bench_output.json', help='Where to write the JSON report')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.05, help='Stand-in API latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.05)
+    parser.add_argument('--rate-limit', type=float, default=0, help='Probability of a 429 response')
+    parser.add_argument('--rate-limit-rps', type=float, default=0,
+                        help='Answer 429 above this many requests per second')
+    parser.add_argument('--error-rate', type=float, default=0, help='Probability of a 503 response')
+    parser.add_argument('--outage', type=float, nargs=2, metavar=('START', 'DURATION'),
+                        help='Answer every request with 503 for DURATION seconds after START seconds')
+    parser.add_argument('--telegram-latency', type=float, default=0.1, help='Fake Telegram call latency')
+    parser.add_argument('--scheduler', action='store_true', help='Run sessions through the shared scheduler')
+    parser.add_argument('--slim', action='store_true', help='Send trimmed selection sets (GRAPHQL_SLIM_QUERIES)')
+    parser.add_argument('--persisted', action='store_true',
+                        help='Send persisted query hashes (GRAPHQL_PERSISTED_QUERIES)')
+    parser.add_argument('--energy-model', action='store_true', help='Plan tap batches with USE_ENERGY_MODEL')
+    parser.add_argument('--fast', action='store_true', help='Enable FAST_MODE (orjson and uvloop when installed)')
+    parser.add_argument('--record', metavar='DIR', help='Record a cassette per session into DIR (CASSETTE_DIR)')
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    settings.CASSETTE_DIR = os.path.abspath(args.record) if args.record else ''
+    logger.remove()
+    logger.add(sink=sys.stderr, level=args.log_level)
+
+    # Session files (user agents, tokens, peers) are written to a scratch directory
+    os.chdir(tempfile.mkdtemp(prefix='memefi-bench-'))
+
+    settings.FAST_MODE = args.fast
+    if args.fast:
+        install_uvloop()
+
+    report = asyncio.run(run_benchmark(sessions=args.sessions, duration=args.duration, port=args.port,
+                                       latency=args.latency, jitter=args.jitter, rate_limit=args.rate_limit,
+                                       telegram_latency=args.telegram_latency, use_scheduler=args.scheduler,
+                                       slim_queries=args.slim, persisted_queries=args.persisted,
+                                       energy_model=args.energy_model, error_rate=args.error_rate,
+                                       outage=args.outage, rate_limit_rps=args.rate_limit_rps))
+
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=4)
+
+    print(f"{report['sessions']} sessions | {report['requests_per_second']} req/s | "
+          f"first tap {report['time_to_first_tap']['first']}s, p50 {report['time_to_first_tap']['p50']}s | "
+          f"{report['upload_bytes_per_request']} bytes/request | {report['coins_per_request']} coins/request | "
+          f"report: {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,319 @@
+import json
+import base64
+import random
+import secrets
+from time import time
+from datetime import datetime, timezone
+
+from bot.utils.boosts import FreeBoostType, UpgradableBoostType
+
+
+ENERGY_PER_LIMIT_LEVEL = 500
+ENERGY_RECHARGE_PER_LEVEL = 1
+BOSS_HEALTH_PER_LEVEL = 50000
+TURBO_DURATION = 10
+TURBO_MULTIPLIER = 5
+TAPBOT_PRICE = 200000
+TAPBOT_DAMAGE_PER_SEC = 1
+TAPBOT_ATTEMPTS = 3
+SPIN_ENERGY_LIMIT = 5
+SPIN_RECHARGE_SECONDS = 3600
+FREE_BOOSTS_PER_DAY = 3
+FREE_BOOSTS_RECHARGE_SECONDS = 24 * 3600
+
+UPGRADE_BASE_COSTS = {
+    UpgradableBoostType.TAP: 200,
+    UpgradableBoostType.ENERGY: 200,
+    UpgradableBoostType.CHARGE: 300,
+}
+
+
+class GameError(Exception):
+    ...
+
+
+def upgrade_cost(boost_type: UpgradableBoostType, level: int) -> int:
+    """Price of buying `level` + 1 for an upgradable boost."""
+    return UPGRADE_BASE_COSTS[boost_type] * 2 ** (level - 1)
+
+
+def isoformat(timestamp: float | None) -> str | None:
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+def make_token(telegram_id: int, lifetime: int) -> str:
+    """Unsigned JWT-shaped token; only the `exp` claim matters to the bot."""
+    def encode(value: dict) -> str:
+        return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip('=')
+
+    return '.'.join((encode({'alg': 'none', 'typ': 'JWT'}),
+                     encode({'sub': telegram_id, 'exp': int(time()) + lifetime}),
+                     secrets.token_hex(8)))
+
+
+class Player:
+    """Game state of one Telegram user with energy regenerated lazily on access."""
+
+    def __init__(self, telegram_id: int, first_name: str = '', last_name: str = '', username: str = '',
+                 tapbot_duration: float = 3 * 3600):
+        self.telegram_id = telegram_id
+        self.first_name = first_name
+        self.last_name = last_name
+        self.username = username
+        self.tapbot_duration = tapbot_duration
+
+        self.coins = 0
+        self.coins_earned = 0
+        self.weapon_level = 1
+        self.energy_limit_level = 1
+        self.energy_recharge_level = 1
+        self.energy = float(self.max_energy)
+        self.energy_updated_at = time()
+
+        self.boss_level = 1
+        self.boss_health = self.boss_max_health
+        self.nonce = secrets.token_hex(32)
+
+        self.turbo_amount = FREE_BOOSTS_PER_DAY
+        self.refill_amount = FREE_BOOSTS_PER_DAY
+        self.turbo_activated_at = None
+        self.refill_activated_at = None
+        self.boosts_recharged_at = time()
+
+        self.tapbot_purchased = False
+        self.tapbot_used_attempts = 0
+        self.tapbot_starts_at = None
+        self.tapbot_ends_at = None
+
+        self.spin_energy = SPIN_ENERGY_LIMIT
+        self.spin_recharged_at = time()
+
+    @property
+    def max_energy(self) -> int:
+        return 1000 + ENERGY_PER_LIMIT_LEVEL * (self.energy_limit_level - 1)
+
+    @property
+    def boss_max_health(self) -> int:
+        return BOSS_HEALTH_PER_LEVEL * self.boss_level
+
+    @property
+    def turbo_active(self) -> bool:
+        return self.turbo_activated_at is not None and time() - self.turbo_activated_at < TURBO_DURATION
+
+    def regenerate(self) -> None:
+        now = time()
+        recharge = (now - self.energy_updated_at) * self.energy_recharge_level * ENERGY_RECHARGE_PER_LEVEL
+        self.energy = min(self.max_energy, self.energy + recharge)
+        self.energy_updated_at = now
+
+        while self.spin_energy < SPIN_ENERGY_LIMIT and now - self.spin_recharged_at >= SPIN_RECHARGE_SECONDS:
+            self.spin_energy += 1
+            self.spin_recharged_at += SPIN_RECHARGE_SECONDS
+        if self.spin_energy >= SPIN_ENERGY_LIMIT:
+            self.spin_recharged_at = now
+
+        if now - self.boosts_recharged_at >= FREE_BOOSTS_RECHARGE_SECONDS:
+            self.turbo_amount = self.refill_amount = FREE_BOOSTS_PER_DAY
+            self.boosts_recharged_at = now
+
+    def game_config(self) -> dict:
+        self.regenerate()
+        return {
+            '_id': str(self.telegram_id),
+            'coinsAmount': self.coins,
+            'currentEnergy': int(self.energy),
+            'maxEnergy': self.max_energy,
+            'weaponLevel': self.weapon_level,
+            'zonesCount': 4,
+            'tapsReward': 0,
+            'energyLimitLevel': self.energy_limit_level,
+            'energyRechargeLevel': self.energy_recharge_level,
+            'tapBotLevel': int(self.tapbot_purchased),
+            'currentBoss': {
+                '_id': str(self.boss_level),
+                'level': self.boss_level,
+                'currentHealth': self.boss_health,
+                'maxHealth': self.boss_max_health,
+                '__typename': 'TelegramGameBossOutput',
+            },
+            'freeBoosts': {
+                '_id': str(self.telegram_id),
+                'currentTurboAmount': self.turbo_amount,
+                'maxTurboAmount': FREE_BOOSTS_PER_DAY,
+                'turboLastActivatedAt': isoformat(self.turbo_activated_at),
+                'turboAmountLastRechargeDate': isoformat(self.boosts_recharged_at),
+                'currentRefillEnergyAmount': self.refill_amount,
+                'maxRefillEnergyAmount': FREE_BOOSTS_PER_DAY,
+                'refillEnergyLastActivatedAt': isoformat(self.refill_activated_at),
+                'refillEnergyAmountLastRechargeDate': isoformat(self.boosts_recharged_at),
+                '__typename': 'TelegramGameFreeBoostsOutput',
+            },
+            'bonusLeaderDamageEndAt': None,
+            'bonusLeaderDamageStartAt': None,
+            'bonusLeaderDamageMultiplier': 1,
+            'nonce': self.nonce,
+            'spinEnergyNextRechargeAt': (isoformat(self.spin_recharged_at + SPIN_RECHARGE_SECONDS)
+                                         if self.spin_energy < SPIN_ENERGY_LIMIT else None),
+            'spinEnergyNonRefillable': 0,
+            'spinEnergyRefillable': self.spin_energy,
+            'spinEnergyTotal': self.spin_energy,
+            'spinEnergyStaticLimit': SPIN_ENERGY_LIMIT,
+            '__typename': 'TelegramGameConfigOutput',
+        }
+
+    def user_me(self) -> dict:
+        return {
+            'firstName': self.first_name,
+            'lastName': self.last_name,
+            'telegramId': str(self.telegram_id),
+            'username': self.username,
+            'referralCode': secrets.token_hex(4),
+            'isDailyRewardClaimed': True,
+            'referral': None,
+            'isReferralInitialJoinBonusAvailable': False,
+            'league': 'bronze',
+            'leagueIsOverTop10k': False,
+            'leaguePosition': 0,
+            '_id': str(self.telegram_id),
+            'opens': [],
+            'features': [],
+            '__typename': 'TelegramUserOutput',
+        }
+
+    def tapbot_config(self) -> dict:
+        return {
+            'damagePerSec': TAPBOT_DAMAGE_PER_SEC,
+            'endsAt': isoformat(self.tapbot_ends_at),
+            'id': str(self.telegram_id),
+            'isPurchased': self.tapbot_purchased,
+            'startsAt': isoformat(self.tapbot_starts_at),
+            'totalAttempts': TAPBOT_ATTEMPTS,
+            'usedAttempts': self.tapbot_used_attempts,
+            '__typename': 'TelegramGameTapbotOutput',
+        }
+
+    def process_taps(self, nonce: str, taps_count: int) -> dict:
+        self.regenerate()
+        if nonce != self.nonce:
+            raise GameError('Invalid nonce')
+        if taps_count <= 0:
+            raise GameError('Invalid taps count')
+
+        if self.turbo_active:
+            damage = taps_count * self.weapon_level * TURBO_MULTIPLIER
+        else:
+            # Taps beyond the available energy are dropped instead of failing the batch
+            damage = min(taps_count * self.weapon_level, int(self.energy))
+            self.energy -= damage
+
+        damage = min(damage, self.boss_health)
+        self.boss_health -= damage
+        self.earn(damage)
+        self.nonce = secrets.token_hex(32)
+
+        return self.game_config()
+
+    def set_next_boss(self) -> dict:
+        if self.boss_health > 0:
+            raise GameError('Current boss is not defeated')
+
+        self.boss_level += 1
+        self.boss_health = self.boss_max_health
+
+        return self.game_config()
+
+    def activate_booster(self, booster_type: str) -> dict:
+        self.regenerate()
+        if booster_type == FreeBoostType.ENERGY:
+            if self.refill_amount <= 0:
+                raise GameError('No energy boosts left')
+            self.refill_amount -= 1
+            self.refill_activated_at = time()
+            self.energy = self.max_energy
+        elif booster_type == FreeBoostType.TURBO:
+            if self.turbo_amount <= 0:
+                raise GameError('No turbo boosts left')
+            self.turbo_amount -= 1
+            self.turbo_activated_at = time()
+        else:
+            raise GameError(f'Unknown booster type {booster_type}')
+
+        return self.game_config()
+
+    def purchase_upgrade(self, upgrade_type: str) -> dict:
+        self.regenerate()
+        if upgrade_type == UpgradableBoostType.TAPBOT:
+            if self.tapbot_purchased:
+                raise GameError('Tapbot is already purchased')
+            self.spend(TAPBOT_PRICE)
+            self.tapbot_purchased = True
+            return self.game_config()
+
+        attributes = {
+            UpgradableBoostType.TAP: 'weapon_level',
+            UpgradableBoostType.ENERGY: 'energy_limit_level',
+            UpgradableBoostType.CHARGE: 'energy_recharge_level',
+        }
+        if upgrade_type not in attributes:
+            raise GameError(f'Unknown upgrade type {upgrade_type}')
+
+        attribute = attributes[upgrade_type]
+        level = getattr(self, attribute)
+        self.spend(upgrade_cost(UpgradableBoostType(upgrade_type), level))
+        setattr(self, attribute, level + 1)
+
+        return self.game_config()
+
+    def earn(self, amount: int) -> None:
+        self.coins += amount
+        self.coins_earned += amount
+
+    def spend(self, amount: int) -> None:
+        if self.coins < amount:
+            raise GameError('Not enough coins')
+        self.coins -= amount
+
+    def start_tapbot(self) -> dict:
+        if not self.tapbot_purchased:
+            raise GameError('Tapbot is not purchased')
+        if self.tapbot_ends_at is not None:
+            raise GameError('Tapbot is already running')
+        if self.tapbot_used_attempts >= TAPBOT_ATTEMPTS:
+            raise GameError('No tapbot attempts left')
+
+        self.tapbot_used_attempts += 1
+        self.tapbot_starts_at = time()
+        self.tapbot_ends_at = self.tapbot_starts_at + self.tapbot_duration
+
+        return self.tapbot_config()
+
+    def claim_tapbot(self) -> dict:
+        if self.tapbot_ends_at is None or self.tapbot_ends_at > time():
+            raise GameError('Tapbot is not finished')
+
+        self.earn(int((self.tapbot_ends_at - self.tapbot_starts_at) * TAPBOT_DAMAGE_PER_SEC))
+        self.tapbot_starts_at = None
+        self.tapbot_ends_at = None
+
+        return self.tapbot_config()
+
+    def spin(self) -> dict:
+        self.regenerate()
+        if self.spin_energy <= 0:
+            raise GameError('No spins left')
+        if self.spin_energy == SPIN_ENERGY_LIMIT:
+            self.spin_recharged_at = time()
+
+        self.spin_energy -= 1
+        reward = random.choice((100, 500, 1000, 5000))
+        self.earn(reward)
+
+        return {
+            'id': secrets.token_hex(8),
+            'combination': random.choices(('COIN', 'ENERGY', 'BOOST'), k=3),
+            'rewardAmount': reward,
+            'rewardType': 'COINS',
+            '__typename': 'SlotMachineSpinOutput',
+        }
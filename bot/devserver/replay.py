@@ -0,0 +1,187 @@
+import os
+import sys
+import json
+import random
+import asyncio
+import argparse
+import cProfile
+import importlib
+import selectors
+import tempfile
+from time import process_time
+from types import SimpleNamespace
+
+from bot.config import settings
+from bot.config.reloader import settings_reloader
+from bot.core import api
+from bot.core.cassette import CassettePlayer
+from bot.utils import logger
+from bot.utils.graphql import OperationName
+
+
+# Module level clock functions the tap loop reads, replaced by the virtual clock during a replay
+CLOCK_FUNCTIONS = {
+    'bot.core.tapper': ('time', 'monotonic'),
+    'bot.core.api': ('monotonic',),
+    'bot.core.energy': ('time',),
+    'bot.core.models': ('time',),
+    'bot.core.proxies': ('monotonic',),
+    'bot.utils.tokens': ('time',),
+    'bot.utils.limiter': ('monotonic',),
+    'bot.utils.retry': ('monotonic',),
+}
+
+
+class VirtualClock:
+    """Time that only moves when every session is waiting, by as much as the earliest timer needs."""
+
+    def __init__(self, started_at: float):
+        self.started_at = started_at
+        self.elapsed = 0.0
+
+    def monotonic(self) -> float:
+        return self.elapsed
+
+    def time(self) -> float:
+        return self.started_at + self.elapsed
+
+    def advance(self, seconds: float) -> None:
+        self.elapsed += seconds
+
+    def install(self) -> None:
+        for module_name, names in CLOCK_FUNCTIONS.items():
+            module = importlib.import_module(module_name)
+            for name in names:
+                setattr(module, name, getattr(self, name))
+
+
+class VirtualSelector:
+    """Polls the real selector without blocking and advances the clock instead of waiting."""
+
+    def __init__(self, clock: VirtualClock):
+        self.clock = clock
+        self.selector = selectors.DefaultSelector()
+
+    def select(self, timeout: float | None = None):
+        events = self.selector.select(0)
+        if not events and timeout:
+            self.clock.advance(timeout)
+        elif not events and timeout is None:
+            raise RuntimeError("Replay is stuck: no session is waiting for a timer")
+        return events
+
+    def __getattr__(self, name: str):
+        return getattr(self.selector, name)
+
+
+class VirtualEventLoop(asyncio.SelectorEventLoop):
+    def __init__(self, clock: VirtualClock):
+        self.clock = clock
+        super().__init__(selector=VirtualSelector(clock))
+
+    def time(self) -> float:
+        return self.clock.monotonic()
+
+
+class ReplayCollector:
+    def __init__(self):
+        self.requests: dict[str, int] = {}
+        self.taps = 0
+
+    def observe(self, session_name: str, operation: str, latency: float, status: int) -> None:
+        self.requests[operation] = self.requests.get(operation, 0) + 1
+        if operation == OperationName.MutationGameProcessTapsBatch and status < 400:
+            self.taps += 1
+
+
+async def run_session(player: CassettePlayer) -> None:
+    """Runs the session until its cassette is used up, it diverges or the tapper stops."""
+    from bot.core.tapper import Tapper
+
+    tapper = Tapper(tg_client=SimpleNamespace(name=player.session_name), cassette=player)
+    with logger.contextualize(session=player.session_name):
+        run = asyncio.create_task(tapper.run(proxy=None))
+    finished = asyncio.create_task(player.finished.wait())
+
+    await asyncio.wait([run, finished], return_when=asyncio.FIRST_COMPLETED)
+    run.cancel()
+    finished.cancel()
+    await asyncio.gather(run, finished, return_exceptions=True)
+
+
+async def replay(players: list[CassettePlayer], clock: VirtualClock) -> dict:
+    collector = ReplayCollector()
+    api.request_observers.append(collector.observe)
+
+    cpu_started_at = process_time()
+    try:
+        await asyncio.gather(*(run_session(player) for player in players))
+    finally:
+        api.request_observers.remove(collector.observe)
+
+    cpu_seconds = process_time() - cpu_started_at
+    requests = sum(collector.requests.values())
+
+    return {
+        'sessions': len(players),
+        'events': sum(len(player.events) for player in players),
+        'replayed': sum(player.position for player in players),
+        'diverged': {player.session_name: player.mismatch for player in players if player.mismatch},
+        'virtual_seconds': round(clock.elapsed, 3),
+        'cpu_seconds': round(cpu_seconds, 3),
+        'requests': requests,
+        'taps': collector.taps,
+        'cpu_seconds_per_request': round(cpu_seconds / requests, 6) if requests else 0,
+        'operations': dict(sorted(collector.requests.items())),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Replay recorded cassettes through Tapper.run without network')
+    parser.add_argument('cassettes', nargs='+', help='Cassette files written with CASSETTE_DIR')
+    parser.add_argument('-o', '--output', default='replay_output.json', help='Where to write the JSON report')
+    parser.add_argument('--profile', help='Write cProfile stats of the replay to this file')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the random tap counts and sleeps')
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    profile = os.path.abspath(args.profile) if args.profile else None
+    logger.remove()
+    logger.add(sink=sys.stderr, level=args.log_level)
+
+    players = [CassettePlayer(path) for path in args.cassettes]
+    for player in players:
+        # Each session runs with the settings it was recorded with
+        settings_reloader.sessions[player.session_name] = settings.model_copy(update=player.settings)
+    settings.CASSETTE_DIR = ''
+
+    # Session files (user agents, tokens) are written to a scratch directory
+    os.chdir(tempfile.mkdtemp(prefix='memefi-replay-'))
+    random.seed(args.seed)
+
+    clock = VirtualClock(started_at=min(player.started_at for player in players))
+    clock.install()
+    loop = VirtualEventLoop(clock)
+
+    profiler = cProfile.Profile() if profile else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        report = loop.run_until_complete(replay(players=players, clock=clock))
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile)
+        loop.close()
+
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=4)
+
+    print(f"{report['sessions']} sessions | {report['replayed']}/{report['events']} events replayed | "
+          f"{report['virtual_seconds']}s virtual in {report['cpu_seconds']}s CPU | "
+          f"{len(report['diverged'])} diverged | report: {output}")
+
+
+if __name__ == '__main__':
+    main()
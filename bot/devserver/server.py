@@ -0,0 +1,166 @@
+import json
+import asyncio
+import random
+from time import monotonic
+
+from aiohttp import web
+
+from bot.utils.graphql import OperationName, persisted_query_hash
+from .game import Player, GameError, make_token
+
+
+class StandInServer:
+    """Local stand-in for the MemeFi GraphQL API.
+
+    Implements every operation from `bot/utils/graphql.py` on top of `Player`
+    state, with configurable latency, a request rate limit, injected 429 and
+    503 responses and outages. Supports automatic persisted queries and counts uploaded request bytes."""
+
+    def __init__(self, latency: float = 0, jitter: float = 0, rate_limit_probability: float = 0,
+                 retry_after: float | None = 1, token_lifetime: int = 3600, tapbot_duration: float = 3 * 3600,
+                 error_probability: float = 0, requests_per_second: float = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_probability = rate_limit_probability
+        self.error_probability = error_probability
+        # Rate limit of the whole server, as seen by a single egress IP
+        self.requests_per_second = requests_per_second
+        self.allowance = requests_per_second
+        self.allowance_updated_at = monotonic()
+        self.down_until = 0.0
+        self.retry_after = retry_after
+        self.token_lifetime = token_lifetime
+        self.tapbot_duration = tapbot_duration
+
+        self.players: dict[int, Player] = {}
+        self.tokens: dict[str, int] = {}
+        self.requests: dict[str, int] = {}
+        self.persisted_queries: set[str] = set()
+        self.bytes_received = 0
+
+    def take_allowance(self) -> bool:
+        now = monotonic()
+        self.allowance = min(self.allowance + (now - self.allowance_updated_at) * self.requests_per_second,
+                             self.requests_per_second)
+        self.allowance_updated_at = now
+        if self.allowance < 1:
+            return False
+
+        self.allowance -= 1
+        return True
+
+    def start_outage(self, seconds: float) -> None:
+        """Answers every request with 503 for `seconds`."""
+        self.down_until = monotonic() + seconds
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/graphql', self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+
+        if monotonic() < self.down_until or (self.error_probability and random.random() < self.error_probability):
+            return web.Response(status=503, text='Service Unavailable')
+
+        if ((self.requests_per_second and not self.take_allowance())
+                or (self.rate_limit_probability and random.random() < self.rate_limit_probability)):
+            headers = {'Retry-After': f'{self.retry_after:g}'} if self.retry_after is not None else None
+            return web.Response(status=429, headers=headers, text='Too Many Requests')
+
+        raw_body = await request.read()
+        self.bytes_received += len(raw_body)
+        body = json.loads(raw_body)
+        authorization = request.headers.get('Authorization', '')
+        player = self.tokens.get(authorization.removeprefix('Bearer '))
+
+        payloads = body if isinstance(body, list) else [body]
+        if player is None and any(payload.get('operationName') != OperationName.MutationTelegramUserLogin
+                                  for payload in payloads):
+            return web.json_response({'errors': [{'message': 'Unauthorized'}], 'data': None}, status=401)
+
+        if isinstance(body, list):
+            return web.json_response([self.execute(payload=payload, player=player) for payload in body])
+
+        return web.json_response(self.execute(payload=body, player=player))
+
+    def execute(self, payload: dict, player: int | None) -> dict:
+        operation_name = payload.get('operationName')
+        variables = payload.get('variables') or {}
+
+        persisted_query = (payload.get('extensions') or {}).get('persistedQuery')
+        if persisted_query:
+            if 'query' in payload:
+                if persisted_query_hash(payload['query']) != persisted_query.get('sha256Hash'):
+                    return {'errors': [{'message': 'provided sha does not match query'}], 'data': None}
+                self.persisted_queries.add(persisted_query['sha256Hash'])
+            elif persisted_query.get('sha256Hash') not in self.persisted_queries:
+                return {'errors': [{'message': 'PersistedQueryNotFound',
+                                    'extensions': {'code': 'PERSISTED_QUERY_NOT_FOUND'}}], 'data': None}
+
+        self.requests[operation_name] = self.requests.get(operation_name, 0) + 1
+
+        try:
+            if operation_name == OperationName.MutationTelegramUserLogin:
+                return {'data': {'telegramUserLogin': self.login(variables['webAppData'])}}
+
+            if player is None:
+                raise GameError('Unauthorized')
+
+            return {'data': self.resolve(operation_name=operation_name, variables=variables,
+                                         player=self.players[player])}
+        except (GameError, KeyError) as error:
+            return {'errors': [{'message': str(error)}], 'data': None}
+
+    def login(self, web_app_data: dict) -> dict:
+        user = web_app_data['user']
+        telegram_id = int(user['id'])
+        if telegram_id not in self.players:
+            self.players[telegram_id] = Player(telegram_id=telegram_id, first_name=user.get('first_name', ''),
+                                               last_name=user.get('last_name', ''),
+                                               username=user.get('username', ''),
+                                               tapbot_duration=self.tapbot_duration)
+
+        access_token = make_token(telegram_id=telegram_id, lifetime=self.token_lifetime)
+        self.tokens[access_token] = telegram_id
+
+        return {'access_token': access_token, '__typename': 'TelegramUserLoginOutput'}
+
+    @staticmethod
+    def resolve(operation_name: str, variables: dict, player: Player) -> dict:
+        if operation_name == OperationName.QUERY_GAME_CONFIG:
+            return {'telegramGameGetConfig': player.game_config()}
+        if operation_name == OperationName.QueryTelegramUserMe:
+            return {'telegramUserMe': player.user_me()}
+        if operation_name == OperationName.MutationGameProcessTapsBatch:
+            payload = variables['payload']
+            return {'telegramGameProcessTapsBatch': player.process_taps(nonce=payload['nonce'],
+                                                                        taps_count=int(payload['tapsCount']))}
+        if operation_name == OperationName.telegramGameSetNextBoss:
+            return {'telegramGameSetNextBoss': player.set_next_boss()}
+        if operation_name == OperationName.telegramGameActivateBooster:
+            return {'telegramGameActivateBooster': player.activate_booster(variables['boosterType'])}
+        if operation_name == OperationName.telegramGamePurchaseUpgrade:
+            return {'telegramGamePurchaseUpgrade': player.purchase_upgrade(variables['upgradeType'])}
+        if operation_name == OperationName.TapbotConfig:
+            return {'telegramGameTapbotGetConfig': player.tapbot_config()}
+        if operation_name == OperationName.TapbotStart:
+            return {'telegramGameTapbotStart': player.start_tapbot()}
+        if operation_name == OperationName.TapbotClaim:
+            return {'telegramGameTapbotClaimCoins': player.claim_tapbot()}
+        if operation_name == OperationName.Mutation:
+            return {'telegramUserClaimReferralBonus': True}
+        if operation_name == OperationName.Spinner:
+            return {'slotMachineSpin': player.spin()}
+
+        raise GameError(f'Unknown operation {operation_name}')
+
+
+async def start_server(server: StandInServer, host: str = '127.0.0.1', port: int = 8080) -> web.AppRunner:
+    runner = web.AppRunner(server.create_app())
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+
+    return runner
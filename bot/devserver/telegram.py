@@ -0,0 +1,46 @@
+import asyncio
+import json
+from time import time
+from types import SimpleNamespace
+from urllib.parse import quote
+
+from pyrogram.raw.types import InputPeerUser
+
+
+class FakeClient:
+    """Offline stand-in for `pyrogram.Client` with the calls `Tapper` makes."""
+
+    def __init__(self, name: str, user_id: int, latency: float = 0):
+        self.name = name
+        self.latency = latency
+        self.proxy = None
+        self.is_connected = False
+        self.me = SimpleNamespace(id=user_id, first_name=name, last_name='', username=name, language_code='en')
+
+    async def _wait(self) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def connect(self) -> bool:
+        await self._wait()
+        self.is_connected = True
+        return True
+
+    async def disconnect(self) -> None:
+        self.is_connected = False
+
+    async def resolve_peer(self, peer_id: str) -> InputPeerUser:
+        await self._wait()
+        return InputPeerUser(user_id=1, access_hash=0)
+
+    async def get_me(self) -> SimpleNamespace:
+        await self._wait()
+        return self.me
+
+    async def invoke(self, query) -> SimpleNamespace:
+        await self._wait()
+        user = quote(json.dumps({'id': self.me.id, 'first_name': self.me.first_name}))
+        web_app_data = quote(f'query_id=AAH{self.me.id}&user={user}&auth_date={int(time())}&hash=fake')
+
+        return SimpleNamespace(url=f'https://tg-app.memefi.club/game#tgWebAppData={web_app_data}'
+                                   f'&tgWebAppVersion=7.2&tgWebAppPlatform=android')
@@ -1,5 +1,5 @@
 from .logger import logger
-from . import launcher
+from . import metrics
 from . import graphql
 from . import boosts
 
@@ -0,0 +1,177 @@
+import os
+import json
+import asyncio
+import sqlite3
+from time import time
+from pathlib import Path
+from contextlib import suppress
+from concurrent.futures import ThreadPoolExecutor
+
+from bot.config import settings
+from bot.utils.logger import logger
+
+
+CHECK_REPORT_FILE = 'session_check.json'
+
+# Size of a Telegram MTProto auth key in bytes
+AUTH_KEY_SIZE = 256
+
+
+def get_session_path(session_name: str) -> str:
+    return os.path.join('sessions', f'{session_name}.session')
+
+
+def check_session_file(path: str) -> dict:
+    """Reads the Pyrogram SQLite storage of a session, read-only, and tells whether it holds
+    an auth key for a logged in user. Sessions that can't be read for another reason, like
+    a lock held by a running bot, are reported as `error` rather than `dead`."""
+    result = {'status': 'ok', 'reason': '', 'user_id': None}
+    try:
+        result['mtime'] = os.path.getmtime(path)
+        if os.path.getsize(path) == 0:
+            return {**result, 'status': 'dead', 'reason': 'empty file'}
+
+        connection = sqlite3.connect(f'{Path(path).resolve().as_uri()}?mode=ro', uri=True, timeout=5)
+        try:
+            row = connection.execute('SELECT auth_key, user_id FROM sessions').fetchone()
+        finally:
+            connection.close()
+    except sqlite3.OperationalError as error:
+        if 'locked' in str(error) or 'unable to open' in str(error):
+            return {**result, 'status': 'error', 'reason': str(error)}
+        return {**result, 'status': 'dead', 'reason': f'not a Pyrogram session: {error}'}
+    except sqlite3.DatabaseError as error:
+        return {**result, 'status': 'dead', 'reason': f'not a Pyrogram session: {error}'}
+    except OSError as error:
+        return {**result, 'status': 'error', 'reason': str(error)}
+
+    if row is None:
+        return {**result, 'status': 'dead', 'reason': 'no session stored'}
+
+    auth_key, user_id = row
+    if not auth_key or len(auth_key) != AUTH_KEY_SIZE:
+        return {**result, 'status': 'dead', 'reason': 'no auth key'}
+    if not user_id:
+        return {**result, 'status': 'dead', 'reason': 'not logged in'}
+
+    return {**result, 'user_id': user_id}
+
+
+async def check_session_online(session_name: str, proxy: str | None = None) -> dict:
+    """Connects the session, through `proxy` when given, and makes one authorized call (`get_me`)."""
+    from pyrogram.errors import Unauthorized, UserDeactivated, AuthKeyUnregistered
+    from bot.core.telegram import tg_pool, get_proxy_dict
+    from bot.utils.launcher import create_tg_client
+
+    tg_client = create_tg_client(session_name)
+    tg_client.proxy = get_proxy_dict(proxy)
+
+    try:
+        async with tg_pool.connection(tg_client):
+            await tg_client.get_me()
+    except (Unauthorized, UserDeactivated, AuthKeyUnregistered) as error:
+        return {'status': 'dead', 'reason': f'rejected by Telegram: {error.ID or type(error).__name__}'}
+    except Exception as error:
+        return {'status': 'error', 'reason': f'{type(error).__name__}: {error}'}
+
+    return {}
+
+
+async def check_sessions(session_names: list[str], online: bool = False) -> dict[str, dict]:
+    """Checks every session file, at most SESSION_CHECK_CONCURRENCY at a time. With `online`
+    the sessions whose files look valid also make an authorized Telegram call. With
+    USE_PROXY_FROM_FILE they get their proxy as a run would and aren't checked without one,
+    so Telegram never sees them from this host's address."""
+    concurrency = max(settings.SESSION_CHECK_CONCURRENCY, 1)
+    loop = asyncio.get_running_loop()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = await asyncio.gather(*(
+            loop.run_in_executor(executor, check_session_file, get_session_path(session_name))
+            for session_name in session_names))
+    report = dict(zip(session_names, results))
+
+    if online:
+        from bot.core.telegram import tg_pool
+        from bot.utils.launcher import assign_proxies
+
+        valid = [session_name for session_name, result in report.items() if result['status'] == 'ok']
+        proxies = await assign_proxies(valid) if settings.USE_PROXY_FROM_FILE else {}
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def check(session_name: str) -> None:
+            proxy = proxies.get(session_name)
+            if settings.USE_PROXY_FROM_FILE and proxy is None:
+                report[session_name].update(status='error', reason='no healthy proxy to check it online through')
+                return
+
+            async with semaphore:
+                report[session_name].update(await check_session_online(session_name, proxy=proxy))
+            # Pyrogram writes the session file on connect, the launcher compares against the new time
+            with suppress(OSError):
+                report[session_name]['mtime'] = os.path.getmtime(get_session_path(session_name))
+
+        try:
+            await asyncio.gather(*(check(session_name) for session_name in valid))
+        finally:
+            await tg_pool.close()
+
+    return report
+
+
+def write_report(report: dict[str, dict], path: str = CHECK_REPORT_FILE) -> None:
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'w') as file:
+        json.dump({'checked_at': int(time()), 'sessions': report}, file, indent=4)
+    os.replace(temporary_path, path)
+
+
+def read_report(path: str = CHECK_REPORT_FILE) -> dict[str, dict]:
+    try:
+        with open(path, 'r') as file:
+            return json.load(file).get('sessions', {})
+    except (FileNotFoundError, json.JSONDecodeError, AttributeError):
+        return {}
+
+
+async def run_check(session_names: list[str], online: bool = False) -> dict[str, dict]:
+    report = await check_sessions(session_names, online=online)
+    write_report(report)
+
+    for session_name, result in sorted(report.items()):
+        if result['status'] != 'ok':
+            # Without colors, the reasons quote errors verbatim
+            logger.opt(colors=False).warning(f"{session_name} | {result['status']}: {result['reason']}")
+
+    statuses = [result['status'] for result in report.values()]
+    logger.info(f"Checked {len(report)} sessions | <g>{statuses.count('ok')}</g> ok | "
+                f"<r>{statuses.count('dead')}</r> dead | <y>{statuses.count('error')}</y> errors | "
+                f"report: <e>{CHECK_REPORT_FILE}</e>")
+    return report
+
+
+def skip_dead_sessions(session_names: list[str]) -> list[str]:
+    """Leaves out sessions the last check found dead, unless their file changed since."""
+    report = read_report()
+    if not report:
+        return session_names
+
+    alive = []
+    for session_name in session_names:
+        result = report.get(session_name)
+        if result is None or result.get('status') != 'dead':
+            alive.append(session_name)
+            continue
+
+        try:
+            modified = os.path.getmtime(get_session_path(session_name)) != result.get('mtime')
+        except OSError:
+            modified = False
+        if modified:
+            alive.append(session_name)
+
+    if len(alive) < len(session_names):
+        logger.warning(f"Skipping {len(session_names) - len(alive)} sessions found dead by the last check "
+                       f"(<e>{CHECK_REPORT_FILE}</e>), run with --check after fixing them")
+
+    return alive
@@ -0,0 +1,34 @@
+import json
+import asyncio
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+
+def dumps(value) -> str:
+    """JSON encoder for aiohttp's `json_serialize`, using orjson when it's installed."""
+    if orjson is not None:
+        return orjson.dumps(value).decode()
+    return json.dumps(value)
+
+
+def loads(data: bytes | str):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def install_uvloop() -> bool:
+    """Makes uvloop the event loop policy if it's installed. Returns whether it was installed."""
+    if uvloop is None:
+        return False
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
@@ -1,20 +1,184 @@
 from enum import Enum
+from hashlib import sha256
+from functools import lru_cache
+
+
+BOSS_FIELDS = """\
+  currentBoss {
+    _id
+    level
+    currentHealth
+    maxHealth
+    __typename
+  }"""
+
+FREE_BOOSTS_FIELDS = """\
+  freeBoosts {
+    _id
+    currentTurboAmount
+    maxTurboAmount
+    turboLastActivatedAt
+    turboAmountLastRechargeDate
+    currentRefillEnergyAmount
+    maxRefillEnergyAmount
+    refillEnergyLastActivatedAt
+    refillEnergyAmountLastRechargeDate
+    __typename
+  }"""
+
+# QUERY_GAME_CONFIG selects a few more fields (spins, leader bonus) than the mutations
+GAME_CONFIG_FRAGMENT = f"""\
+fragment FragmentBossFightConfig on TelegramGameConfigOutput {{
+  _id
+  coinsAmount
+  currentEnergy
+  maxEnergy
+  weaponLevel
+  zonesCount
+  tapsReward
+  energyLimitLevel
+  energyRechargeLevel
+  tapBotLevel
+{BOSS_FIELDS}
+{FREE_BOOSTS_FIELDS}
+  bonusLeaderDamageEndAt
+  bonusLeaderDamageStartAt
+  bonusLeaderDamageMultiplier
+  nonce
+  spinEnergyNextRechargeAt
+  spinEnergyNonRefillable
+  spinEnergyRefillable
+  spinEnergyTotal
+  spinEnergyStaticLimit
+  __typename
+}}"""
+
+BOSS_FIGHT_CONFIG_FRAGMENT = f"""\
+fragment FragmentBossFightConfig on TelegramGameConfigOutput {{
+  _id
+  coinsAmount
+  currentEnergy
+  maxEnergy
+  weaponLevel
+  energyLimitLevel
+  energyRechargeLevel
+  tapBotLevel
+{BOSS_FIELDS}
+{FREE_BOOSTS_FIELDS}
+  nonce
+  __typename
+}}"""
+
+TAPBOT_CONFIG_FRAGMENT = """\
+fragment FragmentTapBotConfig on TelegramGameTapbotOutput {
+  damagePerSec
+  endsAt
+  id
+  isPurchased
+  startsAt
+  totalAttempts
+  usedAttempts
+  __typename
+}"""
+
+# Only the fields read by bot.core.models
+SLIM_BOSS_FIGHT_CONFIG_FRAGMENT = """\
+fragment FragmentBossFightConfig on TelegramGameConfigOutput {
+  coinsAmount
+  currentEnergy
+  maxEnergy
+  weaponLevel
+  energyLimitLevel
+  energyRechargeLevel
+  currentBoss {
+    level
+    currentHealth
+    maxHealth
+  }
+  freeBoosts {
+    currentTurboAmount
+    maxTurboAmount
+    turboAmountLastRechargeDate
+    currentRefillEnergyAmount
+    maxRefillEnergyAmount
+    refillEnergyAmountLastRechargeDate
+  }
+  nonce
+}"""
+
+SLIM_GAME_CONFIG_FRAGMENT = SLIM_BOSS_FIGHT_CONFIG_FRAGMENT.replace(
+    "  nonce\n", "  nonce\n  spinEnergyNextRechargeAt\n  spinEnergyTotal\n")
+
+SLIM_TAPBOT_CONFIG_FRAGMENT = """\
+fragment FragmentTapBotConfig on TelegramGameTapbotOutput {
+  damagePerSec
+  endsAt
+  isPurchased
+  totalAttempts
+  usedAttempts
+}"""
+
+
+def boss_fight_operation(definition: str, field: str, fragment: str = BOSS_FIGHT_CONFIG_FRAGMENT) -> str:
+    return f"{definition} {{\n  {field} {{\n    ...FragmentBossFightConfig\n    __typename\n  }}\n}}\n\n{fragment}"
+
+
+def tapbot_operation(definition: str, field: str, fragment: str = TAPBOT_CONFIG_FRAGMENT) -> str:
+    return f"{fragment}\n\n{definition} {{\n  {field} {{\n    ...FragmentTapBotConfig\n    __typename\n  }}\n}}"
 
 
 class Query(str, Enum):
-    QUERY_GAME_CONFIG = "query QUERY_GAME_CONFIG {\n  telegramGameGetConfig {\n    ...FragmentBossFightConfig\n    __typename\n  }\n}\n\nfragment FragmentBossFightConfig on TelegramGameConfigOutput {\n  _id\n  coinsAmount\n  currentEnergy\n  maxEnergy\n  weaponLevel\n  zonesCount\n  tapsReward\n  energyLimitLevel\n  energyRechargeLevel\n  tapBotLevel\n  currentBoss {\n    _id\n    level\n    currentHealth\n    maxHealth\n    __typename\n  }\n  freeBoosts {\n    _id\n    currentTurboAmount\n    maxTurboAmount\n    turboLastActivatedAt\n    turboAmountLastRechargeDate\n    currentRefillEnergyAmount\n    maxRefillEnergyAmount\n    refillEnergyLastActivatedAt\n    refillEnergyAmountLastRechargeDate\n    __typename\n  }\n  bonusLeaderDamageEndAt\n  bonusLeaderDamageStartAt\n  bonusLeaderDamageMultiplier\n  nonce\n  spinEnergyNextRechargeAt\n  spinEnergyNonRefillable\n  spinEnergyRefillable\n  spinEnergyTotal\n  spinEnergyStaticLimit\n  __typename\n}"
+    QUERY_GAME_CONFIG = boss_fight_operation("query QUERY_GAME_CONFIG", "telegramGameGetConfig",
+                                             fragment=GAME_CONFIG_FRAGMENT)
     MutationTelegramUserLogin = "mutation MutationTelegramUserLogin($webAppData: TelegramWebAppDataInput!) {\n  telegramUserLogin(webAppData: $webAppData) {\n    access_token\n    __typename\n  }\n}"
-    MutationGameProcessTapsBatch = "mutation MutationGameProcessTapsBatch($payload: TelegramGameTapsBatchInput!) {\n  telegramGameProcessTapsBatch(payload: $payload) {\n    ...FragmentBossFightConfig\n    __typename\n  }\n}\n\nfragment FragmentBossFightConfig on TelegramGameConfigOutput {\n  _id\n  coinsAmount\n  currentEnergy\n  maxEnergy\n  weaponLevel\n  energyLimitLevel\n  energyRechargeLevel\n  tapBotLevel\n  currentBoss {\n    _id\n    level\n    currentHealth\n    maxHealth\n    __typename\n  }\n  freeBoosts {\n    _id\n    currentTurboAmount\n    maxTurboAmount\n    turboLastActivatedAt\n    turboAmountLastRechargeDate\n    currentRefillEnergyAmount\n    maxRefillEnergyAmount\n    refillEnergyLastActivatedAt\n    refillEnergyAmountLastRechargeDate\n    __typename\n  }\n  nonce\n  __typename\n}"
-    telegramGameSetNextBoss = "mutation telegramGameSetNextBoss {\n  telegramGameSetNextBoss {\n    ...FragmentBossFightConfig\n    __typename\n  }\n}\n\nfragment FragmentBossFightConfig on TelegramGameConfigOutput {\n  _id\n  coinsAmount\n  currentEnergy\n  maxEnergy\n  weaponLevel\n  energyLimitLevel\n  energyRechargeLevel\n  tapBotLevel\n  currentBoss {\n    _id\n    level\n    currentHealth\n    maxHealth\n    __typename\n  }\n  freeBoosts {\n    _id\n    currentTurboAmount\n    maxTurboAmount\n    turboLastActivatedAt\n    turboAmountLastRechargeDate\n    currentRefillEnergyAmount\n    maxRefillEnergyAmount\n    refillEnergyLastActivatedAt\n    refillEnergyAmountLastRechargeDate\n    __typename\n  }\n  nonce\n  __typename\n}"
-    telegramGameActivateBooster = "mutation telegramGameActivateBooster($boosterType: BoosterType!) {\n  telegramGameActivateBooster(boosterType: $boosterType) {\n    ...FragmentBossFightConfig\n    __typename\n  }\n}\n\nfragment FragmentBossFightConfig on TelegramGameConfigOutput {\n  _id\n  coinsAmount\n  currentEnergy\n  maxEnergy\n  weaponLevel\n  energyLimitLevel\n  energyRechargeLevel\n  tapBotLevel\n  currentBoss {\n    _id\n    level\n    currentHealth\n    maxHealth\n    __typename\n  }\n  freeBoosts {\n    _id\n    currentTurboAmount\n    maxTurboAmount\n    turboLastActivatedAt\n    turboAmountLastRechargeDate\n    currentRefillEnergyAmount\n    maxRefillEnergyAmount\n    refillEnergyLastActivatedAt\n    refillEnergyAmountLastRechargeDate\n    __typename\n  }\n  nonce\n  __typename\n}"
-    telegramGamePurchaseUpgrade = "mutation telegramGamePurchaseUpgrade($upgradeType: UpgradeType!) {\n  telegramGamePurchaseUpgrade(type: $upgradeType) {\n    ...FragmentBossFightConfig\n    __typename\n  }\n}\n\nfragment FragmentBossFightConfig on TelegramGameConfigOutput {\n  _id\n  coinsAmount\n  currentEnergy\n  maxEnergy\n  weaponLevel\n  energyLimitLevel\n  energyRechargeLevel\n  tapBotLevel\n  currentBoss {\n    _id\n    level\n    currentHealth\n    maxHealth\n    __typename\n  }\n  freeBoosts {\n    _id\n    currentTurboAmount\n    maxTurboAmount\n    turboLastActivatedAt\n    turboAmountLastRechargeDate\n    currentRefillEnergyAmount\n    maxRefillEnergyAmount\n    refillEnergyLastActivatedAt\n    refillEnergyAmountLastRechargeDate\n    __typename\n  }\n  nonce\n  __typename\n}"
+    MutationGameProcessTapsBatch = boss_fight_operation(
+        "mutation MutationGameProcessTapsBatch($payload: TelegramGameTapsBatchInput!)",
+        "telegramGameProcessTapsBatch(payload: $payload)")
+    telegramGameSetNextBoss = boss_fight_operation("mutation telegramGameSetNextBoss", "telegramGameSetNextBoss")
+    telegramGameActivateBooster = boss_fight_operation(
+        "mutation telegramGameActivateBooster($boosterType: BoosterType!)",
+        "telegramGameActivateBooster(boosterType: $boosterType)")
+    telegramGamePurchaseUpgrade = boss_fight_operation(
+        "mutation telegramGamePurchaseUpgrade($upgradeType: UpgradeType!)",
+        "telegramGamePurchaseUpgrade(type: $upgradeType)")
     QueryTelegramUserMe = "query QueryTelegramUserMe {\n  telegramUserMe {\n    firstName\n    lastName\n    telegramId\n    username\n    referralCode\n    isDailyRewardClaimed\n    referral {\n      username\n      lastName\n      firstName\n      bossLevel\n      coinsAmount\n      __typename\n    }\n    isReferralInitialJoinBonusAvailable\n    league\n    leagueIsOverTop10k\n    leaguePosition\n    _id\n    opens {\n      isAvailable\n      openType\n      __typename\n    }\n    features\n    __typename\n  }\n}"
-    TapbotConfig = "fragment FragmentTapBotConfig on TelegramGameTapbotOutput {\n  damagePerSec\n  endsAt\n  id\n  isPurchased\n  startsAt\n  totalAttempts\n  usedAttempts\n  __typename\n}\n\nquery TapbotConfig {\n  telegramGameTapbotGetConfig {\n    ...FragmentTapBotConfig\n    __typename\n  }\n}"
-    TapbotStart = "fragment FragmentTapBotConfig on TelegramGameTapbotOutput {\n  damagePerSec\n  endsAt\n  id\n  isPurchased\n  startsAt\n  totalAttempts\n  usedAttempts\n  __typename\n}\n\nmutation TapbotStart {\n  telegramGameTapbotStart {\n    ...FragmentTapBotConfig\n    __typename\n  }\n}"
-    TapbotClaim = "fragment FragmentTapBotConfig on TelegramGameTapbotOutput {\n  damagePerSec\n  endsAt\n  id\n  isPurchased\n  startsAt\n  totalAttempts\n  usedAttempts\n  __typename\n}\n\nmutation TapbotClaim {\n  telegramGameTapbotClaimCoins {\n    ...FragmentTapBotConfig\n    __typename\n  }\n}"
+    TapbotConfig = tapbot_operation("query TapbotConfig", "telegramGameTapbotGetConfig")
+    TapbotStart = tapbot_operation("mutation TapbotStart", "telegramGameTapbotStart")
+    TapbotClaim = tapbot_operation("mutation TapbotClaim", "telegramGameTapbotClaimCoins")
     Mutation = "mutation Mutation {\n  telegramUserClaimReferralBonus\n}"
     Spinner = "mutation spinSlotMachine {\n  slotMachineSpin {\n    id\n    combination\n    rewardAmount\n    rewardType\n    __typename\n  }\n}"
 
+
+class SlimQuery(str, Enum):
+    """Trimmed selection sets for the hot path, used with GRAPHQL_SLIM_QUERIES."""
+    QUERY_GAME_CONFIG = boss_fight_operation("query QUERY_GAME_CONFIG", "telegramGameGetConfig",
+                                             fragment=SLIM_GAME_CONFIG_FRAGMENT)
+    MutationGameProcessTapsBatch = boss_fight_operation(
+        "mutation MutationGameProcessTapsBatch($payload: TelegramGameTapsBatchInput!)",
+        "telegramGameProcessTapsBatch(payload: $payload)", fragment=SLIM_BOSS_FIGHT_CONFIG_FRAGMENT)
+    telegramGameSetNextBoss = boss_fight_operation("mutation telegramGameSetNextBoss", "telegramGameSetNextBoss",
+                                                   fragment=SLIM_BOSS_FIGHT_CONFIG_FRAGMENT)
+    telegramGameActivateBooster = boss_fight_operation(
+        "mutation telegramGameActivateBooster($boosterType: BoosterType!)",
+        "telegramGameActivateBooster(boosterType: $boosterType)", fragment=SLIM_BOSS_FIGHT_CONFIG_FRAGMENT)
+    telegramGamePurchaseUpgrade = boss_fight_operation(
+        "mutation telegramGamePurchaseUpgrade($upgradeType: UpgradeType!)",
+        "telegramGamePurchaseUpgrade(type: $upgradeType)", fragment=SLIM_BOSS_FIGHT_CONFIG_FRAGMENT)
+    QueryTelegramUserMe = "query QueryTelegramUserMe {\n  telegramUserMe {\n    isReferralInitialJoinBonusAvailable\n  }\n}"
+    TapbotConfig = tapbot_operation("query TapbotConfig", "telegramGameTapbotGetConfig",
+                                    fragment=SLIM_TAPBOT_CONFIG_FRAGMENT)
+    TapbotStart = tapbot_operation("mutation TapbotStart", "telegramGameTapbotStart",
+                                   fragment=SLIM_TAPBOT_CONFIG_FRAGMENT)
+    TapbotClaim = tapbot_operation("mutation TapbotClaim", "telegramGameTapbotClaimCoins",
+                                   fragment=SLIM_TAPBOT_CONFIG_FRAGMENT)
+
+
+@lru_cache(maxsize=None)
+def persisted_query_hash(query: str) -> str:
+    """sha256 of the query document, as used by automatic persisted queries."""
+    return sha256(query.encode()).hexdigest()
+
+
 class OperationName(str, Enum):
     QUERY_GAME_CONFIG = "QUERY_GAME_CONFIG"
     MutationTelegramUserLogin = "MutationTelegramUserLogin"
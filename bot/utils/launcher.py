@@ -1,16 +1,21 @@
 import os
-import glob
 import asyncio
 import argparse
-from itertools import cycle
-
-from pyrogram import Client
-from better_proxy import Proxy
+from typing import TYPE_CHECKING, Iterable, Iterator
 
 from bot.config import settings
-from bot.utils import logger
-from bot.core.tapper import run_tapper
-from bot.core.registrator import register_sessions
+from bot.config.reloader import settings_reloader
+from bot.utils import logger, metrics
+from bot.utils.registry import session_registry
+from bot.utils.summary import LogSummary
+from bot.utils.checker import CHECK_REPORT_FILE, run_check, skip_dead_sessions
+from bot.utils.profiler import (LoopLagMonitor, SamplingProfiler, enable_slow_callback_logging,
+                                install_profile_signal, make_profile_handler)
+
+# Pyrogram and the tapper are imported where they are used, so the banner and
+# argument parsing don't wait for them
+if TYPE_CHECKING:
+    from pyrogram import Client
 
 
 start_text = """
@@ -30,51 +35,85 @@ Select an action:
 
 
 def get_session_names() -> list[str]:
-    session_names = glob.glob('sessions/*.session')
-    session_names = [os.path.splitext(os.path.basename(file))[0] for file in session_names]
+    with os.scandir('sessions') as entries:
+        return [entry.name[:-len('.session')] for entry in entries if entry.name.endswith('.session')]
 
-    return session_names
 
+def get_proxies() -> list[str]:
+    if not settings.USE_PROXY_FROM_FILE:
+        return []
 
-def get_proxies() -> list[Proxy]:
-    if settings.USE_PROXY_FROM_FILE:
-        with open(file='bot/config/proxies.txt', encoding='utf-8-sig') as file:
-            proxies = [Proxy.from_str(proxy=row.strip()).as_url for row in file]
-    else:
-        proxies = []
+    from better_proxy import Proxy
 
-    return proxies
+    with open(file='bot/config/proxies.txt', encoding='utf-8-sig') as file:
+        return [Proxy.from_str(proxy=row.strip()).as_url for row in file]
 
 
-async def get_tg_clients() -> list[Client]:
-    session_names = get_session_names()
+async def assign_proxies(session_names: list[str], proxies: list[str] | None = None) -> dict[str, str | None]:
+    """Probes the proxies, then keeps the proxy a session used before while it's healthy
+    and gives new sessions the best scored healthy proxy."""
+    from bot.core.proxies import proxy_pool
 
-    if not session_names:
-        raise FileNotFoundError("Not found session files")
+    proxy_pool.add(get_proxies() if proxies is None else proxies)
+    if proxy_pool.proxies:
+        await proxy_pool.check()
 
-    if not settings.API_ID or not settings.API_HASH:
-        raise ValueError("API_ID and API_HASH not found in the .env file.")
+    assignments = proxy_pool.assign(session_names)
 
-    tg_clients = [Client(
+    # Worker processes load the registry on their own
+    session_registry.flush()
+
+    return assignments
+
+
+def create_tg_client(session_name: str) -> 'Client':
+    from pyrogram import Client
+
+    return Client(
         name=session_name,
         api_id=settings.API_ID,
         api_hash=settings.API_HASH,
-        workdir='sessions/',
-        plugins=dict(root='bot/plugins')
-    ) for session_name in session_names]
+        workdir='sessions/'
+    )
 
-    return tg_clients
+
+def get_tg_clients(session_names: list[str] | None = None) -> Iterator['Client']:
+    """Clients are created as the iterator is consumed, `run_tasks` starts the first
+    sessions before the rest of the fleet is constructed."""
+    if session_names is None:
+        session_names = get_session_names()
+
+    if not session_names:
+        raise FileNotFoundError("Not found session files")
+
+    if not settings.API_ID or not settings.API_HASH:
+        raise ValueError("API_ID and API_HASH not found in the .env file.")
+
+    return (create_tg_client(session_name) for session_name in session_names)
 
 
 async def process() -> None:
     parser = argparse.ArgumentParser()
     parser.add_argument('-a', '--action', type=int, help='Action to perform')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of worker processes to run sessions in')
+    parser.add_argument('--check', action='store_true',
+                        help=f'Validate the session files, write {CHECK_REPORT_FILE} and exit')
+    parser.add_argument('--check-online', action='store_true',
+                        help='With --check, also make one authorized Telegram call per session')
 
-    logger.info(f"Detected {len(get_session_names())} sessions | {len(get_proxies())} proxies")
+    session_names = get_session_names()
+    proxies = get_proxies()
+
+    logger.info(f"Detected {len(session_names)} sessions | {len(proxies)} proxies")
     logger.warning("⚠️ \n<e>en:</e> NOT FOR SALE\n<e>ru:</e> НЕ ДЛЯ ПРОДАЖИ\n<e>es:</e> NO VENTA\n<e>fr:</e> PAS À VENDRE\n<e>it:</e> NON PER VENDITA\n<e>gh:</e> YƐN TƆN")
     logger.info("<b>For updates and support visit:</b> <e>https://github.com/Freddywhest/MemeFiBot</e>\n🚀 Discover the latest in crypto airdrops and mining bots! Join us for regular updates on upcoming airdrops, insightful guides on mining bots, and expert tips to maximize your rewards in the crypto space. Stay informed and engaged with Freddy Bots!\n🔗 Join us: <e>https://t.me/freddy_bots</e>")
 
-    action = parser.parse_args().action
+    args = parser.parse_args()
+    action = args.action
+
+    if args.check:
+        await run_check(session_names, online=args.check_online)
+        return
 
     if not action:
         print(start_text)
@@ -90,18 +129,112 @@ async def process() -> None:
                 action = int(action)
                 break
 
+    if action == 2:
+        session_names = skip_dead_sessions(session_names)
+
     if action == 1:
+        from bot.core.registrator import register_sessions
+
         await register_sessions()
+    elif action == 2 and args.workers > 1:
+        from bot.utils.workers import Supervisor
+
+        if not session_names:
+            raise FileNotFoundError("Not found session files")
+
+        assignments = await assign_proxies(session_names, proxies=proxies)
+        await Supervisor(assignments=assignments, workers=args.workers).run()
     elif action == 2:
-        tg_clients = await get_tg_clients()
+        tg_clients = get_tg_clients(session_names=session_names)
 
-        await run_tasks(tg_clients=tg_clients)
+        await run_tasks(tg_clients=tg_clients, proxies=await assign_proxies(session_names, proxies=proxies))
 
 
-async def run_tasks(tg_clients: list[Client]):
-    proxies = get_proxies()
-    proxies_cycle = cycle(proxies) if proxies else None
-    tasks = [asyncio.create_task(run_tapper(tg_client=tg_client, proxy=next(proxies_cycle) if proxies_cycle else None))
-             for tg_client in tg_clients]
+async def run_tasks(tg_clients: Iterable['Client'], proxies: dict[str, str | None] | None = None):
+    from bot.core.tapper import Tapper, run_tapper
+    from bot.core.scheduler import Scheduler
+    from bot.core.telegram import tg_pool
+    from bot.core.connections import connector_pool
+    from bot.core.proxies import proxy_pool
+    from bot.core import api
+    from bot.core.upgrades import upgrade_costs
 
-    await asyncio.gather(*tasks)
+    if proxies is None:
+        tg_clients = list(tg_clients)
+        proxies = await assign_proxies([tg_client.name for tg_client in tg_clients])
+    else:
+        # Assigned by the supervisor. Only the shard's own proxies are added, so failover never
+        # moves a session onto another worker's egress and its share of the limits
+        proxy_pool.add([proxy for proxy in dict.fromkeys(proxies.values()) if proxy is not None])
+        for session_name, proxy in proxies.items():
+            proxy_pool.set(session_name, proxy)
+
+    loop = asyncio.get_running_loop()
+    profiler = SamplingProfiler(directory=settings.PROFILES_DIR, interval=settings.PROFILE_INTERVAL)
+    install_profile_signal(loop=loop, profiler=profiler, seconds=settings.PROFILE_SECONDS)
+    if settings.SLOW_CALLBACK_DURATION > 0:
+        enable_slow_callback_logging(loop=loop, duration=settings.SLOW_CALLBACK_DURATION)
+
+    lag_monitor = asyncio.create_task(LoopLagMonitor(interval=settings.LOOP_LAG_INTERVAL,
+                                                     threshold=settings.LOOP_LAG_THRESHOLD).run())
+    registry_writer = asyncio.create_task(session_registry.run(interval=settings.REGISTRY_FLUSH_INTERVAL))
+    upgrade_costs_writer = asyncio.create_task(upgrade_costs.run(interval=settings.REGISTRY_FLUSH_INTERVAL))
+
+    settings_reloader.load()
+    settings_watcher = None
+    if settings.SETTINGS_RELOAD_INTERVAL > 0:
+        settings_watcher = asyncio.create_task(settings_reloader.run(interval=settings.SETTINGS_RELOAD_INTERVAL))
+
+    proxy_checker = None
+    if proxy_pool.proxies:
+        api.request_observers.append(proxy_pool.observe_request)
+        proxy_checker = asyncio.create_task(proxy_pool.run(interval=settings.PROXY_CHECK_INTERVAL))
+
+    if settings.METRICS_ENABLED or settings.LOG_SUMMARY_INTERVAL > 0:
+        api.request_observers.append(metrics.observe_request)
+
+    log_summary = None
+    if settings.LOG_SUMMARY_INTERVAL > 0:
+        log_summary = asyncio.create_task(LogSummary(interval=settings.LOG_SUMMARY_INTERVAL).run())
+
+    metrics_runner = None
+    if settings.METRICS_ENABLED:
+        metrics_runner = await metrics.start_metrics_server(
+            host=settings.METRICS_HOST, port=settings.METRICS_PORT,
+            routes={'/profile': make_profile_handler(profiler=profiler, seconds=settings.PROFILE_SECONDS)})
+
+    scheduler = Scheduler(workers=settings.SCHEDULER_WORKERS) if settings.USE_SCHEDULER else None
+    tasks = [asyncio.create_task(scheduler.run())] if scheduler is not None else []
+
+    try:
+        # Sessions are started in batches with a yield in between, so the first ones
+        # make progress while the rest of the fleet is still being constructed
+        for index, tg_client in enumerate(tg_clients, start=1):
+            proxy = proxies.get(tg_client.name)
+            if scheduler is not None:
+                scheduler.add(tapper=Tapper(tg_client=tg_client), proxy=proxy)
+            else:
+                tasks.append(asyncio.create_task(run_tapper(tg_client=tg_client, proxy=proxy)))
+
+            if index % settings.STARTUP_BATCH_SIZE == 0:
+                await asyncio.sleep(0)
+
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        lag_monitor.cancel()
+        registry_writer.cancel()
+        upgrade_costs_writer.cancel()
+        if settings_watcher is not None:
+            settings_watcher.cancel()
+        if log_summary is not None:
+            log_summary.cancel()
+        if proxy_checker is not None:
+            proxy_checker.cancel()
+        session_registry.flush()
+        upgrade_costs.flush()
+        await tg_pool.close()
+        await connector_pool.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
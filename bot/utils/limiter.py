@@ -0,0 +1,162 @@
+import heapq
+import asyncio
+import itertools
+from time import monotonic
+
+from bot.config import settings
+from bot.config.config import Settings
+from bot.config.reloader import settings_reloader
+from bot.utils.logger import logger
+from bot.utils import metrics
+from bot.utils.proxy import mask_proxy
+
+
+egress_rate = metrics.Gauge('memefi_egress_rate', 'Requests per second allowed through each egress')
+
+
+class TokenBucket:
+    """Async token bucket. `rate` tokens are added per second up to `capacity`;
+    a rate of 0 or less disables limiting."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = float(self.capacity)
+        self.updated_at = monotonic()
+        self._lock = asyncio.Lock()
+
+    def configure(self, rate: float, capacity: int) -> None:
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = min(self.tokens, self.capacity)
+
+    def _refill(self) -> None:
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+
+            self.tokens -= 1
+
+
+class AdaptiveLimiter:
+    """Request pacing shared by every session on one egress (a proxy or the direct connection).
+
+    AIMD: every successful response adds `increase / rate` (about `increase` requests per
+    second each second) up to `max_rate`. A 429 halves the rate down to `min_rate` and
+    pauses the whole egress for its Retry-After. 429s answering requests sent before
+    the pause don't halve it again.
+
+    Waiting requests are released lowest `priority` first rather than in arrival order.
+    Sessions pass the time their current step started, so steps that are under way
+    finish before new ones start instead of every session advancing a request at a time."""
+
+    def __init__(self, name: str, rate: float, min_rate: float, max_rate: float, increase: float):
+        self.name = name
+        self.min_rate = max(min_rate, 0.01)
+        self.max_rate = max(max_rate, self.min_rate)
+        self.rate = min(max(rate, self.min_rate), self.max_rate)
+        self.increase = increase
+        self.next_at = monotonic()
+        self.paused_until = 0.0
+        self.waiters: list[tuple[float, int, asyncio.Future]] = []
+        self.counter = itertools.count()
+        self.timer: asyncio.TimerHandle | None = None
+
+    def configure(self, min_rate: float, max_rate: float, increase: float) -> None:
+        """New bounds after a reload, the current rate is kept within them."""
+        self.min_rate = max(min_rate, 0.01)
+        self.max_rate = max(max_rate, self.min_rate)
+        self.rate = min(max(self.rate, self.min_rate), self.max_rate)
+        self.increase = increase
+        egress_rate.set(round(self.rate, 3), egress=self.name)
+
+    async def acquire(self, priority: float = 0) -> None:
+        now = monotonic()
+        if not self.waiters and now >= max(self.next_at, self.paused_until):
+            self.next_at = now + 1 / self.rate
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.counter), future))
+        self.schedule()
+        await future
+
+    def schedule(self) -> None:
+        if self.timer is not None or not self.waiters:
+            return
+
+        delay = max(self.next_at, self.paused_until) - monotonic()
+        self.timer = asyncio.get_running_loop().call_later(max(delay, 0), self.release)
+
+    def release(self) -> None:
+        self.timer = None
+
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                future.set_result(None)
+                self.next_at = monotonic() + 1 / self.rate
+                break
+
+        self.schedule()
+
+    def on_success(self) -> None:
+        self.rate = min(self.rate + self.increase / self.rate, self.max_rate)
+        egress_rate.set(round(self.rate, 3), egress=self.name)
+
+    def on_rate_limited(self, retry_after: float) -> None:
+        now = monotonic()
+        if now < self.paused_until:
+            return
+
+        self.rate = max(self.rate / 2, self.min_rate)
+        self.paused_until = now + retry_after
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+            self.schedule()
+
+        egress_rate.set(round(self.rate, 3), egress=self.name)
+        logger.warning(f"Egress <y>{self.name}</y> is rate limited, pausing its sessions for {retry_after:g}s "
+                       f"| {self.rate:.2f} req/s")
+
+
+# One per proxy URL, None for the direct connection
+egress_limiters: dict[str | None, AdaptiveLimiter] = {}
+# Worker processes that share a proxy, set by the supervisor; each gets its part of the rates
+egress_shares: dict[str | None, int] = {}
+
+
+def get_egress_limiter(proxy: str | None) -> AdaptiveLimiter | None:
+    """The shared limiter of `proxy`, None when EGRESS_INITIAL_RATE disables them."""
+    if settings.EGRESS_INITIAL_RATE <= 0:
+        return None
+
+    limiter = egress_limiters.get(proxy)
+    if limiter is None:
+        share = egress_shares.get(proxy, 1)
+        limiter = egress_limiters[proxy] = AdaptiveLimiter(
+            name=mask_proxy(proxy), rate=settings.EGRESS_INITIAL_RATE / share,
+            min_rate=settings.EGRESS_MIN_RATE / share, max_rate=settings.EGRESS_MAX_RATE / share,
+            increase=settings.EGRESS_RATE_INCREASE / share)
+    return limiter
+
+
+def configure_egress_limiters(settings: Settings) -> None:
+    for proxy, limiter in egress_limiters.items():
+        share = egress_shares.get(proxy, 1)
+        limiter.configure(min_rate=settings.EGRESS_MIN_RATE / share, max_rate=settings.EGRESS_MAX_RATE / share,
+                          increase=settings.EGRESS_RATE_INCREASE / share)
+
+
+settings_reloader.add_listener(configure_egress_limiters)
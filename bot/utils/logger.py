@@ -1,10 +1,75 @@
 import sys
+import json
 from loguru import logger
 
+from bot.config import settings
+
+
+LOG_FORMAT = ("<white>{time:YYYY-MM-DD HH:mm:ss}</white>"
+              " | <level>{level: <8}</level>"
+              " | <cyan><b>{line}</b></cyan>"
+              " - <white><b>{message}</b></white>")
+
+
+class LevelFilter:
+    """Minimum level per record: LOG_LEVEL for records without a session, otherwise the session's
+    entry in LOG_SESSION_LEVELS, falling back to LOG_SESSION_LEVEL.
+
+    Sessions default to WARNING while LOG_SUMMARY_INTERVAL is set, the summary replaces their
+    per-event lines."""
+
+    def __init__(self, level: str, session_level: str, session_levels: dict[str, str]):
+        self.level = logger.level(level.upper()).no
+        self.session_level = logger.level(session_level.upper()).no
+        self.session_levels = {session_name: logger.level(name.upper()).no
+                               for session_name, name in session_levels.items()}
+
+    @classmethod
+    def from_settings(cls) -> 'LevelFilter':
+        session_level = settings.LOG_SESSION_LEVEL or ('WARNING' if settings.LOG_SUMMARY_INTERVAL > 0
+                                                       else settings.LOG_LEVEL)
+        return cls(level=settings.LOG_LEVEL, session_level=session_level,
+                   session_levels=settings.LOG_SESSION_LEVELS)
+
+    def __call__(self, record: dict) -> bool:
+        session_name = record['extra'].get('session')
+        if session_name is None:
+            return record['level'].no >= self.level
+
+        return record['level'].no >= self.session_levels.get(session_name, self.session_level)
+
+
+def format_json(record: dict) -> str:
+    """One JSON object per line, with the session and GraphQL operation as separate fields."""
+    line = {
+        'time': record['time'].isoformat(),
+        'level': record['level'].name,
+        'session': record['extra'].get('session'),
+        'operation': record['extra'].get('operation'),
+        'message': record['message'],
+    }
+    if record['exception'] is not None:
+        line['exception'] = f"{record['exception'].type.__name__}: {record['exception'].value}"
+
+    record['extra']['json'] = json.dumps(line, ensure_ascii=False)
+    return '{extra[json]}\n'
+
+
+def add_sinks(sink=sys.stdout, format: str = LOG_FORMAT, colorize: bool | None = None,
+              json_file: str = '') -> None:
+    """Console sink plus the optional JSON lines file, both behind the per-session level filter.
+
+    With LOG_ENQUEUE the sinks are written from a background thread, so terminal and file I/O
+    don't block the event loop."""
+    level_filter = LevelFilter.from_settings()
+
+    logger.add(sink=sink, format=format, colorize=colorize, level=0, filter=level_filter,
+               enqueue=settings.LOG_ENQUEUE)
+    if json_file:
+        logger.add(sink=json_file, format=format_json, level=0, filter=level_filter,
+                   enqueue=settings.LOG_ENQUEUE)
+
 
 logger.remove()
-logger.add(sink=sys.stdout, format="<white>{time:YYYY-MM-DD HH:mm:ss}</white>"
-                                   " | <level>{level: <8}</level>"
-                                   " | <cyan><b>{line}</b></cyan>"
-                                   " - <white><b>{message}</b></white>")
+add_sinks(json_file=settings.LOG_JSON_FILE)
 logger = logger.opt(colors=True)
@@ -0,0 +1,138 @@
+from time import monotonic
+
+from aiohttp import web
+
+from bot.utils.logger import logger
+
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+
+# Reference point for time-to-first-tap, this module is imported with the logger at startup
+started_at = monotonic()
+
+
+def format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ''
+
+    values = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, values)) + '}'
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return f'{value:g}' if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.values: dict[tuple[tuple[str, str], ...], float] = {}
+        registry.append(self)
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        lines.extend(f'{self.name}{format_labels(labels)} {format_value(value)}'
+                     for labels, value in self.values.items())
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        self.values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name=name, documentation=documentation)
+        self.buckets = buckets
+        self.counts: dict[tuple[tuple[str, str], ...], list[int]] = {}
+        self.sums: dict[tuple[tuple[str, str], ...], float] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        counts = self.counts.setdefault(key, [0] * len(self.buckets))
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+        self.sums[key] = self.sums.get(key, 0) + value
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for labels, counts in self.counts.items():
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{format_labels(labels + (("le", format_value(bound)),))} {count}')
+            lines.append(f'{self.name}_sum{format_labels(labels)} {format_value(self.sums[labels])}')
+            lines.append(f'{self.name}_count{format_labels(labels)} {counts[-1]}')
+        return lines
+
+
+registry: list[Metric] = []
+
+requests_total = Counter('memefi_requests_total', 'GraphQL requests by operation and HTTP status')
+request_duration = Histogram('memefi_request_duration_seconds', 'GraphQL request latency by operation')
+rate_limited_total = Counter('memefi_rate_limited_total', 'Responses with status 429 by operation')
+backoff_seconds_total = Counter('memefi_backoff_seconds_total', 'Seconds spent sleeping after 429 responses')
+token_refreshes_total = Counter('memefi_token_refreshes_total', 'Telegram logins performed per session')
+taps_sent_total = Counter('memefi_taps_sent_total', 'Taps sent per session')
+coins_gained_total = Counter('memefi_coins_gained_total', 'Coins gained from taps per session')
+energy = Gauge('memefi_energy', 'Last known energy per session')
+balance = Gauge('memefi_balance', 'Last known coin balance per session')
+boss_level = Gauge('memefi_boss_level', 'Current boss level per session')
+session_info = Gauge('memefi_session_info', 'Proxy assigned to each session')
+time_to_first_tap = Histogram('memefi_time_to_first_tap_seconds', 'Seconds from startup to the first taps of a session',
+                              buckets=(1, 2.5, 5, 10, 30, 60, 120, 300, 600, float('inf')))
+
+
+def observe_request(session_name: str, operation: str, latency: float, status: int) -> None:
+    requests_total.inc(operation=operation, status=status)
+    request_duration.observe(latency, operation=operation)
+    if status == 429:
+        rate_limited_total.inc(operation=operation)
+
+
+def observe_first_tap(session_name: str) -> None:
+    seconds = monotonic() - started_at
+    if not time_to_first_tap.counts:
+        logger.info(f"⏱ First tap <c>{seconds:.2f}s</c> after startup | {session_name}")
+
+    time_to_first_tap.observe(seconds)
+
+
+def render() -> str:
+    return '\n'.join(line for metric in registry for line in metric.render()) + '\n'
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type='text/plain', charset='utf-8')
+
+
+async def start_metrics_server(host: str, port: int, routes: dict | None = None) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    for path, handler in (routes or {}).items():
+        app.router.add_get(path, handler)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+
+    logger.info(f"Metrics are available on <e>http://{host}:{port}/metrics</e>")
+
+    return runner
@@ -0,0 +1,131 @@
+import os
+import sys
+import signal
+import asyncio
+import logging
+import threading
+from time import monotonic, time, sleep
+
+from aiohttp import web
+
+from bot.utils.logger import logger
+from bot.utils import metrics
+
+
+loop_lag = metrics.Histogram('memefi_event_loop_lag_seconds', 'Event loop scheduling delay',
+                             buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 5, float('inf')))
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up a sleeping task and warns above `threshold`."""
+
+    def __init__(self, interval: float, threshold: float):
+        self.interval = interval
+        self.threshold = threshold
+
+    async def run(self) -> None:
+        while True:
+            started_at = monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(monotonic() - started_at - self.interval, 0)
+
+            loop_lag.observe(lag)
+            if lag >= self.threshold:
+                logger.warning(f"Event loop lag: <y>{lag:.3f}s</y>")
+
+
+class AsyncioLogHandler(logging.Handler):
+    """Forwards asyncio's slow callback reports to loguru."""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        logger.opt(colors=False).warning(f"asyncio | {record.getMessage()}")
+
+
+def enable_slow_callback_logging(loop: asyncio.AbstractEventLoop, duration: float) -> None:
+    loop.set_debug(True)
+    loop.slow_callback_duration = duration
+
+    asyncio_logger = logging.getLogger('asyncio')
+    asyncio_logger.setLevel(logging.WARNING)
+    asyncio_logger.addHandler(AsyncioLogHandler())
+
+
+class SamplingProfiler:
+    """Samples the event loop thread's stack from a background thread for a bounded window
+    and writes the collapsed stacks (flamegraph.pl / speedscope format) to `directory`."""
+
+    def __init__(self, directory: str, interval: float):
+        self.directory = directory
+        self.interval = interval
+        self.running = False
+
+    def start(self, seconds: float) -> bool:
+        if self.running:
+            return False
+
+        self.running = True
+        threading.Thread(target=self._sample, args=(threading.main_thread().ident, seconds),
+                         name='sampling-profiler', daemon=True).start()
+        logger.info(f"Profiling for {seconds:g}s...")
+        return True
+
+    def _sample(self, thread_id: int, seconds: float) -> None:
+        stacks: dict[str, int] = {}
+        ends_at = monotonic() + seconds
+
+        try:
+            while monotonic() < ends_at:
+                frame = sys._current_frames().get(thread_id)
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                    frame = frame.f_back
+
+                if frames:
+                    stack = ';'.join(reversed(frames))
+                    stacks[stack] = stacks.get(stack, 0) + 1
+
+                sleep(self.interval)
+
+            path = self.write(stacks)
+            logger.info(f"Profile written to <e>{path}</e>")
+        finally:
+            self.running = False
+
+    def write(self, stacks: dict[str, int]) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'profile-{int(time())}.txt')
+
+        with open(path, 'w') as file:
+            for stack, count in sorted(stacks.items(), key=lambda item: -item[1]):
+                file.write(f'{stack} {count}\n')
+
+        return path
+
+
+def make_profile_handler(profiler: SamplingProfiler, seconds: float):
+    """aiohttp handler for `GET /profile?seconds=N`."""
+    async def handle_profile(request: web.Request) -> web.Response:
+        try:
+            duration = min(float(request.query.get('seconds', seconds)), seconds * 10)
+        except ValueError:
+            return web.Response(status=400, text='seconds must be a number')
+
+        if not profiler.start(duration):
+            return web.Response(status=409, text='A profile is already running')
+
+        return web.Response(text=f'Profiling for {duration:g}s, the profile is written to {profiler.directory}')
+
+    return handle_profile
+
+
+def install_profile_signal(loop: asyncio.AbstractEventLoop, profiler: SamplingProfiler, seconds: float) -> None:
+    """Starts a profile on SIGUSR1 where the platform supports it."""
+    if not hasattr(signal, 'SIGUSR1'):
+        return
+
+    try:
+        loop.add_signal_handler(signal.SIGUSR1, profiler.start, seconds)
+    except (NotImplementedError, RuntimeError):
+        pass
@@ -0,0 +1,18 @@
+from yarl import URL
+
+
+def mask_proxy(proxy: str | None) -> str:
+    """`scheme://host:port` of a proxy URL, without credentials, for logs and metric labels.
+    `direct` without a proxy."""
+    if not proxy:
+        return 'direct'
+
+    try:
+        url = URL(proxy)
+    except ValueError:
+        url = None
+    if url is None or not url.host:
+        # Whatever comes before `@` may be a login and password
+        return proxy.rpartition('@')[2]
+
+    return f'{url.scheme}://{url.host}:{url.port}'
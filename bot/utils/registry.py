@@ -0,0 +1,161 @@
+import json
+import atexit
+import asyncio
+import sqlite3
+import threading
+
+from .logger import logger
+
+
+REGISTRY_FILE = 'session_registry.db'
+
+# JSON files used before the registry, imported into it once when it is created
+LEGACY_FILES = {
+    'user_agent': 'session_user_agents.json',
+    'access_token': 'session_tokens.json',
+}
+LEGACY_PEERS_FILE = 'session_peers.json'
+
+INDEXED_KEYS = ('user_agent', 'proxy')
+
+
+class SessionRegistry:
+    """Process-wide per-session metadata: user agent, proxy, access token, Telegram peers
+    and the last known game state.
+
+    Records are loaded from SQLite once, on first use, and served from memory. Changes
+    mark the session dirty and are written in a single transaction by `flush`, which
+    `run` calls periodically from a worker thread. `user_agent` and `proxy` are indexed
+    so lookups by value don't scan every session."""
+
+    def __init__(self, path: str = REGISTRY_FILE):
+        self.path = path
+        self._records: dict[str, dict] | None = None
+        self.index: dict[str, dict[str, set[str]]] = {key: {} for key in INDEXED_KEYS}
+        self.dirty: set[str] = set()
+        self.write_lock = threading.Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('CREATE TABLE IF NOT EXISTS sessions (name TEXT PRIMARY KEY, data TEXT NOT NULL)')
+        return connection
+
+    @property
+    def records(self) -> dict[str, dict]:
+        if self._records is None:
+            self._records = self.load()
+            for session_name, record in self._records.items():
+                self.add_to_index(session_name, record)
+            atexit.register(self.flush)
+
+        return self._records
+
+    def load(self) -> dict[str, dict]:
+        connection = self.connect()
+        try:
+            records = {name: json.loads(data) for name, data in connection.execute('SELECT name, data FROM sessions')}
+        finally:
+            connection.close()
+
+        if not records:
+            records = self.import_legacy_files()
+            self.dirty.update(records)
+
+        return records
+
+    @staticmethod
+    def import_legacy_files() -> dict[str, dict]:
+        records: dict[str, dict] = {}
+
+        for key, path in LEGACY_FILES.items():
+            for session_name, value in read_json(path).items():
+                records.setdefault(session_name, {})[key] = value
+
+        for session_name, peers in read_json(LEGACY_PEERS_FILE).items():
+            records.setdefault(session_name, {}).update(peers)
+
+        if records:
+            logger.info(f"Imported {len(records)} sessions into <e>{REGISTRY_FILE}</e>")
+
+        return records
+
+    def add_to_index(self, session_name: str, record: dict) -> None:
+        for key, index in self.index.items():
+            if record.get(key) is not None:
+                index.setdefault(record[key], set()).add(session_name)
+
+    def remove_from_index(self, session_name: str, record: dict) -> None:
+        for key, index in self.index.items():
+            if record.get(key) is not None:
+                index.get(record[key], set()).discard(session_name)
+
+    def get(self, session_name: str, key: str, default=None):
+        return self.records.get(session_name, {}).get(key, default)
+
+    def sessions_with(self, key: str, value) -> set[str]:
+        """Sessions whose indexed `key` equals `value`."""
+        return self.index[key].get(value, set())
+
+    def update(self, session_name: str, **values) -> None:
+        record = self.records.setdefault(session_name, {})
+        self.remove_from_index(session_name, record)
+        record.update(values)
+        self.add_to_index(session_name, record)
+        self.dirty.add(session_name)
+
+    def set(self, session_name: str, key: str, value) -> None:
+        self.update(session_name, **{key: value})
+
+    def delete(self, session_name: str, *keys: str) -> None:
+        record = self.records.get(session_name)
+        if not record or not any(key in record for key in keys):
+            return
+
+        self.remove_from_index(session_name, record)
+        for key in keys:
+            record.pop(key, None)
+        self.add_to_index(session_name, record)
+        self.dirty.add(session_name)
+
+    def snapshot(self) -> list[tuple[str, str]]:
+        """Serializes the dirty records. Must run on the thread that modifies the registry."""
+        if self._records is None:
+            return []
+
+        rows = [(session_name, json.dumps(self._records[session_name])) for session_name in self.dirty]
+        self.dirty.clear()
+        return rows
+
+    def write(self, rows: list[tuple[str, str]]) -> None:
+        if not rows:
+            return
+
+        with self.write_lock:
+            connection = self.connect()
+            try:
+                with connection:
+                    connection.executemany('INSERT OR REPLACE INTO sessions (name, data) VALUES (?, ?)', rows)
+            finally:
+                connection.close()
+
+    def flush(self) -> None:
+        self.write(self.snapshot())
+
+    async def run(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            rows = self.snapshot()
+            if rows:
+                await asyncio.to_thread(self.write, rows)
+
+
+def read_json(path: str) -> dict:
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+session_registry = SessionRegistry()
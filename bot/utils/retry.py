@@ -0,0 +1,164 @@
+import random
+from time import monotonic
+from dataclasses import dataclass
+
+from bot.config import settings
+from bot.config.config import Settings
+from bot.config.reloader import settings_reloader
+from bot.utils.logger import logger
+from bot.utils import metrics
+from bot.utils.graphql import OperationName
+
+
+# Mutations a retry could apply twice. They are only retried when the request
+# can't have reached the game: 429 responses and refused connections
+NON_IDEMPOTENT_OPERATIONS = frozenset({
+    OperationName.telegramGamePurchaseUpgrade,
+    OperationName.telegramGameActivateBooster,
+    OperationName.TapbotStart,
+    OperationName.TapbotClaim,
+    OperationName.Mutation,
+    OperationName.Spinner,
+})
+
+RETRY_BUDGET_CAPACITY = 50
+
+retries_total = metrics.Counter('memefi_retries_total', 'Retried GraphQL requests by operation')
+circuit_opened_total = metrics.Counter('memefi_circuit_opened_total', 'Times a circuit breaker opened by scope')
+
+
+def backoff(attempt: int, base: float, maximum: float) -> float:
+    """Exponential backoff with equal jitter: half of the delay is fixed and half random,
+    so sessions that failed together don't retry together."""
+    delay = min(base * 2 ** attempt, maximum)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def jitter(delay: float, spread: float = 0.2) -> float:
+    return delay * (1 + random.uniform(0, spread))
+
+
+@dataclass(slots=True, frozen=True)
+class RetryPolicy:
+    attempts: int
+    base_delay: float
+    max_delay: float
+    idempotent: bool = True
+
+    def delay(self, attempt: int) -> float:
+        return backoff(attempt, base=self.base_delay, maximum=self.max_delay)
+
+
+def get_retry_policy(operation: OperationName, settings: Settings = settings) -> RetryPolicy:
+    return RetryPolicy(attempts=max(settings.RETRY_ATTEMPTS, 1), base_delay=settings.RETRY_BASE_DELAY,
+                       max_delay=settings.RETRY_MAX_DELAY, idempotent=operation not in NON_IDEMPOTENT_OPERATIONS)
+
+
+class RetryBudget:
+    """Caps retries at a share of the requests: every request deposits `ratio` tokens
+    and every retry withdraws one, so an outage can't multiply the load by the
+    number of attempts."""
+
+    def __init__(self, ratio: float, capacity: float = RETRY_BUDGET_CAPACITY):
+        self.ratio = ratio
+        self.capacity = capacity
+        self.tokens = capacity
+
+    def deposit(self) -> None:
+        self.tokens = min(self.tokens + self.ratio, self.capacity)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+
+        self.tokens -= 1
+        return True
+
+
+# Shared by every session of the process, one per operation
+retry_budgets: dict[str, RetryBudget] = {}
+
+
+def get_retry_budget(operation: str) -> RetryBudget:
+    budget = retry_budgets.get(operation)
+    if budget is None:
+        budget = retry_budgets[operation] = RetryBudget(ratio=settings.RETRY_BUDGET_RATIO)
+    return budget
+
+
+class CircuitBreaker:
+    """Opens after `threshold` failures in a row and rejects calls for `reset_timeout`
+    seconds. After that calls go through again (half-open): a success closes the
+    circuit, a failure opens it again for twice as long, up to `max_timeout`."""
+
+    def __init__(self, name: str, scope: str, threshold: int, reset_timeout: float, max_timeout: float):
+        self.name = name
+        self.scope = scope
+        self.threshold = max(threshold, 1)
+        self.reset_timeout = reset_timeout
+        self.max_timeout = max_timeout
+        self.timeout = reset_timeout
+        self.failures = 0
+        self.opened_until: float | None = None
+
+    def configure(self, threshold: int, reset_timeout: float, max_timeout: float) -> None:
+        self.threshold = max(threshold, 1)
+        self.reset_timeout = reset_timeout
+        self.max_timeout = max_timeout
+        self.timeout = reset_timeout if self.opened_until is None else min(self.timeout, max_timeout)
+
+    def remaining(self) -> float:
+        """Seconds until calls are allowed again, 0 when they are."""
+        if self.opened_until is None:
+            return 0
+        return max(self.opened_until - monotonic(), 0)
+
+    def record_success(self) -> None:
+        if self.opened_until is not None:
+            logger.info(f"{self.name} | Circuit closed")
+
+        self.failures = 0
+        self.opened_until = None
+        self.timeout = self.reset_timeout
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        half_open = self.opened_until is not None
+        if not half_open and self.failures < self.threshold:
+            return
+        if half_open and self.remaining() > 0:
+            # A request that was sent before the circuit opened
+            return
+
+        if half_open:
+            self.timeout = min(self.timeout * 2, self.max_timeout)
+        self.opened_until = monotonic() + jitter(self.timeout)
+
+        circuit_opened_total.inc(scope=self.scope)
+        logger.warning(f"{self.name} | Circuit open after {self.failures} failures in a row, "
+                       f"pausing requests for {self.timeout:g}s")
+
+
+# Shared by every session of the process, one per GraphQL endpoint
+endpoint_breakers: dict[str, CircuitBreaker] = {}
+
+
+def get_endpoint_breaker(url: str) -> CircuitBreaker:
+    breaker = endpoint_breakers.get(url)
+    if breaker is None:
+        breaker = endpoint_breakers[url] = CircuitBreaker(
+            name=url, scope='endpoint', threshold=settings.ENDPOINT_BREAKER_THRESHOLD,
+            reset_timeout=settings.BREAKER_RESET_TIMEOUT, max_timeout=settings.BREAKER_MAX_TIMEOUT)
+    return breaker
+
+
+def configure_shared_retries(settings: Settings) -> None:
+    """Applies reloaded settings to the retry budgets and endpoint breakers."""
+    for budget in retry_budgets.values():
+        budget.ratio = settings.RETRY_BUDGET_RATIO
+    for breaker in endpoint_breakers.values():
+        breaker.configure(threshold=settings.ENDPOINT_BREAKER_THRESHOLD, reset_timeout=settings.BREAKER_RESET_TIMEOUT,
+                          max_timeout=settings.BREAKER_MAX_TIMEOUT)
+
+
+settings_reloader.add_listener(configure_shared_retries)
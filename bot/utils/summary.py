@@ -0,0 +1,44 @@
+import asyncio
+
+from bot.utils.logger import logger
+from bot.utils import metrics
+
+
+def per_session(counter: metrics.Counter) -> dict[str, float]:
+    return {dict(labels).get('session'): value for labels, value in counter.values.items()}
+
+
+class LogSummary:
+    """Logs one aggregated line every `interval` seconds from the metrics counters instead of
+    a line per tap and sleep of every session."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.previous = self.collect()
+
+    @staticmethod
+    def collect() -> dict:
+        return {
+            'taps': per_session(metrics.taps_sent_total),
+            'coins': sum(metrics.coins_gained_total.values.values()),
+            'requests': sum(metrics.requests_total.values.values()),
+            'rate_limited': sum(metrics.rate_limited_total.values.values()),
+        }
+
+    def summarize(self) -> str:
+        current = self.collect()
+        previous, self.previous = self.previous, current
+
+        tapped = sum(1 for session_name, taps in current['taps'].items()
+                     if taps > previous['taps'].get(session_name, 0))
+        taps = sum(current['taps'].values()) - sum(previous['taps'].values())
+
+        return (f"📊 <m>{tapped}</m> sessions tapped | +<c>{current['coins'] - previous['coins']:,.0f}</c> coins | "
+                f"{taps:,.0f} taps | {current['requests'] - previous['requests']:,.0f} requests "
+                f"({current['rate_limited'] - previous['rate_limited']:,.0f} rate limited) "
+                f"in the last {self.interval:g}s")
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            logger.info(self.summarize())
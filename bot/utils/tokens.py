@@ -0,0 +1,43 @@
+import json
+import base64
+from time import time
+
+from .registry import SessionRegistry, session_registry
+
+
+def get_token_expiry(access_token: str) -> float:
+    """Returns the `exp` claim of a JWT or 0 if it can't be read."""
+    try:
+        payload = access_token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))['exp'])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return 0
+
+
+class TokenStore:
+    """Access tokens persisted per session so restarts don't force a Telegram login."""
+
+    def __init__(self, registry: SessionRegistry):
+        self.registry = registry
+
+    def get(self, session_name: str, margin: float = 0) -> tuple[str, float] | None:
+        """Returns the cached token and its expiry if it's valid for at least `margin` seconds."""
+        access_token = self.registry.get(session_name, 'access_token')
+        if not access_token:
+            return None
+
+        expires_at = get_token_expiry(access_token)
+        if expires_at - time() <= margin:
+            return None
+
+        return access_token, expires_at
+
+    def set(self, session_name: str, access_token: str) -> None:
+        self.registry.set(session_name, 'access_token', access_token)
+
+    def delete(self, session_name: str) -> None:
+        self.registry.delete(session_name, 'access_token')
+
+
+token_store = TokenStore(registry=session_registry)
@@ -0,0 +1,196 @@
+import os
+import sys
+import math
+import asyncio
+import threading
+import multiprocessing
+from contextlib import suppress
+
+import aiohttp
+from aiohttp import web
+
+from bot.config import settings
+from bot.utils.logger import logger, LOG_FORMAT, add_sinks
+from bot.utils import limiter
+from bot.utils.fast import install_uvloop
+
+
+def shard_assignments(assignments: dict[str, str | None], workers: int) -> list[dict[str, str | None]]:
+    """Splits the session -> proxy assignments into at most `workers` shards.
+
+    Sessions sharing a proxy stay in one shard, so a single limiter paces each egress.
+    Proxies with more sessions than a shard holds, like the direct connection without
+    proxies, are split over as few shards as fit them."""
+    groups: dict[str | None, list[str]] = {}
+    for session_name, proxy in assignments.items():
+        groups.setdefault(proxy, []).append(session_name)
+
+    size = math.ceil(len(assignments) / workers) if assignments else 0
+    shards: list[dict[str, str | None]] = [{} for _ in range(workers)]
+    for proxy, session_names in sorted(groups.items(), key=lambda item: -len(item[1])):
+        parts = math.ceil(len(session_names) / size)
+        targets = sorted(range(workers), key=lambda index: len(shards[index]))[:parts]
+        for offset, index in enumerate(targets):
+            shards[index].update((session_name, proxy) for session_name in session_names[offset::parts])
+
+    return [shard for shard in shards if shard]
+
+
+def get_egress_shares(shards: list[dict[str, str | None]]) -> dict[str | None, int]:
+    """How many shards each proxy is split across."""
+    shares: dict[str | None, int] = {}
+    for shard in shards:
+        for proxy in set(shard.values()):
+            shares[proxy] = shares.get(proxy, 0) + 1
+    return shares
+
+
+def add_worker_label(line: str, index: int) -> str:
+    if not line or line.startswith('#'):
+        return line
+
+    name, _, value = line.rpartition(' ')
+    if name.endswith('}'):
+        return f'{name[:-1]},worker="{index}"}} {value}'
+
+    return f'{name}{{worker="{index}"}} {value}'
+
+
+def aggregate_metrics(texts: list[str | None]) -> str:
+    """Merges the /metrics output of every worker, adding a `worker` label to each sample."""
+    lines = []
+    seen = set()
+    for index, text in enumerate(texts):
+        for line in (text or '').splitlines():
+            if line.startswith('#'):
+                if line in seen:
+                    continue
+                seen.add(line)
+            lines.append(add_worker_label(line, index))
+
+    return '\n'.join(lines) + '\n'
+
+
+def worker_json_file(path: str, index: int) -> str:
+    """Each worker writes its own JSON log, `logs.jsonl` becomes `logs.w0.jsonl`."""
+    if not path:
+        return ''
+
+    root, extension = os.path.splitext(path)
+    return f'{root}.w{index}{extension}'
+
+
+def run_worker(index: int, assignments: dict[str, str | None], egress_shares: dict[str | None, int], log_queue,
+               metrics_port: int, colorize: bool) -> None:
+    """Entry point of a worker process: runs its shard of sessions on its own event loop."""
+    logger.remove()
+    add_sinks(sink=log_queue.put, format=f"<white>[w{index}]</white> {LOG_FORMAT}", colorize=colorize,
+              json_file=worker_json_file(settings.LOG_JSON_FILE, index))
+    settings.METRICS_PORT = metrics_port
+    # Proxies split across workers share their rate between them
+    limiter.egress_shares.update(egress_shares)
+    if settings.FAST_MODE:
+        install_uvloop()
+
+    with suppress(KeyboardInterrupt):
+        asyncio.run(_run_worker(assignments))
+
+
+async def _run_worker(assignments: dict[str, str | None]) -> None:
+    from bot.utils.launcher import get_tg_clients, run_tasks
+
+    tg_clients = get_tg_clients(session_names=list(assignments))
+    await run_tasks(tg_clients=tg_clients, proxies=assignments)
+
+
+class Supervisor:
+    """Runs sessions in several worker processes, forwards their logs, merges their
+    metrics and restarts workers that exit unexpectedly."""
+
+    def __init__(self, assignments: dict[str, str | None], workers: int, restart_delay: float = 10):
+        self.shards = shard_assignments(assignments, workers)
+        self.egress_shares = get_egress_shares(self.shards)
+        self.restart_delay = restart_delay
+        self.context = multiprocessing.get_context('spawn')
+        self.log_queue = self.context.Queue()
+        self.processes: list[multiprocessing.Process | None] = [None] * len(self.shards)
+
+    def worker_metrics_port(self, index: int) -> int:
+        return settings.METRICS_PORT + index + 1
+
+    def start_worker(self, index: int) -> None:
+        process = self.context.Process(target=run_worker, name=f'worker-{index}',
+                                       args=(index, self.shards[index], self.egress_shares, self.log_queue,
+                                             self.worker_metrics_port(index), sys.stdout.isatty()))
+        process.start()
+        self.processes[index] = process
+
+        logger.info(f"Worker <m>{index}</m> started with {len(self.shards[index])} sessions | pid {process.pid}")
+
+    def forward_logs(self) -> None:
+        while True:
+            try:
+                message = self.log_queue.get()
+            except (EOFError, OSError):
+                break
+
+            if message is None:
+                break
+            sys.stdout.write(message)
+            sys.stdout.flush()
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        async def fetch(index: int) -> str | None:
+            try:
+                async with session.get(f'http://127.0.0.1:{self.worker_metrics_port(index)}/metrics') as response:
+                    return await response.text()
+            except aiohttp.ClientError:
+                return None
+
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
+            texts = await asyncio.gather(*(fetch(index) for index in range(len(self.shards))))
+
+        return web.Response(text=aggregate_metrics(list(texts)), content_type='text/plain', charset='utf-8')
+
+    async def run(self) -> None:
+        threading.Thread(target=self.forward_logs, name='log-forwarder', daemon=True).start()
+
+        metrics_runner = None
+        if settings.METRICS_ENABLED:
+            app = web.Application()
+            app.router.add_get('/metrics', self.handle_metrics)
+            metrics_runner = web.AppRunner(app)
+            await metrics_runner.setup()
+            await web.TCPSite(metrics_runner, host=settings.METRICS_HOST, port=settings.METRICS_PORT).start()
+
+        for index in range(len(self.shards)):
+            self.start_worker(index)
+
+        try:
+            while True:
+                await asyncio.sleep(self.restart_delay)
+
+                for index, process in enumerate(self.processes):
+                    if process is None or process.is_alive():
+                        continue
+
+                    if process.exitcode == 0:
+                        logger.info(f"Worker <m>{index}</m> finished")
+                        self.processes[index] = None
+                    else:
+                        logger.warning(f"Worker <m>{index}</m> exited with code {process.exitcode}, restarting")
+                        self.start_worker(index)
+
+                if not any(self.processes):
+                    break
+        finally:
+            for process in self.processes:
+                if process is not None and process.is_alive():
+                    process.terminate()
+            for process in self.processes:
+                if process is not None:
+                    process.join(timeout=5)
+
+            self.log_queue.put(None)
+            if metrics_runner is not None:
+                await metrics_runner.cleanup()
@@ -2,6 +2,8 @@ import asyncio
 from contextlib import suppress
 import sys
 
+from bot.config import settings
+from bot.utils.fast import install_uvloop
 from bot.utils.launcher import process
 
 
@@ -13,5 +15,8 @@ async def main():
 
 
 if __name__ == '__main__':
+    if settings.FAST_MODE:
+        install_uvloop()
+
     with suppress(KeyboardInterrupt):
         asyncio.run(main())